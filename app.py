@@ -1,11 +1,47 @@
-from flask import Flask , request,render_template
+from flask import Flask
 
+# Application factory.
+# Importing the app, the models or the controllers has no side effects:
+# create_app() loads the config, binds the database and registers the
+# blueprints, hooks and CLI commands, without touching the database. The
+# schema and the admin account are created by `flask init-db` (run it once
+# per deployment, not per worker); `flask migrate` upgrades an existing one.
+# The blueprint modules are imported here rather than at the top, so the CLI
+# and the workers only load the views when an app is actually built.
 
-app = Flask(__name__)
 
-from controllers import config
-from models import models
-from controllers import routes
+def create_app(config=None):
+    app = Flask(__name__)
+
+    from controllers.config import load_config
+    load_config(app, config)
+
+    from models.models import db
+    from models.engine import install_sqlite_pragmas
+    db.init_app(app)
+    with app.app_context():
+        install_sqlite_pragmas(db.engine, app.config)
+
+    from controllers.cache import view_cache
+    view_cache.init_app(app)
+
+    from controllers import instrumentation
+    instrumentation.init_app(app)
+
+    from controllers.routes import main
+    from controllers.api import api
+    from controllers.commands import commands
+    app.register_blueprint(main)
+    app.register_blueprint(api)
+    app.register_blueprint(commands)
+    return app
+
+
+def create_asgi_app(config=None):
+    # uvicorn --factory app:create_asgi_app (see controllers/asgi.py)
+    from controllers.asgi import AsyncApp
+    return AsyncApp(create_app(config))
+
 
 if __name__ == "__main__":
-    app.run(host='0.0.0.0')
+    create_app().run(host='0.0.0.0')
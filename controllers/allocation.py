@@ -0,0 +1,205 @@
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta
+from flask import current_app
+from models.models import db, ParkingLot, ParkingSpot, Bookedspot, Reservation
+from controllers.occupancy import adjust_lot_counters, spot_released
+from controllers.spot_pool import free_spot_pool
+from controllers.rollups import booking_opened, booking_released
+from controllers.cache import lot_changed
+from controllers.live import occupancy_changed
+from controllers.vehicles import normalize_vehicle_number, vehicle_parked
+from controllers.billing import stay_cost
+from controllers.reservations import (RESERVED, reservation_index, hold_time, overlapping, mark_checked_in,
+                                      complete_reservations)
+
+# Spot allocation engine.
+# A spot is claimed with a single conditional UPDATE (compare-and-set on
+# occupied_status), so two concurrent requests can never both win the same
+# spot. The partial unique indexes on open bookings per user and per spot
+# are the last line of defence if two claims still race. A claim also
+# refuses a spot that is reserved before the vehicle is assumed to leave
+# (see controllers/reservations.py), and checking in a reservation goes
+# through the same claim and booking steps.
+
+AUTO_ALLOCATE_RETRIES = 5
+
+
+class BookingError(Exception):
+    pass
+
+
+def _claim(spot_id, until, reservation_id=None):
+    # until: how long the spot is taken for; reservation_id: the reservation being checked in
+    result = db.session.execute(
+        update(ParkingSpot)
+        .where(ParkingSpot.id == spot_id,
+               ParkingSpot.occupied_status == False,
+               ParkingSpot.deleted_spot == True,
+               ~overlapping(spot_id, datetime.now(), until, reservation_id))
+        .values(occupied_status=True)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def _open_booking(user_id, spot_id, lot_id, vehicle_number, reservation_id=None):
+    adjust_lot_counters(lot_id, occupied=1, free=-1)
+    entry_timing = datetime.now()
+    booking_opened(lot_id, user_id, entry_timing)
+    booking = Bookedspot(user_id=user_id, spot_id=spot_id, vehicle_number=vehicle_number, entry_timing=entry_timing)
+    db.session.add(booking)
+    try:
+        if reservation_id is not None:
+            db.session.flush()
+            if not mark_checked_in(reservation_id, booking.id, spot_id):
+                db.session.rollback()
+                raise BookingError("This reservation is no longer active.")
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        raise BookingError("You or this vehicle already have an active booking.")
+    return booking
+
+
+def has_open_booking(user_id):
+    return db.session.query(
+        Bookedspot.query.filter_by(user_id=user_id, vehicle_released=False).exists()
+    ).scalar()
+
+
+def _check_can_book(user_id, vehicle_number):
+    # returns the normalised plate
+    if has_open_booking(user_id):
+        raise BookingError("You already have an active booking.")
+    plate = normalize_vehicle_number(vehicle_number)
+    if not plate:
+        raise BookingError("Please enter the vehicle number.")
+    if vehicle_parked(plate):
+        raise BookingError(f"Vehicle {plate} is already parked.")
+    return plate
+
+
+def claim_spot(user_id, spot_id, vehicle_number):
+    vehicle_number = _check_can_book(user_id, vehicle_number)
+
+    if not _claim(spot_id, datetime.now() + hold_time()):
+        db.session.rollback()
+        spot = ParkingSpot.query.get(spot_id)
+        if spot is None:
+            raise BookingError("Spot not available.")
+        if not spot.deleted_spot:
+            raise BookingError("cant book a deactive spot")
+        if not spot.occupied_status:
+            raise BookingError("Spot is reserved, please pick another one.")
+        raise BookingError("Spot is occupied.")
+
+    lot_id = db.session.query(ParkingSpot.lot_id).filter(ParkingSpot.id == spot_id).scalar()
+    booking = _open_booking(user_id, spot_id, lot_id, vehicle_number)
+    free_spot_pool.discard(lot_id, spot_id)
+    lot_changed(lot_id)
+    occupancy_changed(lot_id, [spot_id])
+    return booking
+
+
+def _claim_first_free(user_id, lot_id, vehicle_number, until, reservation_id=None):
+    # the candidate comes from the in-memory pool, passing over the spots
+    # reserved before until; if another request (or another worker) took it
+    # first the claim fails and we try the next one
+    now = datetime.now()
+    reserved = reservation_index.held(lot_id, now, until)
+    reloaded = False
+    for _ in range(AUTO_ALLOCATE_RETRIES):
+        candidate = free_spot_pool.next_free(lot_id, reserved)
+        if candidate is None:
+            # spots freed through another worker are not in our pool yet
+            if reloaded:
+                raise BookingError("No free spots left in this lot.")
+            free_spot_pool.warm(lot_id)
+            reloaded = True
+            continue
+        spot_id = candidate[0]
+        if _claim(spot_id, until, reservation_id):
+            booking = _open_booking(user_id, spot_id, lot_id, vehicle_number, reservation_id)
+            free_spot_pool.discard(lot_id, spot_id)
+            lot_changed(lot_id)
+            occupancy_changed(lot_id, [spot_id])
+            return booking
+        db.session.rollback()
+        # reserved through another worker, or taken: only a taken spot leaves the pool
+        reservation_index.drop(lot_id)
+        reserved = reservation_index.held(lot_id, now, until)
+        if spot_id not in reserved:
+            free_spot_pool.discard(lot_id, spot_id)
+    raise BookingError("The lot is busy, please try again.")
+
+
+def claim_first_free_spot(user_id, lot_id, vehicle_number):
+    vehicle_number = _check_can_book(user_id, vehicle_number)
+    return _claim_first_free(user_id, lot_id, vehicle_number, datetime.now() + hold_time())
+
+
+def check_in(user_id, reservation_id):
+    # books the reserved spot, or if it is still taken (an overstay) or was
+    # deactivated, the first free spot that nobody has reserved until the
+    # reservation ends
+    reservation = Reservation.query.filter_by(id=reservation_id, user_id=user_id, status=RESERVED).first()
+    if reservation is None:
+        raise BookingError("No such active reservation.")
+    now = datetime.now()
+    config = current_app.config
+    opens = reservation.start_time - timedelta(minutes=config['RESERVATION_EARLY_MINUTES'])
+    if now < opens:
+        raise BookingError(f"Check-in opens at {opens:%d %b %H:%M}.")
+    if now >= min(reservation.end_time,
+                  reservation.start_time + timedelta(minutes=config['RESERVATION_GRACE_MINUTES'])):
+        raise BookingError("This reservation has expired.")
+    vehicle_number = _check_can_book(user_id, reservation.vehicle_number)
+
+    # the spot is taken until the reservation ends (not for the hold time,
+    # which would clash with a reservation right after this one)
+    lot_id, spot_id = reservation.lot_id, reservation.spot_id
+    start, end = reservation.start_time, reservation.end_time
+    if _claim(spot_id, end, reservation_id):
+        booking = _open_booking(user_id, spot_id, lot_id, vehicle_number, reservation_id)
+        free_spot_pool.discard(lot_id, spot_id)
+        lot_changed(lot_id)
+        occupancy_changed(lot_id, [spot_id])
+    else:
+        db.session.rollback()
+        booking = _claim_first_free(user_id, lot_id, vehicle_number, end, reservation_id)
+        reservation_index.remove(lot_id, spot_id, reservation_id)
+        reservation_index.add(lot_id, booking.spot_id, start, end, reservation_id)
+    return booking
+
+
+def release_booking(booking_id):
+    # flipping vehicle_released is the compare-and-set here, so a booking
+    # can only be released (and billed) once
+    exit_time = datetime.now()
+    result = db.session.execute(
+        update(Bookedspot)
+        .where(Bookedspot.id == booking_id, Bookedspot.vehicle_released == False)
+        .values(vehicle_released=True, exit_timing=exit_time)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        db.session.rollback()
+        raise BookingError("Invalid or already released spot.")
+
+    booking = Bookedspot.query.populate_existing().get(booking_id)
+    spot = ParkingSpot.query.get(booking.spot_id)
+    lot = ParkingLot.query.get(spot.lot_id)
+
+    spot.occupied_status = False
+    spot_released(spot)
+
+    booking.parking_cost = stay_cost(lot, booking.entry_timing, booking.exit_timing)
+    booking_released(lot.id, booking.user_id, booking.entry_timing, booking.parking_cost)
+    completed = complete_reservations([booking.id])
+    db.session.commit()
+    reservation_index.forget(completed)
+    free_spot_pool.spot_changed(spot)
+    lot_changed(spot.lot_id)
+    occupancy_changed(spot.lot_id, [spot.id])
+    return booking
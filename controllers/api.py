@@ -0,0 +1,363 @@
+import hashlib
+from datetime import timezone
+from flask import Blueprint, current_app, request, session, jsonify
+from functools import wraps
+from werkzeug.security import check_password_hash
+from models.models import User, Bookedspot
+from controllers.allocation import BookingError, claim_spot, claim_first_free_spot, release_booking, check_in
+from controllers.bookings import history_page, page_size
+from controllers.cache import lot_summaries, lot_summary, spot_grid
+from controllers.current_user import remember_user, forget_user, is_admin
+from controllers.gate import GateError, process_gate_events
+from controllers.geo import GeoError, parse_search, search_lots
+from controllers.reservations import (ReservationError, parse_window, reserve, cancel_reservation,
+                                      upcoming_reservations, free_spot_count)
+from controllers.vehicles import active_parking, search_active_parkings, parking_json
+
+# Versioned JSON API for kiosks and mobile clients.
+# It is built on the same services as the HTML views (lot cache, spot grid
+# cache, allocation engine, history pages) and uses the same session cookie.
+# Lot and spot responses carry an ETag and Last-Modified taken from the
+# lot's occupancy_version, so an unchanged poll is answered with 304 from
+# the cache without building or sending a body.
+
+API_PREFIX = '/api/v1'
+
+api = Blueprint('api', __name__)
+
+
+def api_error(message, status):
+    return jsonify({'error': message}), status
+
+
+def api_auth_required(func):
+    @wraps(func)
+    def inner(*args, **kwargs):
+        if 'user_id' not in session:
+            return api_error("Login required.", 401)
+        return func(*args, **kwargs)
+    return inner
+
+
+def api_admin_required(func):
+    @wraps(func)
+    def inner(*args, **kwargs):
+        if 'user_id' not in session:
+            return api_error("Login required.", 401)
+        if not is_admin():
+            return api_error("You are not an admin.", 403)
+        return func(*args, **kwargs)
+    return inner
+
+
+def _http_time(value):
+    # occupancy timestamps are naive local times
+    return value.astimezone(timezone.utc) if value is not None else None
+
+
+def conditional(etag, last_modified, build):
+    # build() is only called when the client's copy is out of date
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    response.last_modified = _http_time(last_modified)
+    if response.status_code == 200:
+        # answers If-Modified-Since polls
+        response = response.make_conditional(request)
+    return response
+
+
+def int_field(data, key):
+    try:
+        return int(data[key]) if data.get(key) not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+
+def lot_json(lot):
+    return {
+        'id': lot['id'],
+        'name': lot['lot_name'],
+        'city': lot['city'],
+        'pin_code': lot['pin_code'],
+        'price': lot['price'],
+        'total': lot['total_spots'],
+        'available': lot['available_parking_spots'],
+        'occupied': lot['occupied_spots_count'],
+        'latitude': lot['latitude'],
+        'longitude': lot['longitude'],
+        'version': lot['version']
+    }
+
+
+def spot_state(spot):
+    # same letters as the spot grid pages: Occupied, Deactivated, Available
+    if spot['occupied_status']:
+        return 'O'
+    if not spot['deleted_spot']:
+        return 'D'
+    return 'A'
+
+
+def booking_json(booking):
+    return {
+        'id': booking.id,
+        'lot_id': booking.parking_spot.lot_id,
+        'spot_id': booking.spot_id,
+        'spot_number': booking.parking_spot.spot_number,
+        'vehicle_number': booking.vehicle_number,
+        'entry': booking.entry_timing.isoformat(),
+        'exit': booking.exit_timing.isoformat() if booking.exit_timing else None,
+        'cost': booking.parking_cost,
+        'released': booking.vehicle_released
+    }
+
+
+@api.route(f'{API_PREFIX}/login', methods=["POST"])
+def api_login():
+    data = request.get_json(silent=True) or request.form
+    username = data.get('username')
+    password = data.get('password')
+    if not username or not password:
+        return api_error("Username and password are required.", 400)
+
+    user = User.query.filter_by(username=username).first()
+    if not user or not check_password_hash(user.passhash, password):
+        return api_error("Invalid username or password.", 401)
+    if not user.is_active_user:
+        return api_error("You are Blocked.", 403)
+
+    remember_user(user)
+    return jsonify({'id': user.id, 'username': user.username, 'name': user.name, 'is_admin': user.is_admin})
+
+
+@api.route(f'{API_PREFIX}/logout', methods=["POST"])
+def api_logout():
+    forget_user()
+    return '', 204
+
+
+# the lot and spot responses, shared with the async views in controllers/asgi.py
+
+def lots_response(lots):
+    versions = ','.join(f"{lot['id']}:{lot['version']}" for lot in lots)
+    etag = 'lots-' + hashlib.sha1(versions.encode()).hexdigest()[:16]
+    last_modified = max((lot['updated_at'] for lot in lots if lot['updated_at']), default=None)
+    return conditional(etag, last_modified, lambda: {'lots': [lot_json(lot) for lot in lots]})
+
+
+def lot_spots_response(lot, load_grid):
+    def build():
+        spots = [{'id': spot['id'], 'number': spot['spot_number'], 'state': spot_state(spot)}
+                 for spot in load_grid()]
+        return {'lot': lot_json(lot), 'spots': spots}
+
+    return conditional(f"lot-{lot['id']}-v{lot['version']}", lot['updated_at'], build)
+
+
+@api.route(f'{API_PREFIX}/lots')
+@api_auth_required
+def api_lots():
+    return lots_response(lot_summaries())
+
+
+@api.route(f'{API_PREFIX}/lots/search')
+@api_auth_required
+def api_lot_search():
+    # ?city=&pin=&lat=&lon=&available=1&radius_km=&limit= (see controllers/geo.py)
+    try:
+        search = parse_search(request.args)
+    except GeoError as error:
+        return api_error(str(error), 400)
+    lots = search_lots(**search)
+    results = []
+    for lot in lots:
+        result = lot_json(lot)
+        if 'distance_km' in lot:
+            result['distance_km'] = lot['distance_km']
+        results.append(result)
+    return jsonify({'lots': results})
+
+
+@api.route(f'{API_PREFIX}/lots/<int:lot_id>/spots')
+@api_auth_required
+def api_lot_spots(lot_id):
+    lot = lot_summary(lot_id)
+    if lot is None:
+        return api_error("Parking lot not found.", 404)
+    return lot_spots_response(lot, lambda: spot_grid(lot_id))
+
+
+@api.route(f'{API_PREFIX}/bookings', methods=["POST"])
+@api_auth_required
+def api_book():
+    data = request.get_json(silent=True) or request.form
+    vehicle_number = data.get('vehicle_number')
+    spot_id = int_field(data, 'spot_id')
+    lot_id = int_field(data, 'lot_id')
+    if not vehicle_number:
+        return api_error("Please enter the vehicle number.", 400)
+    if spot_id is None and lot_id is None:
+        return api_error("Give a spot_id, or a lot_id to get its first free spot.", 400)
+    if spot_id is None and lot_summary(lot_id) is None:
+        return api_error("Parking lot not found.", 404)
+
+    try:
+        if spot_id is not None:
+            booking = claim_spot(session['user_id'], spot_id, vehicle_number)
+        else:
+            booking = claim_first_free_spot(session['user_id'], lot_id, vehicle_number)
+    except BookingError as error:
+        return api_error(str(error), 409)
+    return jsonify(booking_json(booking)), 201
+
+
+@api.route(f'{API_PREFIX}/bookings/<int:book_id>/release', methods=["POST"])
+@api_auth_required
+def api_release(book_id):
+    booking = Bookedspot.query.filter_by(id=book_id, user_id=session['user_id']).first()
+    if booking is None:
+        return api_error("Booking not found.", 404)
+    try:
+        booking = release_booking(book_id)
+    except BookingError as error:
+        return api_error(str(error), 409)
+    return jsonify(booking_json(booking))
+
+
+@api.route(f'{API_PREFIX}/bookings')
+@api_auth_required
+def api_bookings():
+    # the open booking plus one page of released ones (newest first)
+    user_id = session['user_id']
+    size = page_size(request.args.get('size'))
+    open_booking = Bookedspot.query.filter_by(user_id=user_id, vehicle_released=False).first()
+    history, next_cursor = history_page(user_id, request.args.get('cursor'), size)
+
+    response = jsonify({
+        'open': booking_json(open_booking) if open_booking else None,
+        'history': [{
+            'id': row['bookedspot_id'],
+            'lot_name': row['location_name'],
+            'city': row['address'],
+            'vehicle_number': row['vehicle'],
+            'entry': row['entry'].isoformat(),
+            'exit': row['exit'].isoformat(),
+            'cost': row['cost']
+        } for row in history],
+        'next_cursor': next_cursor
+    })
+    # no version to key on here, so the ETag is a hash of the body
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+def reservation_json(reservation):
+    # a row of controllers.reservations.upcoming_reservations()
+    return {
+        'id': reservation.id,
+        'lot_id': reservation.lot_id,
+        'spot_number': reservation.spot_number,
+        'vehicle_number': reservation.vehicle_number,
+        'start': reservation.start_time.isoformat(),
+        'end': reservation.end_time.isoformat()
+    }
+
+
+# free spots of a lot for ?start=&end= (ISO 8601)
+@api.route(f'{API_PREFIX}/lots/<int:lot_id>/availability')
+@api_auth_required
+def api_lot_availability(lot_id):
+    if lot_summary(lot_id) is None:
+        return api_error("Parking lot not found.", 404)
+    try:
+        start, end = parse_window(request.args.get('start'), request.args.get('end'))
+    except ReservationError as error:
+        return api_error(str(error), 400)
+    return jsonify({'lot_id': lot_id, 'start': start.isoformat(), 'end': end.isoformat(),
+                    'free_spots': free_spot_count(lot_id, start, end)})
+
+
+@api.route(f'{API_PREFIX}/reservations')
+@api_auth_required
+def api_reservations():
+    return jsonify({'reservations': [reservation_json(row) for row in upcoming_reservations(session['user_id'])]})
+
+
+@api.route(f'{API_PREFIX}/reservations', methods=["POST"])
+@api_auth_required
+def api_reserve():
+    data = request.get_json(silent=True) or request.form
+    lot_id = int_field(data, 'lot_id')
+    if not data.get('vehicle_number'):
+        return api_error("Please enter the vehicle number.", 400)
+    if lot_id is None or lot_summary(lot_id) is None:
+        return api_error("Parking lot not found.", 404)
+    try:
+        start, end = parse_window(data.get('start'), data.get('end'))
+    except ReservationError as error:
+        return api_error(str(error), 400)
+
+    try:
+        reservation = reserve(session['user_id'], lot_id, data['vehicle_number'], start, end)
+    except ReservationError as error:
+        return api_error(str(error), 409)
+    return jsonify(reservation_json(reservation)), 201
+
+
+@api.route(f'{API_PREFIX}/reservations/<int:reservation_id>/check_in', methods=["POST"])
+@api_auth_required
+def api_check_in(reservation_id):
+    try:
+        booking = check_in(session['user_id'], reservation_id)
+    except BookingError as error:
+        return api_error(str(error), 409)
+    return jsonify(booking_json(booking)), 201
+
+
+@api.route(f'{API_PREFIX}/reservations/<int:reservation_id>/cancel', methods=["POST"])
+@api_auth_required
+def api_cancel_reservation(reservation_id):
+    try:
+        cancel_reservation(reservation_id, session['user_id'])
+    except ReservationError as error:
+        return api_error(str(error), 409)
+    return '', 204
+
+
+# Gate operators send a batch of entry/exit events in one call
+@api.route(f'{API_PREFIX}/gate/events', methods=["POST"])
+@api_admin_required
+def api_gate_events():
+    data = request.get_json(silent=True)
+    events = data.get('events') if isinstance(data, dict) else None
+    if not isinstance(events, list):
+        return api_error("Send a JSON object with an 'events' list.", 400)
+    try:
+        results = process_gate_events(events)
+    except GateError as error:
+        return api_error(str(error), 409)
+    return jsonify({
+        'applied': sum(1 for result in results if result['ok']),
+        'failed': sum(1 for result in results if not result['ok']),
+        'results': results
+    })
+
+
+# Active parking of a plate, and prefix search over the parked vehicles
+@api.route(f'{API_PREFIX}/vehicles/<plate>')
+@api_admin_required
+def api_vehicle(plate):
+    row = active_parking(plate)
+    if row is None:
+        return api_error("This vehicle is not parked.", 404)
+    return jsonify(parking_json(row))
+
+
+@api.route(f'{API_PREFIX}/vehicles')
+@api_admin_required
+def api_vehicles():
+    prefix = request.args.get('prefix', '')
+    return jsonify({'parkings': [parking_json(row) for row in search_active_parkings(prefix)]})
@@ -0,0 +1,170 @@
+import asyncio
+import io
+import re
+from flask import request, session
+from sqlalchemy.engine import make_url
+from models.models import db
+from models.engine import install_sqlite_pragmas
+from controllers.api import API_PREFIX, lots_response, lot_spots_response
+from controllers.cache import view_cache, LOT_SUMMARIES_KEY, spot_grid_key, spot_grid_select
+from controllers.occupancy import occupancy_summary, lot_summaries_select
+from controllers.live import occupancy_broker
+from controllers.sweeper import overstay_sweeper
+
+try:
+    from a2wsgi import WSGIMiddleware
+    from a2wsgi.wsgi import build_environ
+    from sqlalchemy.ext.asyncio import create_async_engine
+    ASGI_AVAILABLE = True
+except ImportError:
+    ASGI_AVAILABLE = False
+
+# ASGI serving mode (uvicorn --factory app:create_asgi_app).
+# The read-only endpoints that kiosks and live pages hold open or poll -
+# /api/v1/lots, /api/v1/lots/<id>/spots and the /live/lots event stream -
+# are served by coroutines on the event loop, reading through an async
+# engine (aiosqlite for SQLite) and the same view cache as the Flask views.
+# An idle stream or a waiting poll then costs a coroutine instead of a
+# thread, so one worker holds thousands of connections. Every other route,
+# and any of these requests that is not the plain logged-in case (no
+# session, unknown lot), goes to the Flask app on a pool of
+# ASGI_WSGI_THREADS threads, so errors and redirects are the Flask ones.
+# The async views skip the Flask request hooks, so the instrumentation does
+# not count them.
+#
+# Needs the optional packages: pip install uvicorn a2wsgi aiosqlite
+
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite', 'postgresql': 'postgresql+asyncpg', 'mysql': 'mysql+aiomysql'}
+
+
+def async_database_url(config, url):
+    # url is the sync engine's, so relative SQLite paths resolve the same way
+    if config['ASYNC_DATABASE_URI']:
+        return make_url(config['ASYNC_DATABASE_URI'])
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise RuntimeError(f"No async driver known for {backend}; set ASYNC_DATABASE_URI.")
+    if backend == 'sqlite' and url.database in (None, '', ':memory:'):
+        raise RuntimeError("The ASGI mode needs a database file; an in-memory database is not shared.")
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+async def send_response(send, response):
+    # a Flask response, sent whole
+    headers = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in response.headers.items()]
+    await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': response.get_data()})
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+class AsyncApp:
+    def __init__(self, app):
+        if not ASGI_AVAILABLE:
+            raise RuntimeError("The ASGI mode needs uvicorn, a2wsgi and aiosqlite (pip install uvicorn a2wsgi aiosqlite).")
+        self.app = app
+        self.wsgi = WSGIMiddleware(app, workers=app.config['ASGI_WSGI_THREADS'])
+        with app.app_context():
+            url = async_database_url(app.config, db.engine.url)
+        self.engine = create_async_engine(url, **app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+        install_sqlite_pragmas(self.engine.sync_engine, app.config)
+        self.routes = [
+            (re.compile(f'{API_PREFIX}/lots'), self.lots),
+            (re.compile(rf'{API_PREFIX}/lots/(?P<lot_id>\d+)/spots'), self.lot_spots),
+            (re.compile('/live/lots'), self.live_lots),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] == 'http' and scope['method'] == 'GET':
+            for pattern, view in self.routes:
+                match = pattern.fullmatch(scope['path'])
+                if match and await view(scope, receive, send, **match.groupdict()):
+                    return
+        await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # the Flask views start it with the first request they serve
+                if self.app.config['SWEEPER_ENABLED']:
+                    overstay_sweeper.start(self.app)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                overstay_sweeper.stop()
+                await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def request_context(self, scope):
+        # Flask's request and session (the signed cookie) without running the
+        # Flask request hooks
+        return self.app.request_context(build_environ(scope, io.BytesIO()))
+
+    async def _load_lot_summaries(self):
+        async with self.engine.connect() as connection:
+            return [occupancy_summary(row) for row in await connection.execute(lot_summaries_select())]
+
+    async def _load_spot_grid(self, lot_id):
+        async with self.engine.connect() as connection:
+            return [row._asdict() for row in await connection.execute(spot_grid_select(lot_id))]
+
+    async def lot_summaries(self):
+        return await view_cache.get_or_load_async(LOT_SUMMARIES_KEY, self._load_lot_summaries)
+
+    # Views: True when they answered, False to hand the request to Flask
+
+    async def lots(self, scope, receive, send):
+        with self.request_context(scope):
+            if 'user_id' not in session:
+                return False
+            response = lots_response(await self.lot_summaries())
+        await send_response(send, response)
+        return True
+
+    async def lot_spots(self, scope, receive, send, lot_id):
+        lot_id = int(lot_id)
+        with self.request_context(scope):
+            if 'user_id' not in session:
+                return False
+            lot = next((lot for lot in await self.lot_summaries() if lot['id'] == lot_id), None)
+            if lot is None:
+                return False
+            grid = await view_cache.get_or_load_async(spot_grid_key(lot_id), lambda: self._load_spot_grid(lot_id))
+            response = lot_spots_response(lot, lambda: grid)
+        await send_response(send, response)
+        return True
+
+    async def live_lots(self, scope, receive, send):
+        with self.request_context(scope):
+            if 'user_id' not in session:
+                return False
+            lot_id = request.args.get('lot_id', type=int)
+            after_seq = request.headers.get('Last-Event-ID', type=int)
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ]})
+
+        async def pump():
+            stream = occupancy_broker.stream_async(lot_id, after_seq)
+            try:
+                async for frame in stream:
+                    await send({'type': 'http.response.body', 'body': frame.encode(), 'more_body': True})
+            finally:
+                await stream.aclose()
+
+        # the stream runs until the client goes away
+        streaming = asyncio.ensure_future(pump())
+        disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+        await asyncio.wait([streaming, disconnected], return_when=asyncio.FIRST_COMPLETED)
+        for task in (streaming, disconnected):
+            task.cancel()
+        await asyncio.gather(streaming, disconnected, return_exceptions=True)
+        return True
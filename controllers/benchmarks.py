@@ -0,0 +1,699 @@
+import asyncio
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta
+from http.cookiejar import CookieJar
+from urllib.parse import urlsplit
+from flask import current_app
+from sqlalchemy import delete, event, func, select, text
+from models.models import db, User, ParkingLot, ParkingSpot, Bookedspot, Reservation
+from models.engine import SQLITE_PROFILES
+from controllers.seed import seed_username, SEED_PASSWORD
+from controllers.cache import lot_changed
+from controllers.live import occupancy_broker, occupancy_changed
+
+# Benchmarks of the hot routes.
+# run_benchmarks() drives the Flask test client in-process: every scenario
+# is warmed up and then timed request by request, with the SQL statements
+# counted through an engine event. load_test() drives a running server over
+# HTTP from several threads, each logged in as its own seeded user (see
+# controllers/seed.py). Both report p50/p99 latency, throughput and queries
+# per request (over HTTP only with INSTRUMENTATION on) and save JSON that
+# compare_results() diffs against an earlier run. cold_start times what a
+# new worker pays before it can serve: a fresh interpreter running
+# create_app(), which must stay under COLD_START_TARGET_MS.
+# idle_connections_test() holds many /live/lots streams open against a
+# running server and times requests while they are open, to show how many
+# idle connections a worker carries (see the ASGI mode, controllers/asgi.py).
+
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+COLD_START_TARGET_MS = 1500
+# lot_create adds lots of LOT_SPOTS spots, lot_resize grows one to twice
+# that and back; gate_batch sends GATE_BATCH entries and then their exits
+LOT_SPOTS = 10000
+GATE_BATCH = 100
+# the fan_out scenarios publish FAN_OUT_PUBLISHES changes to that many live
+# streams; coroutines as under the ASGI server, threads as under WSGI
+FAN_OUT_SUBSCRIBERS = (100, 1000, 3000)
+FAN_OUT_THREADS = 100
+FAN_OUT_PUBLISHES = 20
+STARTUP_SCRIPT = 'from app import create_app; create_app()'
+SCAN_READERS = 2
+SCAN_SCRIPT = '''
+from sqlalchemy import text
+from app import create_app
+from models.models import db
+with create_app().app_context():
+    while True:
+        db.session.execute(text("SELECT COUNT(*), SUM(parking_cost) FROM bookedspot")).all()
+        db.session.rollback()
+'''
+# one writer of the write test: books and releases through the JSON API as
+# its own user until the time is up, after a 'go' line on stdin
+WRITE_SCRIPT = '''
+import json, sys, time
+from sqlalchemy.exc import OperationalError
+from app import create_app
+username, password, lot_id, vehicle, duration = sys.argv[1], sys.argv[2], int(sys.argv[3]), sys.argv[4], float(sys.argv[5])
+app = create_app({'SWEEPER_ENABLED': False, 'PROPAGATE_EXCEPTIONS': True})
+client = app.test_client()
+client.post('/login', data={'username': username, 'password': password})
+print('ready', flush=True)
+sys.stdin.readline()
+latencies, busy, failed, booking_id = [], 0, 0, None
+deadline = time.perf_counter() + duration
+while time.perf_counter() < deadline:
+    begin = time.perf_counter()
+    try:
+        if booking_id is None:
+            response = client.post('/api/v1/bookings', json={'lot_id': lot_id, 'vehicle_number': vehicle})
+            ok = response.status_code == 201
+            booking_id = response.get_json()['id'] if ok else None
+        else:
+            ok = client.post(f"/api/v1/bookings/{booking_id}/release").status_code == 200
+            booking_id = None
+    except OperationalError as error:
+        if 'locked' not in str(error):
+            raise
+        busy += 1
+        continue
+    if ok:
+        latencies.append(time.perf_counter() - begin)
+    else:
+        failed += 1
+if booking_id is not None:
+    client.post(f"/api/v1/bookings/{booking_id}/release")
+print(json.dumps({'latencies': latencies, 'busy': busy, 'failed': failed}))
+'''
+
+
+def percentile(values, fraction):
+    # nearest rank on the sorted values
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values) + 0.5)) - 1))]
+
+
+def summarize(latencies, elapsed, queries=None):
+    summary = {
+        'requests': len(latencies),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+    }
+    if queries:
+        summary['queries_per_request'] = round(sum(queries) / len(queries), 2)
+    return summary
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=current_app.root_path, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def dataset():
+    return {
+        'lots': db.session.query(func.count(ParkingLot.id)).scalar(),
+        'spots': db.session.query(func.count(ParkingSpot.id)).scalar(),
+        'users': db.session.query(func.count(User.id)).scalar(),
+        'bookings': db.session.query(func.count(Bookedspot.id)).scalar(),
+    }
+
+
+def report(mode, results, **settings):
+    return {
+        'mode': mode,
+        'commit': _commit(),
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'settings': settings,
+        'dataset': dataset(),
+        'results': results,
+    }
+
+
+def bench_user():
+    # the highest-numbered seeded user without an open booking
+    open_users = db.session.query(Bookedspot.user_id).filter(Bookedspot.vehicle_released == False)
+    return User.query.filter(User.username.like('user%'), User.is_active_user == True,
+                             ~User.id.in_(open_users)).order_by(User.username.desc()).first()
+
+
+def bench_lot():
+    return ParkingLot.query.filter_by(deleted_lot=True).order_by(ParkingLot.free_count.desc()).first()
+
+
+def gate_users(count, exclude=None):
+    # usernames of seeded users without an open booking, for the gate
+    # scenarios and the write test
+    open_users = db.session.query(Bookedspot.user_id).filter(Bookedspot.vehicle_released == False)
+    query = db.session.query(User.username).filter(
+        User.username.like('user%'), User.is_active_user == True, ~User.id.in_(open_users))
+    if exclude is not None:
+        query = query.filter(User.id != exclude)
+    return [username for (username,) in query.order_by(User.username).limit(count)]
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        self.engine = engine
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args, **kwargs):
+        self.count += 1
+
+
+@contextmanager
+def booking_table_scans(app, readers=SCAN_READERS, env=None):
+    # worker processes that keep scanning the booking table, like the
+    # reports and exports do, while the writes are timed
+    processes = [subprocess.Popen([sys.executable, '-c', SCAN_SCRIPT], cwd=app.root_path, env=env)
+                 for _ in range(readers)]
+    try:
+        yield
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+def measure_cold_start(runs=5):
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(runs):
+        begin = time.perf_counter()
+        subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], cwd=current_app.root_path, check=True)
+        latencies.append(time.perf_counter() - begin)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def measure_fan_out(app, lot_id, subscribers, threads=False, publishes=FAN_OUT_PUBLISHES):
+    # delivery latency from an occupancy change to each open stream of the
+    # lot; the statements are counted per change, not per subscriber
+    latencies = []
+    queries = []
+
+    def publish():
+        started = time.perf_counter()
+        with app.app_context(), QueryCounter(db.engine) as counter:
+            # as after a booking: the cached lot is stale, then the change goes out
+            lot_changed(lot_id)
+            occupancy_changed(lot_id)
+        queries.append(counter.count)
+        return started
+
+    started = time.perf_counter()
+    if threads:
+        _fan_out_threads(lot_id, subscribers, publishes, publish, latencies)
+    else:
+        asyncio.run(_fan_out_async(lot_id, subscribers, publishes, publish, latencies))
+    return summarize(latencies, time.perf_counter() - started, queries)
+
+
+async def _next_event(stream):
+    # time at which the stream hands over its next event (skipping pings)
+    async for frame in stream:
+        if frame.startswith('id:'):
+            return time.perf_counter()
+
+
+async def _fan_out_async(lot_id, subscribers, publishes, publish, latencies):
+    loop = asyncio.get_running_loop()
+    streams = [occupancy_broker.stream_async(lot_id) for _ in range(subscribers)]
+    try:
+        for stream in streams:
+            # the opening frame; the stream is subscribed from here on
+            await stream.__anext__()
+        for _ in range(publishes):
+            received = [asyncio.ensure_future(_next_event(stream)) for stream in streams]
+            await asyncio.sleep(0)
+            # published from another thread, as a request handler would
+            started = await loop.run_in_executor(None, publish)
+            latencies.extend(at - started for at in await asyncio.gather(*received))
+    finally:
+        for stream in streams:
+            await stream.aclose()
+
+
+def _fan_out_threads(lot_id, subscribers, publishes, publish, latencies):
+    received = [[] for _ in range(publishes)]
+    subscribed = threading.Semaphore(0)
+    delivered = threading.Semaphore(0)
+
+    def subscriber():
+        stream = occupancy_broker.stream(lot_id)
+        next(stream)
+        subscribed.release()
+        count = 0
+        for frame in stream:
+            if frame.startswith('id:'):
+                received[count].append(time.perf_counter())
+                delivered.release()
+                count += 1
+                if count == publishes:
+                    break
+        stream.close()
+
+    workers = [threading.Thread(target=subscriber, daemon=True) for _ in range(subscribers)]
+    for worker in workers:
+        worker.start()
+    for _ in workers:
+        subscribed.acquire()
+    for index in range(publishes):
+        started = publish()
+        for _ in workers:
+            delivered.acquire()
+        latencies.extend(at - started for at in received[index])
+    for worker in workers:
+        worker.join()
+
+
+def _call_alone(app, call):
+    # each call gets an app context of its own: the test client reuses one
+    # that is already pushed (flask commands run in one), and g.current_user
+    # would then carry over from one client's request to the other's
+    with app.app_context():
+        return call()
+
+
+def _delete_bench_lots(app, admin_client, lot_ids):
+    # the spots without any history go in one statement first; deleting a
+    # lot cascades through the ORM one spot at a time, seconds for 10k spots
+    if lot_ids:
+        db.session.execute(delete(ParkingSpot).where(
+            ParkingSpot.lot_id.in_(lot_ids),
+            ParkingSpot.id.not_in(select(Bookedspot.spot_id)),
+            ParkingSpot.id.not_in(select(Reservation.spot_id))))
+        db.session.commit()
+        db.session.remove()
+    for lot_id in lot_ids:
+        _call_alone(app, lambda: admin_client.get(f'/delete_spots/{lot_id}'))
+
+
+def _time_scenario(app, name, call, requests, warmup):
+    for _ in range(warmup):
+        _call_alone(app, call)
+    latencies = []
+    queries = []
+    started = time.perf_counter()
+    with app.app_context(), QueryCounter(db.engine) as counter:
+        for _ in range(requests):
+            before = counter.count
+            begin = time.perf_counter()
+            response = _call_alone(app, call)
+            latencies.append(time.perf_counter() - begin)
+            queries.append(counter.count - before)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{name} answered {response.status_code}")
+    return summarize(latencies, time.perf_counter() - started, queries)
+
+
+def run_benchmarks(requests=200, warmup=20, admin_password='admin', startup_runs=5):
+    user = bench_user()
+    lot = bench_lot()
+    if user is None or lot is None:
+        raise RuntimeError("No free seeded user or lot to benchmark with; run 'flask seed' first.")
+    admin = User.query.filter_by(is_admin=True).first()
+    app = current_app._get_current_object()
+    admin_client = app.test_client()
+    user_client = app.test_client()
+    admin_client.post('/login', data={'username': admin.username, 'password': admin_password})
+    user_client.post('/login', data={'username': user.username, 'password': SEED_PASSWORD})
+    lot_id = lot.id
+    drivers = gate_users(GATE_BATCH, user.id)
+    if len(drivers) < GATE_BATCH:
+        raise RuntimeError(f"The gate scenarios need {GATE_BATCH + 1} seeded users without a booking.")
+    # nearest lots with a free spot, searched from the benchmark lot
+    search = '/api/v1/lots/search?available=1&limit=5'
+    if lot.latitude is not None:
+        search += f"&lat={lot.latitude}&lon={lot.longitude}"
+    db.session.remove()
+
+    def book_release():
+        # through the JSON API, which hands back the booking id
+        response = user_client.post('/api/v1/bookings', json={'lot_id': lot_id, 'vehicle_number': 'BENCH0001'})
+        if response.status_code != 201:
+            return response
+        return user_client.post(f"/api/v1/bookings/{response.get_json()['id']}/release")
+
+    # a window a day ahead, so it never runs into the booking above
+    start = (datetime.now() + timedelta(days=1)).replace(microsecond=0)
+    window = {'start': start.isoformat(), 'end': (start + timedelta(hours=2)).isoformat()}
+    availability = f"/api/v1/lots/{lot_id}/availability?start={window['start']}&end={window['end']}"
+
+    def reserve_cancel():
+        response = user_client.post('/api/v1/reservations', json={'lot_id': lot_id, 'vehicle_number': 'BENCH0001',
+                                                                  **window})
+        if response.status_code != 201:
+            return response
+        return user_client.post(f"/api/v1/reservations/{response.get_json()['id']}/cancel")
+
+    def lot_create(name='Bench create'):
+        return admin_client.post('/create_lot', data={
+            'location_name': name, 'pin_code': '000000', 'adress': 'Bench', 'price': '10', 'spots': str(LOT_SPOTS)})
+
+    @contextmanager
+    def created_lots_deleted(app):
+        try:
+            yield
+        finally:
+            _delete_bench_lots(app, admin_client, [lot_id for (lot_id,) in db.session.query(ParkingLot.id).filter_by(
+                lot_name='Bench create')])
+
+    # a lot of its own for the resize and gate scenarios, deleted at the end
+    _call_alone(app, lambda: lot_create('Bench resize'))
+    resize_lot_id = db.session.query(func.max(ParkingLot.id)).scalar()
+    db.session.remove()
+    resize = {'spots': LOT_SPOTS}
+
+    def lot_resize():
+        # grows the lot to twice its size and shrinks it back, in turns
+        resize['spots'] = LOT_SPOTS * 3 - resize['spots']
+        return admin_client.post(f'/edit_lots/{resize_lot_id}', data={
+            'location_name': 'Bench resize', 'pin_code': '000000', 'adress': 'Bench', 'price': '10',
+            'spots': str(resize['spots'])})
+
+    def gate_round_trip(usernames):
+        # the entries of these drivers in one batch, then their exits in another
+        vehicles = [f'GATE{number:04d}' for number in range(len(usernames))]
+        for events in ([{'type': 'entry', 'vehicle_number': vehicle, 'lot_id': resize_lot_id, 'username': username}
+                        for vehicle, username in zip(vehicles, usernames)],
+                       [{'type': 'exit', 'vehicle_number': vehicle} for vehicle in vehicles]):
+            response = admin_client.post('/api/v1/gate/events', json={'events': events})
+            if response.status_code != 200 or response.get_json()['failed']:
+                raise RuntimeError(f"gate events failed: {response.get_data(as_text=True)[:200]}")
+        return response
+
+    scenarios = [
+        ('spot_list', lambda: user_client.get('/spot_list')),
+        ('lot_search', lambda: user_client.get(search)),
+        ('booking_history', lambda: user_client.get('/booking_history')),
+        ('admin', lambda: admin_client.get('/admin')),
+        ('user_list', lambda: admin_client.get('/user_list')),
+        ('admin_summary', lambda: admin_client.get('/admin_summary')),
+        ('book_release', book_release),
+        ('availability', lambda: user_client.get(availability)),
+        ('reserve_cancel', reserve_cancel),
+        ('lot_create', lot_create, created_lots_deleted),
+        ('lot_resize', lot_resize),
+        # one event per request against GATE_BATCH per request
+        ('gate_single', lambda: gate_round_trip(drivers[:1])),
+        ('gate_batch', lambda: gate_round_trip(drivers)),
+        # the readers are separate processes, as the workers of a real
+        # deployment would be; flask writetest compares the SQLite profiles
+        ('write_under_scan', book_release, booking_table_scans),
+    ]
+    results = {}
+    try:
+        for name, call, *during in scenarios:
+            with during[0](app) if during else nullcontext():
+                results[name] = _time_scenario(app, name, call, requests, warmup)
+    finally:
+        _delete_bench_lots(app, admin_client, [resize_lot_id])
+    for subscribers in FAN_OUT_SUBSCRIBERS:
+        results[f'fan_out_{subscribers}'] = measure_fan_out(app, lot_id, subscribers)
+    results[f'fan_out_wsgi_{FAN_OUT_THREADS}'] = measure_fan_out(app, lot_id, FAN_OUT_THREADS, threads=True)
+    if startup_runs:
+        results['cold_start'] = measure_cold_start(startup_runs)
+    return report('client', results, requests=requests, warmup=warmup)
+
+
+def _set_journal_mode(mode):
+    # the journal mode is stored in the database file, so a run under the
+    # 'default' profile after a WAL one would still be in WAL mode
+    db.session.remove()
+    db.engine.dispose()
+    with db.engine.connect() as connection:
+        mode = connection.exec_driver_sql(f"PRAGMA journal_mode = {mode}").scalar()
+    db.engine.dispose()
+    return mode
+
+
+def _concurrent_writes(app, profile, writers, users, lot_id, duration, readers):
+    env = {**os.environ, 'SQLITE_PROFILE': profile, 'SWEEPER_ENABLED': 'false'}
+    journal_mode = _set_journal_mode(SQLITE_PROFILES[profile].get('journal_mode', 'DELETE'))
+    with booking_table_scans(app, readers, env):
+        processes = [subprocess.Popen([sys.executable, '-c', WRITE_SCRIPT, username, SEED_PASSWORD, str(lot_id),
+                                       f'WRITE{index:04d}', str(duration)],
+                                      cwd=app.root_path, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                      text=True)
+                     for index, username in enumerate(users[:writers])]
+        try:
+            for process in processes:
+                if process.stdout.readline().strip() != 'ready':
+                    raise RuntimeError("A writer process failed to start.")
+            # all writers start together, once every one of them is up
+            for process in processes:
+                process.stdin.write('go\n')
+                process.stdin.flush()
+            outputs = [process.communicate()[0] for process in processes]
+        finally:
+            for process in processes:
+                if process.poll() is None:
+                    process.kill()
+    if any(process.returncode for process in processes):
+        raise RuntimeError("A writer process failed.")
+    runs = [json.loads(output.strip().splitlines()[-1]) for output in outputs]
+    summary = summarize([latency for run in runs for latency in run['latencies']], duration)
+    summary.update(errors=sum(run['busy'] for run in runs), failed=sum(run['failed'] for run in runs),
+                   journal_mode=journal_mode)
+    return summary
+
+
+def run_write_test(profiles=('default', 'production'), writers=(1, 2, 4, 8), duration=10.0, readers=SCAN_READERS):
+    # writes per second from several writer processes at once, per SQLite
+    # profile; every booking and every release is one write
+    if db.engine.dialect.name != 'sqlite':
+        raise RuntimeError("The write test compares SQLite profiles; the database is not SQLite.")
+    unknown = [profile for profile in profiles if profile not in SQLITE_PROFILES]
+    if unknown:
+        raise RuntimeError(f"Unknown SQLite profile(s): {', '.join(unknown)}.")
+    lot = bench_lot()
+    users = gate_users(max(writers))
+    if lot is None or len(users) < max(writers):
+        raise RuntimeError(f"The write test needs a lot with free spots and {max(writers)} seeded users "
+                           "without a booking; run 'flask seed' first.")
+    lot_id = lot.id
+    app = current_app._get_current_object()
+    restore = db.session.execute(text("PRAGMA journal_mode")).scalar()
+    results = {}
+    try:
+        for profile in profiles:
+            for count in writers:
+                results[f'{profile}_w{count}'] = _concurrent_writes(app, profile, count, users, lot_id, duration,
+                                                                    readers)
+    finally:
+        _set_journal_mode(restore)
+    return report('writes', results, profiles=list(profiles), writers=list(writers), duration=duration,
+                  readers=readers)
+
+
+def _http_client(base_url):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+
+    def call(method, path, payload=None):
+        data = json.dumps(payload).encode() if payload is not None else None
+        request = urllib.request.Request(base_url + path, data=data, method=method,
+                                         headers={'Content-Type': 'application/json'} if data else {})
+        try:
+            with opener.open(request, timeout=30) as response:
+                return response.status, response.read(), response.headers.get('Server-Timing')
+        except urllib.error.HTTPError as error:
+            return error.code, error.read(), error.headers.get('Server-Timing')
+    return call
+
+
+def load_test(base_url, threads=8, duration=30.0, admin_password='admin', first_user=None):
+    # each worker thread logs in as its own seeded user (counting down from
+    # first_user) and loops over the user routes; one more thread is the admin
+    base_url = base_url.rstrip('/')
+    samples = {}
+    errors = {}
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+    lot_id = bench_lot().id
+    admin_username = User.query.filter_by(is_admin=True).first().username
+    if first_user is None:
+        first_user = int(bench_user().username[4:])
+
+    def record(name, seconds, status, timing):
+        queries = SERVER_TIMING_QUERIES.search(timing or '')
+        with lock:
+            latencies, counts = samples.setdefault(name, ([], []))
+            latencies.append(seconds)
+            if queries:
+                counts.append(int(queries.group(1)))
+            if status >= 400:
+                errors[name] = errors.get(name, 0) + 1
+
+    def timed(call, name, method, path, payload=None):
+        begin = time.perf_counter()
+        status, body, timing = call(method, path, payload)
+        record(name, time.perf_counter() - begin, status, timing)
+        return status, body
+
+    def user_worker(number):
+        call = _http_client(base_url)
+        call('POST', '/api/v1/login', {'username': seed_username(number), 'password': SEED_PASSWORD})
+        plate = f"LOAD{number:06d}"
+        while time.perf_counter() < stop_at:
+            timed(call, 'spot_list', 'GET', '/spot_list')
+            timed(call, 'booking_history', 'GET', '/booking_history')
+            status, body = timed(call, 'book', 'POST', '/api/v1/bookings', {'lot_id': lot_id, 'vehicle_number': plate})
+            if status == 201:
+                timed(call, 'release', 'POST', f"/api/v1/bookings/{json.loads(body)['id']}/release")
+
+    def admin_worker():
+        call = _http_client(base_url)
+        call('POST', '/api/v1/login', {'username': admin_username, 'password': admin_password})
+        while time.perf_counter() < stop_at:
+            for name, path in [('admin', '/admin'), ('user_list', '/user_list'), ('admin_summary', '/admin_summary')]:
+                timed(call, name, 'GET', path)
+
+    workers = [threading.Thread(target=user_worker, args=(first_user - index,)) for index in range(threads)]
+    workers.append(threading.Thread(target=admin_worker))
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    results = {}
+    for name, (latencies, counts) in sorted(samples.items()):
+        results[name] = summarize(latencies, elapsed, counts)
+        results[name]['errors'] = errors.get(name, 0)
+    return report('http', results, url=base_url, threads=threads, duration=duration)
+
+
+def _session_cookie(base_url, username, password):
+    request = urllib.request.Request(base_url + '/api/v1/login', method='POST',
+                                     data=json.dumps({'username': username, 'password': password}).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return response.headers['Set-Cookie'].split(';')[0]
+
+
+def _server_threads(pid):
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('Threads:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+
+async def _request_head(host, port, path, cookie):
+    # opens a connection and sends a GET; returns the streams after the status line
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nCookie: {cookie}\r\nConnection: close\r\n\r\n".encode())
+    await writer.drain()
+    status = await reader.readline()
+    return reader, writer, int(status.split()[1])
+
+
+async def _hold_stream(host, port, cookie, opened, stop):
+    try:
+        reader, writer, status = await _request_head(host, port, '/live/lots', cookie)
+    except OSError:
+        return False
+    if status != 200:
+        writer.close()
+        return False
+    opened.append(writer)
+    while True:
+        read = asyncio.ensure_future(reader.read(65536))
+        await asyncio.wait([read, stop], return_when=asyncio.FIRST_COMPLETED)
+        if not read.done():
+            read.cancel()
+            break
+        if not read.result():
+            break
+    writer.close()
+    return True
+
+
+async def _timed_get(host, port, path, cookie):
+    begin = time.perf_counter()
+    reader, writer, status = await _request_head(host, port, path, cookie)
+    await reader.read()
+    writer.close()
+    return time.perf_counter() - begin, status
+
+
+async def _idle_connections(base_url, connections, duration, cookie, server_pid):
+    url = urlsplit(base_url)
+    host, port = url.hostname, url.port or 80
+    stop = asyncio.get_running_loop().create_future()
+    opened = []
+    holders = []
+    # open the streams in batches so the listen backlog keeps up
+    for start in range(0, connections, 200):
+        holders += [asyncio.ensure_future(_hold_stream(host, port, cookie, opened, stop))
+                    for _ in range(min(200, connections - start))]
+        await asyncio.sleep(0.2)
+    samples = {'api_lots': [], 'spot_list': []}
+    errors = {}
+    started = time.perf_counter()
+    while time.perf_counter() - started < duration:
+        for name, path in [('api_lots', '/api/v1/lots'), ('spot_list', '/spot_list')]:
+            seconds, status = await _timed_get(host, port, path, cookie)
+            samples[name].append(seconds)
+            if status >= 400:
+                errors[name] = errors.get(name, 0) + 1
+    elapsed = time.perf_counter() - started
+    held = len(opened)
+    threads = _server_threads(server_pid) if server_pid else None
+    stop.set_result(True)
+    await asyncio.gather(*holders, return_exceptions=True)
+    results = {}
+    for name, latencies in samples.items():
+        results[name] = summarize(latencies, elapsed)
+        results[name]['errors'] = errors.get(name, 0)
+    return results, held, threads
+
+
+def idle_connections_test(base_url, connections=1000, duration=10.0, server_pid=None):
+    # holds `connections` live streams (as the highest free seeded user) and
+    # times the lot API and a Flask page while they are open
+    base_url = base_url.rstrip('/')
+    cookie = _session_cookie(base_url, bench_user().username, SEED_PASSWORD)
+    results, held, threads = asyncio.run(_idle_connections(base_url, connections, duration, cookie, server_pid))
+    return report('connections', results, url=base_url, connections=connections, duration=duration,
+                  held=held, server_threads=threads)
+
+
+def compare_results(previous, current):
+    # [(scenario, metric, before, after, change in percent)]
+    changes = []
+    for name, result in current['results'].items():
+        before = previous['results'].get(name)
+        if before is None:
+            continue
+        for metric in ('p50_ms', 'p99_ms', 'throughput_rps', 'queries_per_request'):
+            if metric in result and metric in before:
+                change = (result[metric] - before[metric]) / before[metric] * 100 if before[metric] else 0.0
+                changes.append((name, metric, before[metric], result[metric], round(change, 1)))
+    return changes
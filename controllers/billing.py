@@ -0,0 +1,224 @@
+import threading
+from collections import defaultdict
+from math import ceil
+from sqlalchemy import select, update
+from models.models import db, ParkingLot, ParkingSpot, Bookedspot, LotTariff
+
+# Parking tariffs.
+# Without a tariff a stay costs lot.price for every started hour. A LotTariff
+# adds a first-hour rate, a night rate for the hours that start inside the
+# night window, a free grace period and a cap on what 24 hours of a stay can
+# cost.
+#
+# A tariff is compiled into lookup tables: for each clock hour a stay can
+# start in, the (capped) cost of its first k hours, k = 0..24, once for the
+# first day and once for the following days. Pricing a stay of any length
+# is then two or three lookups instead of a loop over its hours. Compiled
+# tariffs are kept per worker under the lot's price and tariff_version;
+# saving a tariff bumps tariff_version, so the other workers compile the new
+# one on their next release.
+
+REPRICE_CHUNK = 5000
+
+
+class TariffError(Exception):
+    pass
+
+
+def _in_night(hour, night_start, night_end):
+    if night_start <= night_end:
+        return night_start <= hour < night_end
+    return hour >= night_start or hour < night_end
+
+
+def hourly_rates(price, tariff):
+    # the rate of an hour that starts at each clock hour 0..23
+    if tariff is None or tariff.night_rate is None:
+        return [price] * 24
+    return [tariff.night_rate if _in_night(hour, tariff.night_start, tariff.night_end) else price
+            for hour in range(24)]
+
+
+class CompiledTariff:
+    def __init__(self, price, tariff=None):
+        rates = hourly_rates(price, tariff)
+        first_hour_rate = tariff.first_hour_rate if tariff is not None else None
+        daily_cap = tariff.daily_cap if tariff is not None else None
+        self.grace_seconds = (tariff.grace_minutes or 0) * 60 if tariff is not None else 0
+        # first[start][k] / rest[start][k]: cost of k hours from clock hour start
+        self.first = []
+        self.rest = []
+        for start in range(24):
+            first = [0.0]
+            rest = [0.0]
+            for k in range(24):
+                rate = rates[(start + k) % 24]
+                first.append(first[-1] + (first_hour_rate if k == 0 and first_hour_rate is not None else rate))
+                rest.append(rest[-1] + rate)
+            if daily_cap is not None:
+                first = [min(cost, daily_cap) for cost in first]
+                rest = [min(cost, daily_cap) for cost in rest]
+            self.first.append(first)
+            self.rest.append(rest)
+
+    def _hours_cost(self, start, started_hours):
+        # every started hour is charged; the stay is split into 24 hour days
+        days, hours = divmod(started_hours, 24)
+        if not days:
+            return round(self.first[start][hours], 2)
+        rest = self.rest[start]
+        return round(self.first[start][24] + (days - 1) * rest[24] + rest[hours], 2)
+
+    def cost(self, entry_timing, exit_timing):
+        seconds = (exit_timing - entry_timing).total_seconds()
+        if seconds <= self.grace_seconds:
+            return 0.0
+        return self._hours_cost(entry_timing.hour, ceil(seconds / 3600))
+
+    def costs(self, stays):
+        # [(entry_timing, exit_timing)] -> [cost] in one pass: the stays are
+        # bucketed by start hour and started hours, and each bucket is priced
+        # once from the tables. Without numpy this is still a Python loop, but
+        # one that does a subtraction and a dict lookup per stay.
+        grace_seconds = self.grace_seconds
+        keys = []
+        for entry_timing, exit_timing in stays:
+            seconds = (exit_timing - entry_timing).total_seconds()
+            keys.append((entry_timing.hour, ceil(seconds / 3600)) if seconds > grace_seconds else None)
+        prices = {key: self._hours_cost(*key) for key in set(keys) if key is not None}
+        prices[None] = 0.0
+        return [prices[key] for key in keys]
+
+
+class TariffBook:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._compiled = {}
+
+    def get(self, lot_id, price, tariff_version):
+        with self._lock:
+            cached = self._compiled.get(lot_id)
+        if cached is not None and cached[0] == (price, tariff_version):
+            return cached[1]
+        tariff = db.session.get(LotTariff, lot_id) if tariff_version else None
+        compiled = CompiledTariff(price, tariff)
+        self.put(lot_id, price, tariff_version, compiled)
+        return compiled
+
+    def put(self, lot_id, price, tariff_version, compiled):
+        with self._lock:
+            self._compiled[lot_id] = ((price, tariff_version), compiled)
+
+    def clear(self):
+        with self._lock:
+            self._compiled.clear()
+
+
+tariff_book = TariffBook()
+
+
+def stay_cost(lot, entry_timing, exit_timing):
+    return tariff_book.get(lot.id, lot.price, lot.tariff_version).cost(entry_timing, exit_timing)
+
+
+def price_stays(stays):
+    # [(lot_id, price, tariff_version, entry_timing, exit_timing)] -> [cost],
+    # priced lot by lot through the compiled tables
+    by_lot = defaultdict(list)
+    for index, (lot_id, price, tariff_version, entry_timing, exit_timing) in enumerate(stays):
+        by_lot[(lot_id, price, tariff_version)].append((index, (entry_timing, exit_timing)))
+    result = [None] * len(stays)
+    for (lot_id, price, tariff_version), group in by_lot.items():
+        costs = tariff_book.get(lot_id, price, tariff_version).costs([stay for _, stay in group])
+        for (index, _), cost in zip(group, costs):
+            result[index] = cost
+    return result
+
+
+def _optional_number(form, name, cast=float):
+    value = (form.get(name) or '').strip()
+    if not value:
+        return None
+    try:
+        value = cast(value)
+    except ValueError:
+        raise TariffError(f"{name.replace('_', ' ').capitalize()} must be a number.")
+    if value < 0:
+        raise TariffError(f"{name.replace('_', ' ').capitalize()} cannot be negative.")
+    return value
+
+
+def save_tariff(lot, form):
+    # reads the tariff fields of the edit lot form; without a rate, a cap or a
+    # grace period the lot has no tariff. The caller commits, then hands the
+    # returned table to tariff_book.put().
+    fields = {
+        'first_hour_rate': _optional_number(form, 'first_hour_rate'),
+        'night_rate': _optional_number(form, 'night_rate'),
+        'night_start': _optional_number(form, 'night_start', int),
+        'night_end': _optional_number(form, 'night_end', int),
+        'daily_cap': _optional_number(form, 'daily_cap'),
+        'grace_minutes': _optional_number(form, 'grace_minutes', int),
+    }
+    for name in ('night_start', 'night_end'):
+        if fields[name] is not None and fields[name] > 23:
+            raise TariffError("Night hours must be between 0 and 23.")
+    if fields['daily_cap'] == 0:
+        raise TariffError("Daily cap must be more than zero.")
+
+    tariff = lot.tariff
+    has_tariff = (fields['first_hour_rate'] is not None or fields['night_rate'] is not None
+                  or fields['daily_cap'] is not None or fields['grace_minutes'])
+    if not has_tariff:
+        if tariff is None:
+            return tariff_book.get(lot.id, lot.price, lot.tariff_version)
+        lot.tariff = None
+        tariff = None
+    else:
+        if tariff is None:
+            tariff = lot.tariff = LotTariff(lot_id=lot.id)
+        fields['night_start'] = 22 if fields['night_start'] is None else fields['night_start']
+        fields['night_end'] = 6 if fields['night_end'] is None else fields['night_end']
+        fields['grace_minutes'] = fields['grace_minutes'] or 0
+        for name, value in fields.items():
+            setattr(tariff, name, value)
+    lot.tariff_version = (lot.tariff_version or 0) + 1
+    return CompiledTariff(lot.price, tariff)
+
+
+def reprice_bookings(lot_id=None, start=None, end=None, apply=False):
+    # prices the released bookings again under the current tariffs;
+    # returns {lot_id: [bookings, billed, repriced, changed]}
+    query = select(
+        Bookedspot.id, Bookedspot.entry_timing, Bookedspot.exit_timing, Bookedspot.parking_cost,
+        ParkingLot.id.label('lot_id'), ParkingLot.price, ParkingLot.tariff_version
+    ).join(ParkingSpot, ParkingSpot.id == Bookedspot.spot_id
+    ).join(ParkingLot, ParkingLot.id == ParkingSpot.lot_id
+    ).where(Bookedspot.vehicle_released == True, Bookedspot.exit_timing != None)
+    if lot_id is not None:
+        query = query.where(ParkingSpot.lot_id == lot_id)
+    if start is not None:
+        query = query.where(Bookedspot.entry_timing >= start)
+    if end is not None:
+        query = query.where(Bookedspot.entry_timing < end)
+
+    totals = defaultdict(lambda: [0, 0.0, 0.0, 0])
+    changes = []
+    for rows in db.session.execute(query.execution_options(yield_per=REPRICE_CHUNK)).partitions():
+        costs = price_stays([(row.lot_id, row.price, row.tariff_version, row.entry_timing, row.exit_timing)
+                             for row in rows])
+        for row, cost in zip(rows, costs):
+            total = totals[row.lot_id]
+            total[0] += 1
+            total[1] += row.parking_cost or 0
+            total[2] += cost
+            if cost != row.parking_cost:
+                total[3] += 1
+                changes.append({'id': row.id, 'parking_cost': cost})
+
+    if apply:
+        # written after the read so the scan is not changing under us
+        for index in range(0, len(changes), REPRICE_CHUNK):
+            db.session.execute(update(Bookedspot), changes[index:index + REPRICE_CHUNK])
+        db.session.commit()
+    return dict(totals)
@@ -0,0 +1,77 @@
+from sqlalchemy import tuple_
+from datetime import datetime
+from models.models import db, ParkingLot, ParkingSpot, Bookedspot
+
+# Booking history with keyset (cursor) pagination.
+# Pages are ordered newest first on (exit_timing, id) and the cursor is the
+# key of the last row shown, so every page is one indexed range query no
+# matter how long the history is.
+
+HISTORY_PAGE_SIZE = 20
+HISTORY_MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(exit_timing, booking_id):
+    return f"{exit_timing.isoformat()}_{booking_id}"
+
+
+def decode_cursor(cursor):
+    # returns (exit_timing, booking_id), or None for a missing or bad cursor
+    if not cursor:
+        return None
+    try:
+        exit_timing, booking_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(exit_timing), int(booking_id)
+    except ValueError:
+        return None
+
+
+def page_size(size, default=HISTORY_PAGE_SIZE, maximum=HISTORY_MAX_PAGE_SIZE):
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(size, maximum))
+
+
+def history_page_query(user_id, key, size):
+    query = db.session.query(
+        Bookedspot.id,
+        Bookedspot.vehicle_number,
+        Bookedspot.entry_timing,
+        Bookedspot.exit_timing,
+        Bookedspot.parking_cost,
+        ParkingLot.lot_name,
+        ParkingLot.city
+    ).join(ParkingSpot, ParkingSpot.id == Bookedspot.spot_id
+    ).join(ParkingLot, ParkingLot.id == ParkingSpot.lot_id
+    ).filter(Bookedspot.user_id == user_id, Bookedspot.vehicle_released == True)
+
+    if key is not None:
+        query = query.filter(tuple_(Bookedspot.exit_timing, Bookedspot.id) < tuple_(*key))
+
+    # one extra row tells us whether there is an older page
+    return query.order_by(Bookedspot.exit_timing.desc(), Bookedspot.id.desc()).limit(size + 1)
+
+
+def history_page(user_id, cursor=None, size=HISTORY_PAGE_SIZE):
+    # returns (rows, next_cursor); next_cursor is None on the last page
+    rows = history_page_query(user_id, decode_cursor(cursor), size).all()
+
+    next_cursor = None
+    if len(rows) > size:
+        rows = rows[:size]
+        next_cursor = encode_cursor(rows[-1].exit_timing, rows[-1].id)
+
+    history = []
+    for row in rows:
+        history.append({
+            'bookedspot_id': row.id,
+            'location_name': row.lot_name,
+            'address': row.city,
+            'vehicle': row.vehicle_number,
+            'entry': row.entry_timing,
+            'exit': row.exit_timing,
+            'cost': row.parking_cost
+        })
+    return history, next_cursor
@@ -0,0 +1,206 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import select
+from models.models import db, ParkingSpot
+from controllers.occupancy import occupancy_summary, lot_summaries_select
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Read-through cache for the lot cards and spot grids.
+# Entries expire after CACHE_TTL seconds and the least recently used entry
+# is evicted once CACHE_MAX_ENTRIES is reached. Every view that changes a
+# lot or its spots calls lot_changed() after it commits, so readers in the
+# same process never see stale data; other workers sharing the in-process
+# backend catch up within the TTL, or at once with the redis backend.
+#
+# Only plain dicts are cached (no ORM objects), so the values can be shared
+# between sessions and pickled for a shared backend.
+
+
+class MemoryBackend:
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        # returns (found, value)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisBackend:
+    # shared between workers; eviction is left to redis (maxmemory-policy)
+    def __init__(self, url, ttl, prefix='parking:'):
+        if redis is None:
+            raise RuntimeError("CACHE_BACKEND=redis needs the redis package (pip install redis).")
+        self.ttl = ttl
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        raw = self._client.get(self.prefix + key)
+        if raw is None:
+            return False, None
+        return True, pickle.loads(raw)
+
+    def set(self, key, value):
+        self._client.set(self.prefix + key, pickle.dumps(value), ex=max(1, int(self.ttl)))
+
+    def delete(self, *keys):
+        if keys:
+            self._client.delete(*(self.prefix + key for key in keys))
+
+    def clear(self):
+        keys = list(self._client.scan_iter(self.prefix + '*'))
+        if keys:
+            self._client.delete(*keys)
+
+
+class ReadThroughCache:
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # bumped on every invalidation, so a load that raced with a write
+        # is returned to its caller but not stored
+        self._generation = 0
+
+    def init_app(self, app):
+        self.backend = make_backend(app.config)
+
+    def get_or_load(self, key, loader):
+        found, value = self.backend.get(key)
+        with self._lock:
+            if found:
+                self.hits += 1
+                return value
+            self.misses += 1
+            generation = self._generation
+        value = loader()
+        with self._lock:
+            if generation == self._generation:
+                self.backend.set(key, value)
+        return value
+
+    async def get_or_load_async(self, key, loader):
+        # the same, for the async views; loader is a coroutine function. The
+        # backend call is not awaited: the memory backend never blocks and a
+        # redis lookup is one short round trip.
+        found, value = self.backend.get(key)
+        with self._lock:
+            if found:
+                self.hits += 1
+                return value
+            self.misses += 1
+            generation = self._generation
+        value = await loader()
+        with self._lock:
+            if generation == self._generation:
+                self.backend.set(key, value)
+        return value
+
+    def invalidate(self, *keys):
+        with self._lock:
+            self._generation += 1
+            self.backend.delete(*keys)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'backend': type(self.backend).__name__,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+def make_backend(config):
+    ttl = config['CACHE_TTL']
+    if config['CACHE_BACKEND'] == 'redis':
+        return RedisBackend(config['CACHE_URL'], ttl)
+    return MemoryBackend(ttl, config['CACHE_MAX_ENTRIES'])
+
+
+# the backend is picked from the config by create_app()
+view_cache = ReadThroughCache()
+
+
+# Cached readers used by the views
+
+LOT_SUMMARIES_KEY = 'lot_summaries'
+
+
+def spot_grid_key(lot_id):
+    return f'spot_grid:{lot_id}'
+
+
+def _load_lot_summaries():
+    return [occupancy_summary(row) for row in db.session.execute(lot_summaries_select())]
+
+
+def lot_summaries():
+    return view_cache.get_or_load(LOT_SUMMARIES_KEY, _load_lot_summaries)
+
+
+def lot_summary(lot_id):
+    for lot in lot_summaries():
+        if lot['id'] == lot_id:
+            return lot
+    return None
+
+
+def spot_grid_select(lot_id):
+    return select(
+        ParkingSpot.id, ParkingSpot.spot_number, ParkingSpot.occupied_status, ParkingSpot.deleted_spot
+    ).where(ParkingSpot.lot_id == lot_id, ParkingSpot.retired == False).order_by(ParkingSpot.id)
+
+
+def _load_spot_grid(lot_id):
+    return [row._asdict() for row in db.session.execute(spot_grid_select(lot_id))]
+
+
+def spot_grid(lot_id):
+    return view_cache.get_or_load(spot_grid_key(lot_id), lambda: _load_spot_grid(lot_id))
+
+
+def lot_changed(lot_id):
+    # call after the commit that changed the lot, its counters or its spots
+    view_cache.invalidate(LOT_SUMMARIES_KEY, spot_grid_key(lot_id))
@@ -0,0 +1,269 @@
+import json
+import time
+import click
+from flask import Blueprint, current_app
+from models.models import db, init_db
+from models.migrations import migrate
+from controllers.occupancy import check_lot_counters
+from controllers.query_plans import full_scans
+from controllers.rollups import rebuild_rollups
+from controllers.cache import view_cache
+from controllers.billing import reprice_bookings
+from controllers.sweeper import sweep
+from controllers.seed import seed_database, SeedError, SEED_PASSWORD
+from controllers.benchmarks import (run_benchmarks, run_write_test, load_test, idle_connections_test, compare_results,
+                                   COLD_START_TARGET_MS, SCAN_READERS)
+from controllers.exports import ExportError, EXPORTS, EXPORT_FORMATS, parse_range, write_csv, write_parquet, arrow_stream
+
+# flask CLI maintenance commands (top level, e.g. `flask migrate`)
+commands = Blueprint('commands', __name__, cli_group=None)
+
+
+@commands.cli.command('init-db')
+def init_db_command():
+    """Create or upgrade the schema and create the admin account if there is none."""
+    applied, admin_created = init_db()
+    for version, description in applied:
+        click.echo(f"Applied migration {version}: {description}")
+    click.echo("Database schema is up to date.")
+    if admin_created:
+        click.echo("Created the admin account (username 'admin', password 'admin'); change its password.")
+
+
+@commands.cli.command('check-occupancy')
+@click.option('--repair', is_flag=True, help="Overwrite drifted counters with the recounted values.")
+def check_occupancy(repair):
+    """Compare the ParkingLot spot counters against the ParkingSpot rows."""
+    drifted = check_lot_counters(repair=repair)
+    if not drifted:
+        click.echo("All lot counters match the spot table.")
+        return
+    for lot_id, column, stored, expected in drifted:
+        click.echo(f"lot {lot_id}: {column} is {stored}, expected {expected}")
+    if repair:
+        view_cache.clear()
+        click.echo(f"Repaired {len(drifted)} counter(s).")
+    else:
+        click.echo("Run again with --repair to fix them.")
+
+
+@commands.cli.command('migrate')
+def migrate_command():
+    """Apply pending schema migrations to the configured database."""
+    applied = migrate(db)
+    if not applied:
+        click.echo("Database schema is up to date.")
+    for version, description in applied:
+        click.echo(f"Applied migration {version}: {description}")
+
+
+@commands.cli.command('check-query-plans')
+def check_query_plans():
+    """Fail if any hot query falls back to a full table scan."""
+    scans = full_scans()
+    if not scans:
+        click.echo("All hot queries use an index.")
+        return
+    for name, step in scans:
+        click.echo(f"{name}: {step}")
+    raise SystemExit(1)
+
+
+@commands.cli.command('backfill-rollups')
+def backfill_rollups():
+    """Rebuild the usage rollup tables from the full booking history."""
+    with db.engine.begin() as connection:
+        rebuild_rollups(connection)
+    click.echo("Usage rollups rebuilt.")
+
+
+@commands.cli.command('export')
+@click.argument('kind', type=click.Choice(sorted(EXPORTS)))
+@click.option('--format', 'fmt', type=click.Choice(EXPORT_FORMATS), default='csv', show_default=True)
+@click.option('--start', help="First day, YYYY-MM-DD.")
+@click.option('--end', help="Last day (inclusive), YYYY-MM-DD.")
+@click.option('--lot-id', type=int, help="Only this lot.")
+@click.option('--output', '-o', type=click.Path(dir_okay=False), required=True)
+def export_command(kind, fmt, start, end, lot_id, output):
+    """Write the booking history or daily revenue to a CSV, Arrow or Parquet file."""
+    try:
+        start, end = parse_range(start, end)
+        if fmt == 'parquet':
+            write_parquet(kind, output, start, end, lot_id)
+        elif fmt == 'arrow':
+            with open(output, 'wb') as handle:
+                for block in arrow_stream(kind, start, end, lot_id):
+                    handle.write(block)
+        else:
+            with open(output, 'w', newline='') as handle:
+                write_csv(kind, handle, start, end, lot_id)
+    except ExportError as error:
+        raise click.ClickException(str(error))
+    click.echo(f"Wrote {output}")
+
+
+@commands.cli.command('reprice')
+@click.option('--lot-id', type=int, help="Only this lot.")
+@click.option('--start', help="First day, YYYY-MM-DD.")
+@click.option('--end', help="Last day (inclusive), YYYY-MM-DD.")
+@click.option('--apply', is_flag=True, help="Store the new costs and rebuild the usage rollups.")
+def reprice_command(lot_id, start, end, apply):
+    """Price the released bookings again under the current tariffs."""
+    try:
+        start, end = parse_range(start, end)
+    except ExportError as error:
+        raise click.ClickException(str(error))
+    totals = reprice_bookings(lot_id, start, end, apply=apply)
+    if not totals:
+        click.echo("No released bookings in that range.")
+        return
+    for lot, (bookings, billed, repriced, changed) in sorted(totals.items()):
+        click.echo(f"lot {lot}: {bookings} bookings, billed {billed:.2f}, "
+                   f"tariff {repriced:.2f}, {changed} {'changed' if apply else 'would change'}")
+    if apply:
+        with db.engine.begin() as connection:
+            rebuild_rollups(connection)
+        click.echo("Costs updated and usage rollups rebuilt.")
+
+
+@commands.cli.command('sweep-overstays')
+def sweep_overstays():
+    """Run one overstay sweep now (running costs, overstay flags, auto-release, no-show reservations)."""
+    stats = sweep(current_app.config)
+    click.echo(f"Priced {stats['accrued']} open booking(s), flagged {stats['flagged']} overstay(s), "
+               f"released {stats['released']}, expired {stats['expired']} reservation(s).")
+
+
+@commands.cli.command('seed')
+@click.option('--lots', default=20, show_default=True)
+@click.option('--spots', 'spots_per_lot', default=100, show_default=True, help="Spots per lot.")
+@click.option('--users', default=1000, show_default=True)
+@click.option('--bookings', default=100000, show_default=True, help="Released bookings in the history.")
+@click.option('--days', default=365, show_default=True, help="How far back the history goes.")
+@click.option('--occupancy', default=0.6, show_default=True, help="Share of the spots parked right now.")
+@click.option('--seed', default=42, show_default=True, help="Random seed; the same seed gives the same data.")
+def seed_command(lots, spots_per_lot, users, bookings, days, occupancy, seed):
+    """Fill an empty database with synthetic lots, users and booking history."""
+    started = time.perf_counter()
+    try:
+        counts = seed_database(lots, spots_per_lot, users, bookings, days, occupancy, seed)
+    except SeedError as error:
+        raise click.ClickException(str(error))
+    click.echo(f"Seeded {counts['lots']} lots, {counts['spots']} spots, {counts['users']} users, "
+               f"{counts['bookings']} past bookings and {counts['parked']} parked vehicles "
+               f"in {time.perf_counter() - started:.1f}s.")
+    click.echo(f"Seeded users log in with the password '{SEED_PASSWORD}'.")
+
+
+def _print_results(results, previous=None):
+    for name, result in results['results'].items():
+        queries = result.get('queries_per_request')
+        click.echo(f"{name:16} p50 {result['p50_ms']:8.2f} ms  p99 {result['p99_ms']:8.2f} ms  "
+                   f"{result['throughput_rps']:8.1f} req/s" + (f"  {queries:6.2f} queries" if queries is not None else "")
+                   + (f"  {result['errors']} errors" if result.get('errors') else ""))
+    if previous is None:
+        return []
+    click.echo(f"\nCompared with {previous.get('commit')} ({previous.get('created')}):")
+    changes = compare_results(previous, results)
+    for name, metric, before, after, change in changes:
+        click.echo(f"{name:16} {metric:20} {before:10} -> {after:10}  {change:+.1f}%")
+    return changes
+
+
+def _finish(results, output, compare, fail_over):
+    previous = None
+    if compare:
+        with open(compare) as handle:
+            previous = json.load(handle)
+    changes = _print_results(results, previous)
+    if output:
+        with open(output, 'w') as handle:
+            json.dump(results, handle, indent=2)
+        click.echo(f"Results written to {output}")
+    if fail_over is None:
+        return
+    regressed = [name for name, metric, _, _, change in changes if metric == 'p99_ms' and change > fail_over]
+    if regressed:
+        raise click.ClickException(f"p99 latency regressed by more than {fail_over}% on: {', '.join(regressed)}")
+
+
+@commands.cli.command('bench')
+@click.option('--requests', default=200, show_default=True, help="Timed requests per scenario.")
+@click.option('--warmup', default=20, show_default=True)
+@click.option('--startup-runs', default=5, show_default=True, help="Fresh worker start-ups to time (0 skips).")
+@click.option('--admin-password', default='admin', show_default=True)
+@click.option('--output', '-o', type=click.Path(dir_okay=False), help="Save the results as JSON.")
+@click.option('--compare', type=click.Path(exists=True, dir_okay=False), help="Earlier results to compare with.")
+@click.option('--fail-over', type=float, help="Fail if any p99 got this many percent slower.")
+def bench_command(requests, warmup, startup_runs, admin_password, output, compare, fail_over):
+    """Time the hot routes in-process through the Flask test client."""
+    try:
+        results = run_benchmarks(requests, warmup, admin_password, startup_runs)
+    except RuntimeError as error:
+        raise click.ClickException(str(error))
+    _finish(results, output, compare, fail_over)
+    cold_start = results['results'].get('cold_start')
+    if cold_start and cold_start['p50_ms'] > COLD_START_TARGET_MS:
+        raise click.ClickException(f"Cold start p50 of {cold_start['p50_ms']:.0f} ms is over the "
+                                   f"{COLD_START_TARGET_MS} ms target.")
+
+
+def _numbers(value):
+    try:
+        numbers = [int(item) for item in value.split(',') if item.strip()]
+    except ValueError:
+        numbers = []
+    if not numbers or min(numbers) < 1:
+        raise click.BadParameter("Give positive whole numbers separated by commas, e.g. 1,2,4,8.")
+    return numbers
+
+
+@commands.cli.command('writetest')
+@click.option('--writers', default='1,2,4,8', show_default=True, help="Writer process counts to run, comma separated.")
+@click.option('--profiles', default='default,production', show_default=True, help="SQLITE_PROFILE values to compare.")
+@click.option('--duration', default=10.0, show_default=True, help="Seconds each run lasts.")
+@click.option('--readers', default=SCAN_READERS, show_default=True, help="Processes scanning the booking table meanwhile.")
+@click.option('--output', '-o', type=click.Path(dir_okay=False), help="Save the results as JSON.")
+@click.option('--compare', type=click.Path(exists=True, dir_okay=False), help="Earlier results to compare with.")
+@click.option('--fail-over', type=float, help="Fail if any p99 got this many percent slower.")
+def writetest_command(writers, profiles, duration, readers, output, compare, fail_over):
+    """Book and release from several processes at once under each SQLite profile (use a seeded database)."""
+    try:
+        results = run_write_test([profile.strip() for profile in profiles.split(',') if profile.strip()],
+                                 _numbers(writers), duration, readers)
+    except RuntimeError as error:
+        raise click.ClickException(str(error))
+    for name, result in results['results'].items():
+        click.echo(f"{name:16} {result['throughput_rps']:8.1f} writes/s  {result['errors']:4} busy errors  "
+                   f"{result['failed']:4} refused  ({result['journal_mode']})")
+    _finish(results, output, compare, fail_over)
+
+
+@commands.cli.command('loadtest')
+@click.argument('url')
+@click.option('--threads', default=8, show_default=True, help="Concurrent users (plus one admin).")
+@click.option('--duration', default=30.0, show_default=True, help="Seconds to run.")
+@click.option('--admin-password', default='admin', show_default=True)
+@click.option('--output', '-o', type=click.Path(dir_okay=False), help="Save the results as JSON.")
+@click.option('--compare', type=click.Path(exists=True, dir_okay=False), help="Earlier results to compare with.")
+@click.option('--fail-over', type=float, help="Fail if any p99 got this many percent slower.")
+def loadtest_command(url, threads, duration, admin_password, output, compare, fail_over):
+    """Drive a running server over HTTP from several threads (use a seeded database)."""
+    _finish(load_test(url, threads, duration, admin_password), output, compare, fail_over)
+
+
+@commands.cli.command('conntest')
+@click.argument('url')
+@click.option('--connections', default=1000, show_default=True, help="Live streams to hold open.")
+@click.option('--duration', default=10.0, show_default=True, help="Seconds to time requests while they are open.")
+@click.option('--server-pid', type=int, help="Report the thread count of this server process (Linux).")
+@click.option('--output', '-o', type=click.Path(dir_okay=False), help="Save the results as JSON.")
+@click.option('--compare', type=click.Path(exists=True, dir_okay=False), help="Earlier results to compare with.")
+@click.option('--fail-over', type=float, help="Fail if any p99 got this many percent slower.")
+def conntest_command(url, connections, duration, server_pid, output, compare, fail_over):
+    """Hold many idle /live/lots streams open on a running server and time requests meanwhile."""
+    results = idle_connections_test(url, connections, duration, server_pid)
+    settings = results['settings']
+    click.echo(f"Held {settings['held']} of {connections} streams open"
+               + (f" on {settings['server_threads']} server threads." if settings['server_threads'] else "."))
+    _finish(results, output, compare, fail_over)
@@ -1,10 +1,64 @@
 from dotenv import load_dotenv
 import os
-from app import app
+from models.engine import engine_options, SQLITE_PROFILES
 
 
 load_dotenv()
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('SQLALCHEMY_DATABASE_URI')
-app.config['TRACK_MODIFICATOIN'] = os.getenv('TRACK_MODIFICATION')
-app.config['SECRET_KEY']  = os.getenv('SECRET_KEY')
 
+
+def load_config(app, overrides=None):
+    # settings from the environment (and .env); overrides (e.g. a test
+    # database URI) are applied before the engine options are derived
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('SQLALCHEMY_DATABASE_URI')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = os.getenv('TRACK_MODIFICATION', 'false').lower() == 'true'
+    app.config['SECRET_KEY']  = os.getenv('SECRET_KEY')
+    # keep role/active flags in the signed session so admin checks skip the DB
+    app.config['SESSION_ROLE_CACHE'] = os.getenv('SESSION_ROLE_CACHE', 'false').lower() == 'true'
+
+    # lot card / spot grid cache: 'memory' (per worker) or 'redis' (shared, needs CACHE_URL)
+    app.config['CACHE_BACKEND'] = os.getenv('CACHE_BACKEND', 'memory')
+    app.config['CACHE_URL'] = os.getenv('CACHE_URL', 'redis://localhost:6379/0')
+    app.config['CACHE_TTL'] = float(os.getenv('CACHE_TTL', '30'))
+    app.config['CACHE_MAX_ENTRIES'] = int(os.getenv('CACHE_MAX_ENTRIES', '1024'))
+
+    # database engine profile (see models/engine.py): 'production', 'safe' or 'default'
+    app.config['SQLITE_PROFILE'] = os.getenv('SQLITE_PROFILE', 'production')
+    # extra or overriding PRAGMAs, e.g. "busy_timeout=10000,cache_size=-131072"
+    app.config['SQLITE_PRAGMAS'] = os.getenv('SQLITE_PRAGMAS', '')
+    app.config['DB_POOL_SIZE'] = int(os.getenv('DB_POOL_SIZE')) if os.getenv('DB_POOL_SIZE') else None
+    app.config['DB_MAX_OVERFLOW'] = int(os.getenv('DB_MAX_OVERFLOW')) if os.getenv('DB_MAX_OVERFLOW') else None
+
+    # overstay sweeper (see controllers/sweeper.py); OVERSTAY_RELEASE_HOURS=0 only flags
+    app.config['SWEEPER_ENABLED'] = os.getenv('SWEEPER_ENABLED', 'true').lower() == 'true'
+    app.config['SWEEP_INTERVAL'] = float(os.getenv('SWEEP_INTERVAL', '300'))
+    app.config['OVERSTAY_HOURS'] = float(os.getenv('OVERSTAY_HOURS', '24'))
+    app.config['OVERSTAY_RELEASE_HOURS'] = float(os.getenv('OVERSTAY_RELEASE_HOURS', '0'))
+
+    # advance reservations (see controllers/reservations.py): a parked vehicle is
+    # assumed to stay RESERVATION_HOLD_MINUTES, and a spot reserved that soon is
+    # kept from walk-ins; a reservation not checked into RESERVATION_GRACE_MINUTES
+    # after its start expires
+    app.config['RESERVATION_HOLD_MINUTES'] = float(os.getenv('RESERVATION_HOLD_MINUTES', '120'))
+    app.config['RESERVATION_EARLY_MINUTES'] = float(os.getenv('RESERVATION_EARLY_MINUTES', '15'))
+    app.config['RESERVATION_GRACE_MINUTES'] = float(os.getenv('RESERVATION_GRACE_MINUTES', '15'))
+    app.config['RESERVATION_MAX_HOURS'] = float(os.getenv('RESERVATION_MAX_HOURS', '24'))
+    app.config['RESERVATION_MAX_DAYS'] = float(os.getenv('RESERVATION_MAX_DAYS', '30'))
+
+    # ASGI serving (see controllers/asgi.py): the async database URI defaults to the
+    # sync one with its async driver; the other routes run on ASGI_WSGI_THREADS threads
+    app.config['ASYNC_DATABASE_URI'] = os.getenv('ASYNC_DATABASE_URI')
+    app.config['ASGI_WSGI_THREADS'] = int(os.getenv('ASGI_WSGI_THREADS', '10'))
+
+    # request timing, SQL counts and /metrics (see controllers/instrumentation.py)
+    app.config['INSTRUMENTATION'] = os.getenv('INSTRUMENTATION', 'false').lower() == 'true'
+    app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN', '')
+    app.config['N_PLUS_ONE_THRESHOLD'] = int(os.getenv('N_PLUS_ONE_THRESHOLD', '10'))
+    app.config['SLOW_REQUEST_MS'] = float(os.getenv('SLOW_REQUEST_MS', '500'))
+    app.config['PROFILE_SLOW_REQUESTS'] = os.getenv('PROFILE_SLOW_REQUESTS', 'false').lower() == 'true'
+    app.config['PROFILE_INTERVAL_MS'] = float(os.getenv('PROFILE_INTERVAL_MS', '5'))
+    app.config['PROFILE_DIR'] = os.getenv('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+
+    app.config.update(overrides or {})
+    if app.config['SQLITE_PROFILE'] not in SQLITE_PROFILES:
+        raise RuntimeError(f"SQLITE_PROFILE must be one of {', '.join(SQLITE_PROFILES)}")
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
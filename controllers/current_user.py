@@ -0,0 +1,34 @@
+from flask import g, session, current_app
+from models.models import db, User
+
+# Request-scoped current user.
+# The logged-in User is loaded at most once per request and shared by the
+# decorators, the context processor and the views. With SESSION_ROLE_CACHE
+# enabled, the role and active flags are also kept in the signed session
+# cookie at login, so admin_required can authorise without a query.
+
+
+def current_user():
+    if 'user_id' not in session:
+        return None
+    if 'current_user' not in g:
+        g.current_user = db.session.get(User, session['user_id'])
+    return g.current_user
+
+
+def remember_user(user):
+    session['user_id'] = user.id
+    session['is_admin'] = user.is_admin
+    session['is_active_user'] = user.is_active_user
+
+
+def forget_user():
+    for key in ('user_id', 'is_admin', 'is_active_user'):
+        session.pop(key, None)
+
+
+def is_admin():
+    if current_app.config['SESSION_ROLE_CACHE'] and 'is_admin' in session:
+        return session['is_admin'] and session['is_active_user']
+    user = current_user()
+    return user is not None and user.is_admin and user.is_active_user
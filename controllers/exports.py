@@ -0,0 +1,227 @@
+import csv
+import io
+from datetime import datetime, timedelta
+from sqlalchemy import Boolean, Date, DateTime, Float, Integer, select
+from models.models import db, User, ParkingLot, ParkingSpot, Bookedspot, LotDailyUsage
+
+# Streaming exports of the booking history and the daily revenue.
+# Rows are read with yield_per, so the driver fetches EXPORT_CHUNK rows at a
+# time and only one chunk is in memory however long the export is. Each
+# chunk becomes one block of CSV text, one Arrow record batch or one Parquet
+# row group. Arrow and Parquet need the optional pyarrow package, which is
+# only imported by the first Arrow or Parquet export (it is slow to import).
+
+EXPORT_CHUNK = 5000
+EXPORT_FORMATS = ('csv', 'arrow', 'parquet')
+
+
+class ExportError(Exception):
+    pass
+
+
+def _bookings_query(start, end, lot_id):
+    query = select(
+        Bookedspot.id.label('booking_id'),
+        ParkingLot.id.label('lot_id'),
+        ParkingLot.lot_name,
+        ParkingLot.city,
+        ParkingSpot.id.label('spot_id'),
+        ParkingSpot.spot_number,
+        User.id.label('user_id'),
+        User.username,
+        Bookedspot.vehicle_number,
+        Bookedspot.entry_timing,
+        Bookedspot.exit_timing,
+        Bookedspot.parking_cost,
+        Bookedspot.vehicle_released
+    ).join(ParkingSpot, ParkingSpot.id == Bookedspot.spot_id
+    ).join(ParkingLot, ParkingLot.id == ParkingSpot.lot_id
+    ).join(User, User.id == Bookedspot.user_id)
+    if start is not None:
+        query = query.where(Bookedspot.entry_timing >= start)
+    if end is not None:
+        query = query.where(Bookedspot.entry_timing < end)
+    if lot_id is not None:
+        query = query.where(ParkingSpot.lot_id == lot_id)
+    return query.order_by(Bookedspot.id)
+
+
+def _revenue_query(start, end, lot_id):
+    query = select(
+        LotDailyUsage.day,
+        ParkingLot.id.label('lot_id'),
+        ParkingLot.lot_name,
+        LotDailyUsage.bookings,
+        LotDailyUsage.released,
+        LotDailyUsage.revenue
+    ).join(ParkingLot, ParkingLot.id == LotDailyUsage.lot_id)
+    if start is not None:
+        query = query.where(LotDailyUsage.day >= start.date())
+    if end is not None:
+        query = query.where(LotDailyUsage.day < end.date())
+    if lot_id is not None:
+        query = query.where(LotDailyUsage.lot_id == lot_id)
+    return query.order_by(LotDailyUsage.day, LotDailyUsage.lot_id)
+
+
+EXPORTS = {
+    'bookings': _bookings_query,
+    'revenue': _revenue_query,
+}
+
+
+def parse_range(start, end):
+    # 'YYYY-MM-DD' strings (both optional, end inclusive) -> datetimes, end exclusive
+    try:
+        start = datetime.fromisoformat(start) if start else None
+        end = datetime.fromisoformat(end) + timedelta(days=1) if end else None
+    except ValueError:
+        raise ExportError("Dates must look like 2025-01-31.")
+    return start, end
+
+
+def _columns(kind):
+    return list(EXPORTS[kind](None, None, None).selected_columns.keys())
+
+
+def export_chunks(kind, start=None, end=None, lot_id=None):
+    # yields (column names, list of row tuples) one chunk at a time
+    if kind not in EXPORTS:
+        raise ExportError(f"Unknown export '{kind}'.")
+    query = EXPORTS[kind](start, end, lot_id).execution_options(yield_per=EXPORT_CHUNK)
+    result = db.session.execute(query)
+    columns = list(result.keys())
+    for rows in result.partitions():
+        yield columns, [tuple(row) for row in rows]
+
+
+def _csv_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ', timespec='seconds')
+    return value
+
+
+def csv_stream(kind, start=None, end=None, lot_id=None):
+    # text blocks: the header, then one block per chunk
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    header_written = False
+    for columns, rows in export_chunks(kind, start, end, lot_id):
+        if not header_written:
+            writer.writerow(columns)
+            header_written = True
+        writer.writerows([_csv_value(value) for value in row] for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if not header_written:
+        # nothing matched; still send the column names
+        writer.writerow(_columns(kind))
+        yield buffer.getvalue()
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ExportError("Arrow and Parquet exports need the pyarrow package (pip install pyarrow).")
+    return pyarrow
+
+
+def _arrow_type(pyarrow, column_type):
+    # Arrow type of an export column, from its SQLAlchemy type
+    types = [
+        (DateTime, pyarrow.timestamp('us')),
+        (Date, pyarrow.date32()),
+        (Boolean, pyarrow.bool_()),
+        (Integer, pyarrow.int64()),
+        (Float, pyarrow.float64()),
+    ]
+    for sql_type, arrow_type in types:
+        if isinstance(column_type, sql_type):
+            return arrow_type
+    return pyarrow.string()
+
+
+def _arrow_schema(pyarrow, kind):
+    # one schema for every batch: a chunk in which a nullable column is all
+    # null would otherwise get a null-typed column the writers reject
+    columns = EXPORTS[kind](None, None, None).selected_columns
+    return pyarrow.schema([(name, _arrow_type(pyarrow, column.type)) for name, column in columns.items()])
+
+
+def _record_batches(pyarrow, kind, start, end, lot_id):
+    schema = _arrow_schema(pyarrow, kind)
+    empty = True
+    for columns, rows in export_chunks(kind, start, end, lot_id):
+        empty = False
+        yield pyarrow.RecordBatch.from_pydict(
+            {name: list(values) for name, values in zip(columns, zip(*rows))}, schema=schema)
+    if empty:
+        # nothing matched; an empty batch still carries the column names
+        yield pyarrow.RecordBatch.from_pydict({name: [] for name in schema.names}, schema=schema)
+
+
+class _Drain:
+    # write-only file for pyarrow that hands back what was written so far
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def writable(self):
+        return True
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def arrow_stream(kind, start=None, end=None, lot_id=None):
+    # Arrow IPC stream: the schema, then one message per chunk
+    pyarrow = _require_pyarrow()
+    drain = _Drain()
+    writer = None
+    for batch in _record_batches(pyarrow, kind, start, end, lot_id):
+        if writer is None:
+            writer = pyarrow.ipc.new_stream(pyarrow.PythonFile(drain, mode='w'), batch.schema)
+        writer.write_batch(batch)
+        yield drain.drain()
+    writer.close()
+    yield drain.drain()
+
+
+def write_parquet(kind, path, start=None, end=None, lot_id=None):
+    # one row group per chunk; returns the number of rows written
+    pyarrow = _require_pyarrow()
+    writer = None
+    count = 0
+    for batch in _record_batches(pyarrow, kind, start, end, lot_id):
+        if writer is None:
+            writer = pyarrow.parquet.ParquetWriter(path, batch.schema)
+        writer.write_batch(batch)
+        count += batch.num_rows
+    writer.close()
+    return count
+
+
+def write_csv(kind, output, start=None, end=None, lot_id=None):
+    for block in csv_stream(kind, start, end, lot_id):
+        output.write(block)
@@ -0,0 +1,259 @@
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError
+from models.models import db, User, ParkingLot, ParkingSpot, Bookedspot
+from controllers.occupancy import adjust_lot_counters
+from controllers.allocation import AUTO_ALLOCATE_RETRIES
+from controllers.billing import price_stays
+from controllers.rollups import bookings_opened, bookings_released
+from controllers.spot_pool import free_spot_pool
+from controllers.cache import lot_changed
+from controllers.live import occupancy_changed
+from controllers.vehicles import normalize_vehicle_number
+from controllers.reservations import reservation_index, hold_time, overlapping, complete_reservations
+
+# Bulk gate operations.
+# A batch of entry/exit events from the gate operators is applied in one
+# transaction with a fixed number of statements per lot instead of several
+# lookups and a commit per vehicle:
+#   exits   - one query finds the open bookings of all the vehicles, the costs
+#             are priced in one pass per lot (a Python loop over the compiled
+#             tariff tables, see CompiledTariff.costs), and the bookings,
+#             spots, counters and rollups are updated with one bulk
+#             statement each;
+#   entries - one query resolves the drivers, one UPDATE ... RETURNING per lot
+#             claims the lowest free spots, and one multi-row INSERT opens the
+#             bookings.
+# Exits are applied before entries so a batch can hand freed spots straight
+# to arriving vehicles. An item that cannot be applied is reported in its
+# result and does not affect the rest of the batch.
+
+GATE_MAX_EVENTS = 5000
+
+
+class GateError(Exception):
+    pass
+
+
+def _parse_event(index, event):
+    kind = event.get('type')
+    if kind not in ('entry', 'exit'):
+        raise ValueError("type must be 'entry' or 'exit'.")
+    vehicle_number = normalize_vehicle_number(event.get('vehicle_number'))
+    if not vehicle_number:
+        raise ValueError("vehicle_number is required.")
+    lot_id = event.get('lot_id')
+    # JSON true/false arrive as bool, which is an int subclass
+    if lot_id is not None and (isinstance(lot_id, bool) or not isinstance(lot_id, int)):
+        raise ValueError("lot_id must be a number.")
+    if kind == 'entry' and (lot_id is None or not event.get('username')):
+        raise ValueError("An entry needs a lot_id and the driver's username.")
+    timestamp = event.get('timestamp')
+    try:
+        timestamp = datetime.fromisoformat(timestamp) if timestamp else datetime.now()
+    except (TypeError, ValueError):
+        raise ValueError("timestamp must be an ISO 8601 date and time.")
+    if timestamp.tzinfo is not None:
+        # stored times are naive local time, so an offset is converted to it
+        timestamp = timestamp.astimezone().replace(tzinfo=None)
+    return {'index': index, 'type': kind, 'vehicle_number': vehicle_number, 'lot_id': lot_id,
+            'username': event.get('username'), 'timestamp': timestamp}
+
+
+def _fail(results, item, message):
+    results[item['index']].update(ok=False, error=message)
+
+
+def _claim_spots(lot_id, count):
+    # claims up to count of the lowest free spots that are not reserved
+    # within the hold time, returns [(spot_id, spot_number)]
+    now = datetime.now()
+    reserved_soon = overlapping(ParkingSpot.id, now, now + hold_time())
+    claimed = []
+    for _ in range(AUTO_ALLOCATE_RETRIES):
+        candidates = [spot_id for (spot_id,) in db.session.query(ParkingSpot.id).filter_by(
+            lot_id=lot_id, occupied_status=False, deleted_spot=True
+        ).filter(~reserved_soon).order_by(ParkingSpot.id).limit(count - len(claimed))]
+        if not candidates:
+            break
+        claimed += db.session.execute(
+            update(ParkingSpot)
+            .where(ParkingSpot.id.in_(candidates),
+                   ParkingSpot.occupied_status == False,
+                   ParkingSpot.deleted_spot == True,
+                   ~reserved_soon)
+            .values(occupied_status=True)
+            .returning(ParkingSpot.id, ParkingSpot.spot_number)
+            .execution_options(synchronize_session=False)
+        ).all()
+        if len(claimed) == count:
+            break
+    return sorted(claimed)
+
+
+def _apply_exits(items, results, changed, completed):
+    rows = db.session.query(
+        Bookedspot.id, Bookedspot.vehicle_number, Bookedspot.user_id, Bookedspot.entry_timing,
+        ParkingSpot.id.label('spot_id'), ParkingSpot.spot_number, ParkingSpot.lot_id,
+        ParkingSpot.deleted_spot, ParkingLot.price, ParkingLot.tariff_version
+    ).join(ParkingSpot, ParkingSpot.id == Bookedspot.spot_id
+    ).join(ParkingLot, ParkingLot.id == ParkingSpot.lot_id
+    ).filter(Bookedspot.vehicle_released == False,
+             Bookedspot.vehicle_number.in_({item['vehicle_number'] for item in items})).all()
+
+    open_bookings = defaultdict(list)
+    for row in rows:
+        open_bookings[row.vehicle_number].append(row)
+
+    matched = []
+    for item in items:
+        candidates = [row for row in open_bookings[item['vehicle_number']]
+                      if item['lot_id'] is None or row.lot_id == item['lot_id']]
+        if not candidates:
+            _fail(results, item, "No active booking for this vehicle.")
+            continue
+        row = candidates[0]
+        if item['timestamp'] < row.entry_timing:
+            _fail(results, item, "Exit time is before the entry time.")
+            continue
+        open_bookings[item['vehicle_number']].remove(row)
+        matched.append((item, row))
+    if not matched:
+        return
+
+    # one pass over the whole batch, lot by lot through the compiled tariffs
+    costs = price_stays([(row.lot_id, row.price, row.tariff_version, row.entry_timing, item['timestamp'])
+                         for item, row in matched])
+
+    # compare-and-set on vehicle_released, as in release_booking
+    released = set(db.session.execute(
+        update(Bookedspot)
+        .where(Bookedspot.id.in_([row.id for _, row in matched]), Bookedspot.vehicle_released == False)
+        .values(vehicle_released=True)
+        .returning(Bookedspot.id)
+        .execution_options(synchronize_session=False)
+    ).scalars())
+
+    billed = []
+    for (item, row), cost in zip(matched, costs):
+        if row.id not in released:
+            _fail(results, item, "Invalid or already released spot.")
+            continue
+        billed.append((item, row, cost))
+        results[item['index']].update(ok=True, booking_id=row.id, lot_id=row.lot_id,
+                                      spot_number=row.spot_number, cost=cost)
+    if not billed:
+        return
+
+    db.session.execute(update(Bookedspot), [
+        {'id': row.id, 'exit_timing': item['timestamp'], 'parking_cost': cost} for item, row, cost in billed
+    ])
+    db.session.execute(
+        update(ParkingSpot)
+        .where(ParkingSpot.id.in_([row.spot_id for _, row, _ in billed]))
+        .values(occupied_status=False)
+        .execution_options(synchronize_session=False)
+    )
+    deltas = defaultdict(lambda: [0, 0])
+    for _, row, _ in billed:
+        deltas[row.lot_id][0] -= 1
+        deltas[row.lot_id][1] += 1 if row.deleted_spot else 0
+        changed[row.lot_id].append((row.spot_id, row.spot_number, row.deleted_spot))
+    for lot_id, (occupied, free) in deltas.items():
+        adjust_lot_counters(lot_id, occupied=occupied, free=free)
+    bookings_released([(row.lot_id, row.user_id, row.entry_timing, cost) for _, row, cost in billed])
+    completed += complete_reservations([row.id for _, row, _ in billed])
+
+
+def _apply_entries(items, results, changed):
+    users = dict(db.session.query(User.username, User.id).filter(
+        User.username.in_({item['username'] for item in items}), User.is_active_user == True))
+    parked = {user_id for (user_id,) in db.session.query(Bookedspot.user_id).filter(
+        Bookedspot.user_id.in_(users.values()), Bookedspot.vehicle_released == False)}
+    parked_vehicles = {plate for (plate,) in db.session.query(Bookedspot.vehicle_number).filter(
+        Bookedspot.vehicle_number.in_({item['vehicle_number'] for item in items}),
+        Bookedspot.vehicle_released == False)}
+
+    by_lot = defaultdict(list)
+    for item in items:
+        user_id = users.get(item['username'])
+        if user_id is None:
+            _fail(results, item, "Unknown or blocked user.")
+        elif user_id in parked:
+            _fail(results, item, "You already have an active booking.")
+        elif item['vehicle_number'] in parked_vehicles:
+            _fail(results, item, f"Vehicle {item['vehicle_number']} is already parked.")
+        else:
+            parked.add(user_id)
+            parked_vehicles.add(item['vehicle_number'])
+            by_lot[item['lot_id']].append((item, user_id))
+
+    bookings = []
+    for lot_id, group in by_lot.items():
+        spots = _claim_spots(lot_id, len(group))
+        for (item, user_id), spot in zip(group, spots):
+            bookings.append((item, user_id, lot_id, spot))
+        for item, _ in group[len(spots):]:
+            _fail(results, item, "No free spots left in this lot.")
+        if spots:
+            adjust_lot_counters(lot_id, occupied=len(spots), free=-len(spots))
+    if not bookings:
+        return
+
+    booking_ids = db.session.scalars(
+        insert(Bookedspot).returning(Bookedspot.id, sort_by_parameter_order=True),
+        [{'user_id': user_id, 'spot_id': spot_id, 'vehicle_number': item['vehicle_number'],
+          'entry_timing': item['timestamp'], 'vehicle_released': False}
+         for item, user_id, _, (spot_id, _) in bookings]
+    ).all()
+    for booking_id, (item, _, lot_id, (spot_id, spot_number)) in zip(booking_ids, bookings):
+        results[item['index']].update(ok=True, booking_id=booking_id, lot_id=lot_id, spot_number=spot_number)
+        changed[lot_id].append((spot_id, spot_number, None))
+    bookings_opened([(lot_id, user_id, item['timestamp']) for item, user_id, lot_id, _ in bookings])
+
+
+def process_gate_events(events):
+    # returns one result dict per event, in the order given
+    if len(events) > GATE_MAX_EVENTS:
+        raise GateError(f"A batch can hold at most {GATE_MAX_EVENTS} events.")
+
+    results = []
+    items = {'entry': [], 'exit': []}
+    for index, event in enumerate(events):
+        results.append({'index': index, 'type': event.get('type') if isinstance(event, dict) else None,
+                        'ok': False})
+        try:
+            if not isinstance(event, dict):
+                raise ValueError("Each event must be an object.")
+            item = _parse_event(index, event)
+        except ValueError as error:
+            results[index]['error'] = str(error)
+            continue
+        items[item['type']].append(item)
+
+    # lot_id -> [(spot_id, spot_number, active)]; active is None for a claimed spot
+    changed = defaultdict(list)
+    # reservations completed by the exits, see controllers/reservations.py
+    completed = []
+    try:
+        if items['exit']:
+            _apply_exits(items['exit'], results, changed, completed)
+        if items['entry']:
+            _apply_entries(items['entry'], results, changed)
+        db.session.commit()
+    except IntegrityError:
+        # a booking made through the website raced with the batch
+        db.session.rollback()
+        raise GateError("The batch conflicted with another booking, please send it again.")
+
+    reservation_index.forget(completed)
+    for lot_id, spots in changed.items():
+        for spot_id, spot_number, active in spots:
+            if active:
+                free_spot_pool.add(lot_id, spot_id, spot_number)
+            else:
+                free_spot_pool.discard(lot_id, spot_id)
+        lot_changed(lot_id)
+        occupancy_changed(lot_id, [spot_id for spot_id, _, _ in spots])
+    return results
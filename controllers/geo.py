@@ -0,0 +1,216 @@
+import threading
+from collections import defaultdict
+from math import asin, cos, floor, radians, sin, sqrt
+from sqlalchemy import func, select
+from models.models import db, ParkingLot
+from controllers.users import _prefix_range
+from controllers.cache import lot_summaries
+
+# Lot search by city, pin code prefix and distance.
+# The city and pin filters are indexed queries (ix_parking_lot_city on
+# lower(city), and pin_code as a range on ix_parking_lot_pin_code). Free
+# counts come from the cached lot cards. Distances come from an in-memory
+# grid of the lot coordinates: cells of GRID_DEGREES (about 2 km), searched
+# ring by ring outward from the searcher's cell, so "the nearest lot with a
+# free spot" looks at the lots around the searcher instead of all of them.
+#
+# The grid lives in the worker and follows the lot cards: every search
+# syncs it with the cards it ranks, and only the lots that were added,
+# moved or deleted since the last sync are re-indexed. The cards are
+# invalidated by every lot edit (lot_changed), so a moved lot is found at
+# its new place by the next search in this worker, and within CACHE_TTL
+# in the others.
+
+GRID_DEGREES = 0.02
+KM_PER_DEGREE = 111.195
+EARTH_RADIUS_KM = 6371.0
+SEARCH_LIMIT = 10
+SEARCH_MAX_LIMIT = 50
+
+
+class GeoError(Exception):
+    pass
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    # haversine
+    lat1, lon1, lat2, lon2 = map(radians, (lat1, lon1, lat2, lon2))
+    a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * asin(sqrt(a))
+
+
+def _position(lot):
+    if lot['latitude'] is None or lot['longitude'] is None:
+        return None
+    return lot['latitude'], lot['longitude']
+
+
+class LotGrid:
+    def __init__(self, cell_degrees=GRID_DEGREES):
+        self.cell_degrees = cell_degrees
+        self._lock = threading.Lock()
+        self._positions = {}
+        self._cells = defaultdict(set)
+        self._synced = None
+
+    def _cell(self, lat, lon):
+        return floor(lat / self.cell_degrees), floor(lon / self.cell_degrees)
+
+    def _move(self, lot_id, position):
+        old = self._positions.pop(lot_id, None)
+        if old is not None:
+            cell = self._cell(*old)
+            self._cells[cell].discard(lot_id)
+            if not self._cells[cell]:
+                del self._cells[cell]
+        if position is not None:
+            self._positions[lot_id] = position
+            self._cells[self._cell(*position)].add(lot_id)
+
+    def sync(self, lots):
+        # lots: the lot cards; returns how many lots were re-indexed
+        if lots is self._synced:
+            # the memory cache hands out the same list until it changes
+            return 0
+        changed = 0
+        with self._lock:
+            seen = set()
+            for lot in lots:
+                seen.add(lot['id'])
+                position = _position(lot)
+                if self._positions.get(lot['id']) != position:
+                    self._move(lot['id'], position)
+                    changed += 1
+            for lot_id in set(self._positions) - seen:
+                self._move(lot_id, None)
+                changed += 1
+            self._synced = lots
+        return changed
+
+    def _ring(self, row, col, radius):
+        # the cells at Chebyshev distance radius around (row, col)
+        if radius == 0:
+            yield row, col
+            return
+        for c in range(col - radius, col + radius + 1):
+            yield row - radius, c
+            yield row + radius, c
+        for r in range(row - radius + 1, row + radius):
+            yield r, col - radius
+            yield r, col + radius
+
+    def nearest(self, lat, lon, accept, limit, max_km=None):
+        # [(lot_id, km)] of up to limit accepted lots, nearest first
+        row, col = self._cell(lat, lon)
+        found = []
+        with self._lock:
+            remaining = len(self._positions)
+            visited = 0
+            radius = 0
+            while remaining:
+                visited += max(8 * radius, 1)
+                if visited > len(self._cells):
+                    # the rings have cost more than a pass over the occupied
+                    # cells would (sparse lots, or a searcher far from them):
+                    # check the rest directly
+                    for cell, ids in self._cells.items():
+                        if max(abs(cell[0] - row), abs(cell[1] - col)) >= radius:
+                            found.extend((distance_km(lat, lon, *self._positions[lot_id]), lot_id)
+                                         for lot_id in ids if accept(lot_id))
+                    break
+                for cell in self._ring(row, col, radius):
+                    ids = self._cells.get(cell)
+                    if ids:
+                        remaining -= len(ids)
+                        found.extend((distance_km(lat, lon, *self._positions[lot_id]), lot_id)
+                                     for lot_id in ids if accept(lot_id))
+                # every lot outside this ring is at least this far away
+                bound = radius * self.cell_degrees * KM_PER_DEGREE * cos(
+                    radians(min(89.0, abs(lat) + (radius + 1) * self.cell_degrees)))
+                if max_km is not None and bound > max_km:
+                    break
+                if len(found) >= limit:
+                    found.sort()
+                    del found[limit:]
+                    if found[-1][0] <= bound:
+                        break
+                radius += 1
+        found.sort()
+        return [(lot_id, km) for km, lot_id in found[:limit] if max_km is None or km <= max_km]
+
+
+lot_grid = LotGrid()
+
+
+def lot_filter_query(city=None, pin=None):
+    query = select(ParkingLot.id)
+    if city:
+        query = query.where(func.lower(ParkingLot.city) == city.lower())
+    if pin:
+        query = query.where(_prefix_range(ParkingLot.pin_code, pin))
+    return query
+
+
+def _number(value, name, low, high):
+    if value in (None, ''):
+        return None
+    try:
+        value = float(value)
+    except ValueError:
+        raise GeoError(f"{name} must be a number.")
+    if not low <= value <= high:
+        raise GeoError(f"{name} must be between {low} and {high}.")
+    return value
+
+
+def parse_coordinates(latitude, longitude):
+    # (latitude, longitude), both None when neither is given
+    latitude = _number(latitude, "Latitude", -90, 90)
+    longitude = _number(longitude, "Longitude", -180, 180)
+    if (latitude is None) != (longitude is None):
+        raise GeoError("Give both the latitude and the longitude, or neither.")
+    return latitude, longitude
+
+
+def parse_search(args):
+    # the query string of the search page and the search API
+    latitude, longitude = parse_coordinates(args.get('lat'), args.get('lon'))
+    try:
+        limit = min(max(int(args.get('limit') or SEARCH_LIMIT), 1), SEARCH_MAX_LIMIT)
+    except ValueError:
+        raise GeoError("Limit must be a number.")
+    return {
+        'city': (args.get('city') or '').strip() or None,
+        'pin': (args.get('pin') or '').strip() or None,
+        'latitude': latitude,
+        'longitude': longitude,
+        'available': args.get('available') in ('1', 'true', 'on'),
+        'radius_km': _number(args.get('radius_km'), "Radius", 0, 20000),
+        'limit': limit,
+    }
+
+
+def search_lots(city=None, pin=None, latitude=None, longitude=None, available=False, radius_km=None,
+                limit=SEARCH_LIMIT):
+    # lot cards, nearest first (ties: more free spots first) with a position,
+    # otherwise most free spots first; near ones carry distance_km.
+    # limit=None returns every match
+    lots = lot_summaries()
+    limit = limit or len(lots)
+    by_id = {lot['id']: lot for lot in lots}
+    matching = set(db.session.scalars(lot_filter_query(city, pin))) if city or pin else None
+
+    def accept(lot_id):
+        lot = by_id.get(lot_id)
+        return (lot is not None and (matching is None or lot_id in matching)
+                and (not available or lot['available_parking_spots'] > 0))
+
+    if latitude is None:
+        found = [lot for lot in lots if accept(lot['id'])]
+        found.sort(key=lambda lot: -lot['available_parking_spots'])
+        return found[:limit]
+
+    lot_grid.sync(lots)
+    nearest = lot_grid.nearest(latitude, longitude, accept, limit, radius_km)
+    nearest.sort(key=lambda item: (round(item[1], 1), -by_id[item[0]]['available_parking_spots']))
+    return [dict(by_id[lot_id], distance_km=round(km, 2)) for lot_id, km in nearest]
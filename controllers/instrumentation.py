@@ -0,0 +1,243 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from flask import g, request, has_request_context, before_render_template, template_rendered, Response, abort, current_app
+from sqlalchemy import event
+from models.models import db
+from controllers.current_user import is_admin
+from controllers.cache import view_cache
+from controllers.live import occupancy_broker
+
+# Opt-in request instrumentation (INSTRUMENTATION=true).
+# For every request it measures the wall time, the number of SQL statements
+# and the time spent in them (engine events), and the template render time
+# (Flask's template signals). Each response carries the numbers in a
+# Server-Timing header; a statement that runs N_PLUS_ONE_THRESHOLD or more
+# times in one request is logged as a likely N+1. /metrics serves the
+# totals and per-endpoint latency histograms in the Prometheus text format.
+# The numbers are per worker process.
+#
+# PROFILE_SLOW_REQUESTS=true adds a sampling profiler: a background thread
+# samples the stacks of the threads that are serving a request, and the
+# samples of every request slower than SLOW_REQUEST_MS are written to
+# PROFILE_DIR as folded stacks (flamegraph.pl / speedscope input).
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Metrics:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        # (endpoint, method) -> [count per bucket..., +Inf count]
+        self.latency = defaultdict(lambda: [0] * (len(buckets) + 1))
+        self.latency_sum = defaultdict(float)
+        self.requests = Counter()
+        self.queries = Counter()
+        self.db_seconds = defaultdict(float)
+        self.template_seconds = defaultdict(float)
+        self.n_plus_one = Counter()
+        self.profiles = 0
+
+    def observe(self, endpoint, method, status, seconds, queries, db_seconds, template_seconds, n_plus_one):
+        with self._lock:
+            counts = self.latency[(endpoint, method)]
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    counts[index] += 1
+            counts[-1] += 1
+            self.latency_sum[(endpoint, method)] += seconds
+            self.requests[(endpoint, method, status)] += 1
+            self.queries[endpoint] += queries
+            self.db_seconds[endpoint] += db_seconds
+            self.template_seconds[endpoint] += template_seconds
+            self.n_plus_one[endpoint] += n_plus_one
+
+    def profile_written(self):
+        with self._lock:
+            self.profiles += 1
+
+    def render(self):
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            family('parkmatrix_request_duration_seconds', 'histogram', "Request latency by endpoint.")
+            for (endpoint, method), counts in sorted(self.latency.items()):
+                labels = f'endpoint="{endpoint}",method="{method}"'
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(f'parkmatrix_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'parkmatrix_request_duration_seconds_bucket{{{labels},le="+Inf"}} {counts[-1]}')
+                lines.append(f'parkmatrix_request_duration_seconds_sum{{{labels}}} {self.latency_sum[(endpoint, method)]:.6f}')
+                lines.append(f'parkmatrix_request_duration_seconds_count{{{labels}}} {counts[-1]}')
+
+            family('parkmatrix_requests_total', 'counter', "Requests by endpoint and status code.")
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(f'parkmatrix_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}')
+
+            for name, values, help_text in [
+                ('parkmatrix_db_queries_total', self.queries, "SQL statements run by endpoint."),
+                ('parkmatrix_db_seconds_total', self.db_seconds, "Time spent in SQL statements by endpoint."),
+                ('parkmatrix_template_seconds_total', self.template_seconds, "Template render time by endpoint."),
+                ('parkmatrix_n_plus_one_total', self.n_plus_one, "Requests with a statement repeated N_PLUS_ONE_THRESHOLD times."),
+            ]:
+                family(name, 'counter', help_text)
+                for endpoint, value in sorted(values.items()):
+                    lines.append(f'{name}{{endpoint="{endpoint}"}} {value:.6f}' if isinstance(value, float)
+                                 else f'{name}{{endpoint="{endpoint}"}} {value}')
+
+            family('parkmatrix_slow_request_profiles_total', 'counter', "Profiles written for slow requests.")
+            lines.append(f'parkmatrix_slow_request_profiles_total {self.profiles}')
+
+        cache = view_cache.stats()
+        family('parkmatrix_cache_hits_total', 'counter', "Lot card / spot grid cache hits.")
+        lines.append(f"parkmatrix_cache_hits_total {cache['hits']}")
+        family('parkmatrix_cache_misses_total', 'counter', "Lot card / spot grid cache misses.")
+        lines.append(f"parkmatrix_cache_misses_total {cache['misses']}")
+        family('parkmatrix_live_subscribers', 'gauge', "Open live availability streams.")
+        lines.append(f"parkmatrix_live_subscribers {occupancy_broker.subscribers}")
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def _fold(frame):
+    # one stack, outermost frame first, in the folded format
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class SamplingProfiler:
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._active = {}
+        self._thread = None
+
+    def begin(self):
+        with self._lock:
+            self._active[threading.get_ident()] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+                self._thread.start()
+
+    def end(self):
+        with self._lock:
+            return self._active.pop(threading.get_ident(), None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, stacks in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[_fold(frame)] += 1
+
+
+def write_profile(directory, endpoint, seconds, stacks):
+    os.makedirs(directory, exist_ok=True)
+    name = f"{datetime.now():%Y%m%d-%H%M%S-%f}-{endpoint}-{int(seconds * 1000)}ms.folded"
+    path = os.path.join(directory, name)
+    with open(path, 'w') as handle:
+        for stack, count in stacks.most_common():
+            handle.write(f"{stack} {count}\n")
+    return path
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'instrumentation' in g:
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'instrumentation' in g and conn.info.get('query_start'):
+        stats = g.instrumentation
+        stats['db_seconds'] += time.perf_counter() - conn.info['query_start'].pop()
+        stats['queries'] += 1
+        stats['statements'][statement] += 1
+
+
+def _before_render(sender, template, context, **extra):
+    if 'instrumentation' in g:
+        g.instrumentation['render_start'].append(time.perf_counter())
+
+
+def _rendered(sender, template, context, **extra):
+    if 'instrumentation' in g and g.instrumentation['render_start']:
+        g.instrumentation['template_seconds'] += time.perf_counter() - g.instrumentation['render_start'].pop()
+
+
+profiler = None
+
+
+def start_request():
+    g.instrumentation = {'start': time.perf_counter(), 'queries': 0, 'db_seconds': 0.0,
+                         'template_seconds': 0.0, 'render_start': [], 'statements': Counter()}
+    if profiler is not None:
+        profiler.begin()
+
+
+def finish_request(response):
+    stats = g.pop('instrumentation', None)
+    if stats is None:
+        return response
+    seconds = time.perf_counter() - stats['start']
+    endpoint = request.endpoint or 'unmatched'
+
+    repeated = [(count, statement) for statement, count in stats['statements'].items()
+                if count >= current_app.config['N_PLUS_ONE_THRESHOLD']]
+    for count, statement in repeated:
+        current_app.logger.warning("Possible N+1 in %s: %d x %s", endpoint, count, ' '.join(statement.split())[:200])
+
+    metrics.observe(endpoint, request.method, response.status_code, seconds, stats['queries'],
+                    stats['db_seconds'], stats['template_seconds'], 1 if repeated else 0)
+    response.headers['Server-Timing'] = (
+        f'app;dur={seconds * 1000:.1f}, '
+        f'db;dur={stats["db_seconds"] * 1000:.1f};desc="{stats["queries"]} queries", '
+        f'tpl;dur={stats["template_seconds"] * 1000:.1f}'
+    )
+
+    if profiler is not None:
+        stacks = profiler.end()
+        if stacks and seconds * 1000 >= current_app.config['SLOW_REQUEST_MS']:
+            path = write_profile(current_app.config['PROFILE_DIR'], endpoint, seconds, stacks)
+            metrics.profile_written()
+            current_app.logger.warning("Slow request %s took %.0f ms, profile in %s", endpoint, seconds * 1000, path)
+    return response
+
+
+def metrics_view():
+    # an admin session, or "Authorization: Bearer <METRICS_TOKEN>" for the scraper
+    token = current_app.config['METRICS_TOKEN']
+    if not (token and request.headers.get('Authorization') == f"Bearer {token}") and not is_admin():
+        abort(403)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    global profiler
+    if not app.config['INSTRUMENTATION']:
+        return
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(db.engine, 'after_cursor_execute', _after_cursor_execute)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
+    if app.config['PROFILE_SLOW_REQUESTS']:
+        profiler = SamplingProfiler(app.config['PROFILE_INTERVAL_MS'] / 1000)
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
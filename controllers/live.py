@@ -0,0 +1,167 @@
+import asyncio
+import json
+import threading
+from collections import deque
+from models.models import db, ParkingSpot
+from controllers.cache import lot_summary
+
+# Live occupancy push over Server-Sent Events.
+# Every booking, release, spot toggle and lot edit publishes one event with
+# the lot's new counters (and the spots that changed). The event is built
+# and serialised once; subscribers only wait on a shared condition and read
+# it from a short backlog, so a change costs the same whether one or
+# thousands of browsers are listening, and no subscriber touches the
+# database. Streams resume from Last-Event-ID after a reconnect.
+#
+# The broker lives in the worker process: under several workers a stream
+# sees the changes made through its own worker, and the pages still render
+# fresh numbers on every load.
+#
+# Under the ASGI server (controllers/asgi.py) streams are coroutines instead
+# of threads. They wait on one asyncio.Event per event loop, which publish()
+# sets from whatever thread committed the change, so a change still wakes
+# every stream with a single call into each loop.
+
+LIVE_BACKLOG = 1000
+HEARTBEAT_SECONDS = 15
+
+
+class OccupancyBroker:
+    def __init__(self, backlog=LIVE_BACKLOG):
+        self._condition = threading.Condition()
+        self._events = deque(maxlen=backlog)
+        self._seq = 0
+        self.subscribers = 0
+        # event loop -> asyncio.Event set by the next publish()
+        self._loop_events = {}
+
+    @property
+    def last_seq(self):
+        return self._seq
+
+    def publish(self, lot_id, payload):
+        data = json.dumps(payload)
+        with self._condition:
+            self._seq += 1
+            frame = f"id: {self._seq}\nevent: occupancy\ndata: {data}\n\n"
+            self._events.append((self._seq, lot_id, frame))
+            self._condition.notify_all()
+            loops = list(self._loop_events)
+        for loop in loops:
+            try:
+                loop.call_soon_threadsafe(self._wake, loop)
+            except RuntimeError:
+                # the loop was closed (server shut down)
+                with self._condition:
+                    self._loop_events.pop(loop, None)
+
+    def _wake(self, loop):
+        with self._condition:
+            event = self._loop_events.pop(loop, None)
+        if event is not None:
+            event.set()
+
+    def _since(self, after_seq):
+        # (events after after_seq, missed); missed is True when the
+        # subscriber fell further behind than the backlog reaches.
+        # Call with the condition held.
+        pending = self._seq - after_seq
+        missed = pending > len(self._events)
+        if pending <= 0:
+            return [], False
+        start = max(0, len(self._events) - pending)
+        return [self._events[i] for i in range(start, len(self._events))], missed
+
+    def wait(self, after_seq, timeout):
+        with self._condition:
+            self._condition.wait_for(lambda: self._seq > after_seq, timeout)
+            return self._since(after_seq)
+
+    async def wait_async(self, after_seq, timeout):
+        loop = asyncio.get_running_loop()
+        with self._condition:
+            event = None
+            if self._seq <= after_seq:
+                event = self._loop_events.get(loop)
+                if event is None:
+                    event = self._loop_events[loop] = asyncio.Event()
+        if event is not None:
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        with self._condition:
+            return self._since(after_seq)
+
+    def _start(self, after_seq):
+        with self._condition:
+            self.subscribers += 1
+            return self._seq if after_seq is None or after_seq > self._seq else after_seq
+
+    def _stop(self):
+        with self._condition:
+            self.subscribers -= 1
+
+    def _frames(self, lot_id, events, missed):
+        if missed:
+            yield "event: resync\ndata: {}\n\n"
+        if not events:
+            # keeps proxies from closing the idle connection
+            yield ": ping\n\n"
+        for event_seq, event_lot_id, frame in events:
+            if lot_id is None or event_lot_id == lot_id:
+                yield frame
+
+    def stream(self, lot_id=None, after_seq=None):
+        # generator of SSE frames for one subscriber; lot_id=None follows every lot
+        seq = self._start(after_seq)
+        try:
+            yield f"retry: 3000\nid: {seq}\n\n"
+            while True:
+                events, missed = self.wait(seq, HEARTBEAT_SECONDS)
+                yield from self._frames(lot_id, events, missed)
+                if events:
+                    seq = events[-1][0]
+        finally:
+            self._stop()
+
+    async def stream_async(self, lot_id=None, after_seq=None):
+        # the same frames as stream(), for a coroutine per subscriber
+        seq = self._start(after_seq)
+        try:
+            yield f"retry: 3000\nid: {seq}\n\n"
+            while True:
+                events, missed = await self.wait_async(seq, HEARTBEAT_SECONDS)
+                for frame in self._frames(lot_id, events, missed):
+                    yield frame
+                if events:
+                    seq = events[-1][0]
+        finally:
+            self._stop()
+
+
+occupancy_broker = OccupancyBroker()
+
+
+def occupancy_changed(lot_id, spot_ids=(), reload=False):
+    # call after the commit (and after lot_changed) so the numbers are fresh;
+    # reload=True tells open spot grids that spots were added or removed
+    lot = lot_summary(lot_id)
+    if lot is None:
+        occupancy_broker.publish(lot_id, {'lot_id': lot_id, 'deleted': True})
+        return
+
+    spots = []
+    if spot_ids:
+        rows = db.session.query(ParkingSpot.id, ParkingSpot.occupied_status, ParkingSpot.deleted_spot).filter(
+            ParkingSpot.id.in_(spot_ids)).all()
+        spots = [{'id': spot_id, 'occupied': occupied, 'active': active} for spot_id, occupied, active in rows]
+
+    occupancy_broker.publish(lot_id, {
+        'lot_id': lot_id,
+        'available': lot['available_parking_spots'],
+        'occupied': lot['occupied_spots_count'],
+        'total': lot['total_spots'],
+        'spots': spots,
+        'reload': reload
+    })
@@ -0,0 +1,126 @@
+from sqlalchemy import func, case, select, update
+from datetime import datetime
+from models.models import db, ParkingLot, ParkingSpot
+
+# Shared lot occupancy service used by every lot-listing view.
+# Availability is read from the counters stored on ParkingLot, which are
+# updated in the same transaction as every booking, release and
+# activation toggle, so listing lots never has to scan ParkingSpot.
+
+
+def occupancy_summary(lot):
+    # lot is a ParkingLot or a row of lot_summaries_select()
+    return {
+        'id': lot.id,
+        'lot_name': lot.lot_name,
+        'city': lot.city,
+        'pin_code': lot.pin_code,
+        'available_parking_spots': lot.free_count,
+        'occupied_spots_count': lot.occupied_count,
+        'deactivated_spots_count': lot.available_parking_spots - lot.active_count,
+        'total_spots': lot.available_parking_spots,
+        'price': lot.price,
+        'version': lot.occupancy_version,
+        'updated_at': lot.occupancy_updated_at,
+        'latitude': lot.latitude,
+        'longitude': lot.longitude
+    }
+
+
+def lot_summaries_select():
+    # just the columns occupancy_summary() reads, for the cached lot cards
+    return select(
+        ParkingLot.id, ParkingLot.lot_name, ParkingLot.city, ParkingLot.pin_code, ParkingLot.price,
+        ParkingLot.free_count, ParkingLot.occupied_count, ParkingLot.active_count,
+        ParkingLot.available_parking_spots, ParkingLot.occupancy_version, ParkingLot.occupancy_updated_at,
+        ParkingLot.latitude, ParkingLot.longitude
+    ).order_by(ParkingLot.id)
+
+
+def lot_occupancy(lot_id=None):
+    query = ParkingLot.query
+    if lot_id is not None:
+        query = query.filter(ParkingLot.id == lot_id)
+    return [dict(occupancy_summary(lot), lot_object=lot) for lot in query.order_by(ParkingLot.id).all()]
+
+
+# Counter maintenance, called by the views before they commit
+
+def adjust_lot_counters(lot_id, occupied=0, free=0, active=0):
+    db.session.execute(
+        update(ParkingLot)
+        .where(ParkingLot.id == lot_id)
+        .values(occupied_count=ParkingLot.occupied_count + occupied,
+                free_count=ParkingLot.free_count + free,
+                active_count=ParkingLot.active_count + active,
+                occupancy_version=ParkingLot.occupancy_version + 1,
+                occupancy_updated_at=datetime.now())
+    )
+
+
+def spot_released(spot):
+    adjust_lot_counters(spot.lot_id, occupied=-1, free=1 if spot.deleted_spot else 0)
+
+
+def spot_toggled(spot):
+    # deleted_spot is True for an active spot, so call this after the toggle
+    change = 1 if spot.deleted_spot else -1
+    adjust_lot_counters(spot.lot_id, active=change, free=0 if spot.occupied_status else change)
+
+
+def reset_lot_counters(lot, spots_count):
+    lot.available_parking_spots = spots_count
+    lot.occupied_count = 0
+    lot.free_count = spots_count
+    lot.active_count = spots_count
+    bump_occupancy_version(lot)
+
+
+def bump_occupancy_version(lot):
+    # for counters set directly on the lot instead of through adjust_lot_counters
+    lot.occupancy_version = (lot.occupancy_version or 0) + 1
+    lot.occupancy_updated_at = datetime.now()
+
+
+# Drift check: recount every lot from ParkingSpot with one grouped query.
+# Retired spots (see controllers/provisioning.py) are not part of the lot.
+
+def spot_counts(lot_id=None):
+    query = db.session.query(
+        ParkingLot.id,
+        func.count(ParkingSpot.id),
+        func.coalesce(func.sum(case((ParkingSpot.occupied_status == True, 1), else_=0)), 0),
+        func.coalesce(func.sum(case(
+            ((ParkingSpot.occupied_status == False) & (ParkingSpot.deleted_spot == True), 1), else_=0)), 0),
+        func.coalesce(func.sum(case((ParkingSpot.deleted_spot == True, 1), else_=0)), 0)
+    ).outerjoin(ParkingSpot, (ParkingSpot.lot_id == ParkingLot.id) & (ParkingSpot.retired == False))
+    if lot_id is not None:
+        query = query.filter(ParkingLot.id == lot_id)
+    rows = query.group_by(ParkingLot.id).all()
+
+    counts = {}
+    for lot_id, total, occupied, free, active in rows:
+        counts[lot_id] = {
+            'available_parking_spots': total,
+            'occupied_count': occupied,
+            'free_count': free,
+            'active_count': active
+        }
+    return counts
+
+
+def check_lot_counters(repair=False):
+    drifted = []
+    counts = spot_counts()
+    for lot in ParkingLot.query.order_by(ParkingLot.id).all():
+        expected = counts[lot.id]
+        for column, value in expected.items():
+            stored = getattr(lot, column)
+            if stored != value:
+                drifted.append((lot.id, column, stored, value))
+                if repair:
+                    setattr(lot, column, value)
+                    bump_occupancy_version(lot)
+    if repair and drifted:
+        db.session.commit()
+    return drifted
@@ -0,0 +1,76 @@
+from sqlalchemy import insert, update, select, func
+from models.models import db, ParkingSpot
+from controllers.occupancy import spot_counts
+from controllers.reservations import has_upcoming_reservations
+
+# Bulk spot provisioning for parking lots.
+# New spots go in with one executemany-style INSERT, and resizing a lot is
+# a diff against its current spots: growing re-activates retired spots and
+# appends new spot numbers, shrinking retires the trailing free spots that
+# nobody has reserved with one UPDATE. Spots are never deleted, so their
+# booking history is kept.
+
+
+class ResizeError(Exception):
+    pass
+
+
+def spot_number(position):
+    return 'P{:03d}'.format(position)
+
+
+def add_spots(lot_id, first_position, count):
+    if count <= 0:
+        return
+    db.session.execute(insert(ParkingSpot), [
+        {'lot_id': lot_id, 'spot_number': spot_number(position),
+         'occupied_status': False, 'deleted_spot': True, 'retired': False}
+        for position in range(first_position, first_position + count)
+    ])
+
+
+def _sync_counters(lot):
+    # the caller bumps the lot's occupancy version
+    counts = spot_counts(lot.id)[lot.id]
+    for column, value in counts.items():
+        setattr(lot, column, value)
+
+
+def resize_lot(lot, new_count):
+    # spots are ordered by id, which follows their spot number
+    current = lot.available_parking_spots
+    if new_count < 0:
+        raise ResizeError("Spot count cannot be negative.")
+
+    if new_count > current:
+        needed = new_count - current
+        first_retired = select(ParkingSpot.id).where(
+            ParkingSpot.lot_id == lot.id, ParkingSpot.retired == True
+        ).order_by(ParkingSpot.id).limit(needed)
+        reactivated = db.session.execute(
+            update(ParkingSpot)
+            .where(ParkingSpot.id.in_(first_retired.scalar_subquery()))
+            .values(retired=False, deleted_spot=True)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        total = db.session.query(func.count(ParkingSpot.id)).filter_by(lot_id=lot.id).scalar()
+        add_spots(lot.id, total + 1, needed - reactivated)
+
+    elif new_count < current:
+        trailing = select(ParkingSpot.id).where(
+            ParkingSpot.lot_id == lot.id, ParkingSpot.retired == False
+        ).order_by(ParkingSpot.id.desc()).limit(current - new_count).scalar_subquery()
+        occupied = db.session.query(func.count(ParkingSpot.id)).filter(
+            ParkingSpot.id.in_(trailing), ParkingSpot.occupied_status == True).scalar()
+        if occupied:
+            raise ResizeError("Occupied spots are in the way, the lot cannot shrink that far.")
+        if has_upcoming_reservations(lot.id, trailing):
+            raise ResizeError("Reserved spots are in the way, the lot cannot shrink that far.")
+        db.session.execute(
+            update(ParkingSpot)
+            .where(ParkingSpot.id.in_(trailing))
+            .values(retired=True, deleted_spot=False)
+            .execution_options(synchronize_session=False)
+        )
+
+    _sync_counters(lot)
@@ -0,0 +1,74 @@
+from sqlalchemy import create_engine, func, text
+from datetime import datetime
+from models.models import db, User, ParkingSpot, Bookedspot, UserMonthlyUsage, Reservation
+from controllers.bookings import history_page_query, HISTORY_PAGE_SIZE
+from controllers.users import _prefix_range
+from controllers.vehicles import active_parkings_query
+from controllers.sweeper import open_bookings_page, overstays_query
+from controllers.geo import lot_filter_query
+from controllers.reservations import RESERVED, lot_windows_query, overlapping, upcoming_reservations_query
+
+# EXPLAIN QUERY PLAN check for the hot queries behind the routes.
+# Any plan step that reads a whole table ("SCAN <table>" without a covering
+# index) means a route has lost its index and will slow down as data grows.
+# Plans are taken on an empty in-memory copy of the schema: on a real
+# database SQLite's table statistics rightly prefer scanning tiny tables,
+# which would hide a missing index until the data grows.
+
+
+def hot_queries():
+    return [
+        ("spot grid of a lot", ParkingSpot.query.filter_by(lot_id=1)),
+        ("free spots of a lot", db.session.query(ParkingSpot.id, ParkingSpot.spot_number).filter_by(
+            lot_id=1, occupied_status=False, deleted_spot=True)),
+        ("open booking of a user", Bookedspot.query.filter_by(user_id=1, vehicle_released=False)),
+        ("booking history page", history_page_query(1, (datetime(2025, 1, 1), 1), HISTORY_PAGE_SIZE)),
+        ("bookings of a spot", Bookedspot.query.filter_by(spot_id=1)),
+        ("active user count", db.session.query(func.count(User.id)).filter_by(is_active_user=True, is_admin=False)),
+        ("monthly summary of a user", UserMonthlyUsage.query.filter(UserMonthlyUsage.user_id == 1)),
+        ("active parking of a vehicle", active_parkings_query().filter(Bookedspot.vehicle_number == 'TN01AB1234')),
+        ("parked vehicle prefix search", active_parkings_query().filter(
+            _prefix_range(Bookedspot.vehicle_number, 'TN01')).order_by(Bookedspot.vehicle_number).limit(50)),
+        ("open bookings page of the sweeper", open_bookings_page((datetime(2025, 1, 1), 1))),
+        ("overstays on the admin dashboard", overstays_query(24)),
+        ("lot search by city", lot_filter_query(city='Chennai')),
+        ("lot search by pin code prefix", lot_filter_query(pin='6000')),
+        ("claim of a spot that is not reserved", db.session.query(ParkingSpot.id).filter(
+            ParkingSpot.id == 1, ~overlapping(ParkingSpot.id, datetime(2025, 1, 1), datetime(2025, 1, 2)))),
+        ("reservation windows of a lot", lot_windows_query(1)),
+        ("upcoming reservations of a user", upcoming_reservations_query(1)),
+        ("no-show reservations", Reservation.query.filter(
+            Reservation.status == RESERVED, Reservation.start_time < datetime(2025, 1, 1))),
+        ("reservation of a booking", Reservation.query.filter(Reservation.booking_id.in_([1, 2]))),
+    ]
+
+
+_plan_engine = None
+
+
+def plan_engine():
+    global _plan_engine
+    if _plan_engine is None:
+        _plan_engine = create_engine('sqlite://')
+        db.metadata.create_all(_plan_engine)
+    return _plan_engine
+
+
+def query_plan(query):
+    engine = plan_engine()
+    # ORM queries and select() statements
+    statement = getattr(query, 'statement', query)
+    compiled = statement.compile(engine, compile_kwargs={'literal_binds': True})
+    with engine.connect() as connection:
+        rows = connection.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).all()
+    return [row[-1] for row in rows]
+
+
+def full_scans():
+    # (query name, plan step) for every step that scans a whole table
+    found = []
+    for name, query in hot_queries():
+        for step in query_plan(query):
+            if step.startswith('SCAN') and 'COVERING INDEX' not in step:
+                found.append((name, step))
+    return found
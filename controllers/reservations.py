@@ -0,0 +1,330 @@
+import bisect
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import DateTime, exists, insert, literal, select, update
+from models.models import db, ParkingLot, ParkingSpot, Reservation
+from controllers.cache import lot_summary, spot_grid
+from controllers.vehicles import normalize_vehicle_number
+
+# Advance reservations.
+# A reservation holds one spot for a window [start, end). Windows on a spot
+# may not overlap, so for each spot they form a sorted list in which the
+# ends are sorted too: one bisect tells whether the spot is free for a
+# window, and "any spot in the lot free for [t1, t2)" is one bisect per spot,
+# without reading Reservation at all. The lists live in ReservationIndex,
+# per worker and per lot, loaded from the reservations that have not ended
+# yet.
+#
+# Like the free spot pool the index is only a hint. A reservation is written
+# with one INSERT ... SELECT that re-checks the spot and the overlap in the
+# database (ix_reservation_spot_end), so a window reserved through another
+# worker just costs a failed insert and a reload of the lot. Each worker
+# also re-reads a lot after INDEX_TTL seconds, to forget windows that were
+# cancelled elsewhere.
+#
+# A vehicle that is parked has no exit time, so it is assumed to stay
+# RESERVATION_HOLD_MINUTES: a window starting within that time cannot take
+# an occupied spot, and a walk-in booking cannot take a spot reserved
+# within that time (see _claim in controllers/allocation.py). Checking in
+# books the reserved spot through the normal booking path, and releasing
+# the booking completes the reservation.
+
+RESERVED = 'reserved'
+CHECKED_IN = 'checked_in'
+COMPLETED = 'completed'
+CANCELLED = 'cancelled'
+EXPIRED = 'expired'
+# the states in which a reservation holds its spot
+HOLDING = (RESERVED, CHECKED_IN)
+
+RESERVE_RETRIES = 5
+INDEX_TTL = 30
+
+
+class ReservationError(Exception):
+    pass
+
+
+def hold_time():
+    return timedelta(minutes=current_app.config['RESERVATION_HOLD_MINUTES'])
+
+
+def lot_windows_query(lot_id):
+    # the windows of the lot that still hold their spots, for the index
+    return select(Reservation.spot_id, Reservation.start_time, Reservation.end_time, Reservation.id).where(
+        Reservation.lot_id == lot_id, Reservation.end_time > datetime.now(), Reservation.status.in_(HOLDING))
+
+
+def overlapping(spot_id, start, end, ignore=None):
+    # a holding reservation of the spot overlaps [start, end); spot_id may be a column
+    query = select(Reservation.id).where(
+        Reservation.spot_id == spot_id,
+        Reservation.end_time > start,
+        Reservation.start_time < end,
+        Reservation.status.in_(HOLDING))
+    if ignore is not None:
+        query = query.where(Reservation.id != ignore)
+    return exists(query)
+
+
+class ReservationIndex:
+    def __init__(self, ttl=INDEX_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # lot_id -> {spot_id: [(start, end, reservation_id), ...] sorted}
+        self._lots = {}
+        self._loaded = {}
+
+    # as in the free spot pool, the database is never queried under the lock
+
+    def _fetch(self, lot_id):
+        rows = db.session.execute(lot_windows_query(lot_id)).all()
+        spots = defaultdict(list)
+        for spot_id, start, end, reservation_id in rows:
+            spots[spot_id].append((start, end, reservation_id))
+        for windows in spots.values():
+            windows.sort()
+        return spots
+
+    def _ensure(self, lot_id):
+        with self._lock:
+            loaded = self._loaded.get(lot_id)
+            if loaded is not None and time.monotonic() - loaded < self.ttl:
+                return
+        spots = self._fetch(lot_id)
+        with self._lock:
+            self._lots[lot_id] = spots
+            self._loaded[lot_id] = time.monotonic()
+
+    @staticmethod
+    def _is_free(windows, start, end):
+        # the last window starting before end is the only one that can reach past start
+        index = bisect.bisect_left(windows, (end,))
+        return index == 0 or windows[index - 1][1] <= start
+
+    def free_spots(self, lot_id, candidates, start, end):
+        # the candidate spot ids that are free for [start, end), in the given order
+        self._ensure(lot_id)
+        with self._lock:
+            spots = self._lots.get(lot_id, {})
+            return [spot_id for spot_id in candidates
+                    if spot_id not in spots or self._is_free(spots[spot_id], start, end)]
+
+    def first_free(self, lot_id, candidates, start, end):
+        self._ensure(lot_id)
+        with self._lock:
+            spots = self._lots.get(lot_id, {})
+            for spot_id in candidates:
+                if spot_id not in spots or self._is_free(spots[spot_id], start, end):
+                    return spot_id
+        return None
+
+    def held(self, lot_id, start, end):
+        # ids of the spots reserved somewhere in [start, end)
+        self._ensure(lot_id)
+        with self._lock:
+            spots = self._lots.get(lot_id, {})
+            return {spot_id for spot_id, windows in spots.items() if not self._is_free(windows, start, end)}
+
+    def add(self, lot_id, spot_id, start, end, reservation_id):
+        with self._lock:
+            if lot_id in self._lots:
+                bisect.insort(self._lots[lot_id].setdefault(spot_id, []), (start, end, reservation_id))
+
+    def remove(self, lot_id, spot_id, reservation_id):
+        with self._lock:
+            windows = self._lots.get(lot_id, {}).get(spot_id)
+            if windows:
+                windows[:] = [window for window in windows if window[2] != reservation_id]
+
+    def forget(self, rows):
+        # rows of (lot_id, spot_id, reservation_id) that stopped holding their spots
+        for lot_id, spot_id, reservation_id in rows:
+            self.remove(lot_id, spot_id, reservation_id)
+
+    def drop(self, lot_id):
+        with self._lock:
+            self._lots.pop(lot_id, None)
+            self._loaded.pop(lot_id, None)
+
+
+reservation_index = ReservationIndex()
+
+
+def _naive(value):
+    # aware times are converted to local time, like every stored timestamp
+    return value.astimezone().replace(tzinfo=None) if value.tzinfo else value
+
+
+def parse_window(start, end, now=None):
+    # (start, end) from ISO 8601 strings, e.g. the form's datetime-local inputs
+    try:
+        start = _naive(datetime.fromisoformat(start))
+        end = _naive(datetime.fromisoformat(end))
+    except (TypeError, ValueError):
+        raise ReservationError("Start and end must be a date and time (YYYY-MM-DDTHH:MM).")
+    now = now or datetime.now()
+    config = current_app.config
+    if end <= start:
+        raise ReservationError("The reservation must end after it starts.")
+    if start < now - timedelta(minutes=config['RESERVATION_GRACE_MINUTES']):
+        raise ReservationError("The reservation cannot start in the past.")
+    if end - start > timedelta(hours=config['RESERVATION_MAX_HOURS']):
+        raise ReservationError(f"A reservation can be at most {config['RESERVATION_MAX_HOURS']:g} hours long.")
+    if start > now + timedelta(days=config['RESERVATION_MAX_DAYS']):
+        raise ReservationError(f"Reservations open {config['RESERVATION_MAX_DAYS']:g} days ahead.")
+    return start, end
+
+
+def candidate_spots(lot_id, start, now):
+    # the lot's active spots, lowest first; one that is occupied now only
+    # counts for a window that starts after the hold time
+    soon = start < now + hold_time()
+    return [spot['id'] for spot in spot_grid(lot_id)
+            if spot['deleted_spot'] and not (soon and spot['occupied_status'])]
+
+
+def free_spot_count(lot_id, start, end):
+    return len(reservation_index.free_spots(lot_id, candidate_spots(lot_id, start, datetime.now()), start, end))
+
+
+def _insert(lot_id, spot_id, user_id, vehicle_number, start, end, now):
+    # the reservation is only written if the spot is still active, free for
+    # the window and, for a window starting within the hold time, not occupied;
+    # returns its id, or None
+    conditions = [ParkingSpot.id == spot_id, ParkingSpot.deleted_spot == True, ParkingSpot.retired == False]
+    if start < now + hold_time():
+        conditions.append(ParkingSpot.occupied_status == False)
+    # a row lock on the spot where the database has them (SQLite runs one writer at a time)
+    db.session.execute(select(ParkingSpot.id).where(ParkingSpot.id == spot_id).with_for_update())
+    row = select(
+        literal(lot_id), literal(spot_id), literal(user_id), literal(vehicle_number),
+        literal(start, DateTime), literal(end, DateTime), literal(RESERVED), literal(now, DateTime)
+    ).where(exists(select(ParkingSpot.id).where(*conditions)), ~overlapping(spot_id, start, end))
+    return db.session.execute(
+        insert(Reservation).from_select(
+            ['lot_id', 'spot_id', 'user_id', 'vehicle_number', 'start_time', 'end_time', 'status', 'created_at'], row
+        ).returning(Reservation.id)
+    ).scalar()
+
+
+def reserve(user_id, lot_id, vehicle_number, start, end):
+    now = datetime.now()
+    plate = normalize_vehicle_number(vehicle_number)
+    if not plate:
+        raise ReservationError("Please enter the vehicle number.")
+    if lot_summary(lot_id) is None:
+        raise ReservationError("Parking lot not found.")
+    if db.session.query(exists(
+        select(Reservation.id).where(Reservation.user_id == user_id, Reservation.end_time > start,
+                                     Reservation.start_time < end, Reservation.status.in_(HOLDING))
+    )).scalar():
+        raise ReservationError("You already have a reservation for this time.")
+
+    tried = set()
+    reloaded = False
+    for _ in range(RESERVE_RETRIES):
+        candidates = [spot_id for spot_id in candidate_spots(lot_id, start, now) if spot_id not in tried]
+        spot_id = reservation_index.first_free(lot_id, candidates, start, end)
+        if spot_id is None:
+            # windows cancelled through another worker may still be in our index
+            if reloaded or not candidates:
+                raise ReservationError("No spot in this lot is free for that time.")
+            reservation_index.drop(lot_id)
+            reloaded = True
+            continue
+        reservation_id = _insert(lot_id, spot_id, user_id, plate, start, end, now)
+        if reservation_id is not None:
+            db.session.commit()
+            reservation_index.add(lot_id, spot_id, start, end, reservation_id)
+            return _details_query().filter(Reservation.id == reservation_id).one()
+        # reserved or taken through another worker: re-read the lot, try the next spot
+        db.session.rollback()
+        tried.add(spot_id)
+        reservation_index.drop(lot_id)
+    raise ReservationError("The lot is busy, please try again.")
+
+
+def cancel_reservation(reservation_id, user_id=None):
+    # user_id: only cancel if it is this user's reservation
+    query = update(Reservation).where(Reservation.id == reservation_id, Reservation.status == RESERVED)
+    if user_id is not None:
+        query = query.where(Reservation.user_id == user_id)
+    row = db.session.execute(
+        query.values(status=CANCELLED).returning(Reservation.lot_id, Reservation.spot_id)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if row is None:
+        db.session.rollback()
+        raise ReservationError("No such active reservation.")
+    db.session.commit()
+    reservation_index.remove(row.lot_id, row.spot_id, reservation_id)
+
+
+def mark_checked_in(reservation_id, booking_id, spot_id):
+    # part of the booking's transaction; False if the reservation is no longer open
+    return db.session.execute(
+        update(Reservation)
+        .where(Reservation.id == reservation_id, Reservation.status == RESERVED)
+        .values(status=CHECKED_IN, booking_id=booking_id, spot_id=spot_id)
+        .execution_options(synchronize_session=False)
+    ).rowcount == 1
+
+
+def complete_reservations(booking_ids):
+    # part of the release transaction: the reservations behind these bookings
+    # stop holding their spots. Returns rows for reservation_index.forget()
+    # once committed
+    return db.session.execute(
+        update(Reservation)
+        .where(Reservation.booking_id.in_(booking_ids), Reservation.status == CHECKED_IN)
+        .values(status=COMPLETED)
+        .returning(Reservation.lot_id, Reservation.spot_id, Reservation.id)
+        .execution_options(synchronize_session=False)
+    ).all()
+
+
+def expire_reservations(now, grace_minutes):
+    # no-shows: reservations not checked into grace_minutes after their start
+    rows = db.session.execute(
+        update(Reservation)
+        .where(Reservation.status == RESERVED, Reservation.start_time < now - timedelta(minutes=grace_minutes))
+        .values(status=EXPIRED)
+        .returning(Reservation.lot_id, Reservation.spot_id, Reservation.id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.session.commit()
+    reservation_index.forget(rows)
+    return len(rows)
+
+
+def has_upcoming_reservations(lot_id, spot_ids=None):
+    # spot_ids: only look at these spots (a list or a subquery)
+    query = select(Reservation.id).where(Reservation.lot_id == lot_id, Reservation.end_time > datetime.now(),
+                                         Reservation.status.in_(HOLDING))
+    if spot_ids is not None:
+        query = query.where(Reservation.spot_id.in_(spot_ids))
+    return db.session.query(exists(query)).scalar()
+
+
+def _details_query():
+    return db.session.query(
+        Reservation.id, Reservation.lot_id, Reservation.vehicle_number,
+        Reservation.start_time, Reservation.end_time,
+        ParkingSpot.spot_number, ParkingLot.lot_name, ParkingLot.city
+    ).join(ParkingSpot, ParkingSpot.id == Reservation.spot_id
+    ).join(ParkingLot, ParkingLot.id == Reservation.lot_id)
+
+
+def upcoming_reservations_query(user_id):
+    # the user's reservations that are not checked into yet, soonest first
+    return _details_query().filter(
+        Reservation.user_id == user_id, Reservation.status == RESERVED, Reservation.end_time > datetime.now()
+    ).order_by(Reservation.start_time)
+
+
+def upcoming_reservations(user_id):
+    return upcoming_reservations_query(user_id).all()
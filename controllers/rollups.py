@@ -0,0 +1,134 @@
+from collections import Counter, defaultdict
+from sqlalchemy import case, delete, func, insert, select
+from models.models import db, ParkingSpot, Bookedspot, LotDailyUsage, UserMonthlyUsage
+
+# Incremental usage rollups for the summary dashboards.
+# Every booking adds to its lot/day and user/month rows, and every release
+# adds the final cost, in the same transaction as the booking change. The
+# dashboards then read a few hundred rollup rows instead of grouping the
+# whole Bookedspot table. Rows are keyed on the booking's entry time, the
+# same way the reports have always grouped bookings. Months are 'YYYY-MM'
+# strings on every backend (see month_of).
+
+
+UPSERT_CHUNK = 500
+
+
+def month_of(column, dialect_name=None):
+    # 'YYYY-MM' of a date or datetime column
+    if (dialect_name or db.engine.dialect.name) == 'postgresql':
+        return func.to_char(column, 'YYYY-MM')
+    return func.strftime('%Y-%m', column)
+
+
+def _upsert_rows(model, key_columns, rows):
+    # rows are dicts of the key columns plus the increments to add
+    # the dialect modules are imported on first use, only the one in use
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    for start in range(0, len(rows), UPSERT_CHUNK):
+        statement = dialect_insert(model).values(rows[start:start + UPSERT_CHUNK])
+        statement = statement.on_conflict_do_update(
+            index_elements=key_columns,
+            set_={column: getattr(model, column) + statement.excluded[column]
+                  for column in rows[0] if column not in key_columns}
+        )
+        db.session.execute(statement)
+
+
+def _upsert(model, keys, increments):
+    _upsert_rows(model, list(keys), [{**keys, **increments}])
+
+
+def booking_opened(lot_id, user_id, entry_timing):
+    _upsert(LotDailyUsage, {'lot_id': lot_id, 'day': entry_timing.date()},
+            {'bookings': 1, 'released': 0, 'revenue': 0})
+    _upsert(UserMonthlyUsage, {'user_id': user_id, 'month': entry_timing.strftime('%Y-%m')},
+            {'bookings': 1, 'expenditure': 0})
+
+
+def booking_released(lot_id, user_id, entry_timing, cost):
+    _upsert(LotDailyUsage, {'lot_id': lot_id, 'day': entry_timing.date()},
+            {'bookings': 0, 'released': 1, 'revenue': cost})
+    _upsert(UserMonthlyUsage, {'user_id': user_id, 'month': entry_timing.strftime('%Y-%m')},
+            {'bookings': 0, 'expenditure': cost})
+
+
+# Batch versions for the gate endpoint: one multi-row upsert per table
+# instead of one statement per booking
+
+def bookings_opened(rows):
+    # rows of (lot_id, user_id, entry_timing)
+    lot_days = Counter((lot_id, entry_timing.date()) for lot_id, _, entry_timing in rows)
+    user_months = Counter((user_id, entry_timing.strftime('%Y-%m')) for _, user_id, entry_timing in rows)
+    _upsert_rows(LotDailyUsage, ['lot_id', 'day'], [
+        {'lot_id': lot_id, 'day': day, 'bookings': bookings, 'released': 0, 'revenue': 0}
+        for (lot_id, day), bookings in lot_days.items()])
+    _upsert_rows(UserMonthlyUsage, ['user_id', 'month'], [
+        {'user_id': user_id, 'month': month, 'bookings': bookings, 'expenditure': 0}
+        for (user_id, month), bookings in user_months.items()])
+
+
+def bookings_released(rows):
+    # rows of (lot_id, user_id, entry_timing, cost)
+    lot_days = defaultdict(lambda: [0, 0])
+    user_months = defaultdict(int)
+    for lot_id, user_id, entry_timing, cost in rows:
+        totals = lot_days[(lot_id, entry_timing.date())]
+        totals[0] += 1
+        totals[1] += cost
+        user_months[(user_id, entry_timing.strftime('%Y-%m'))] += cost
+    _upsert_rows(LotDailyUsage, ['lot_id', 'day'], [
+        {'lot_id': lot_id, 'day': day, 'bookings': 0, 'released': released, 'revenue': revenue}
+        for (lot_id, day), (released, revenue) in lot_days.items()])
+    _upsert_rows(UserMonthlyUsage, ['user_id', 'month'], [
+        {'user_id': user_id, 'month': month, 'bookings': 0, 'expenditure': expenditure}
+        for (user_id, month), expenditure in user_months.items()])
+
+
+def lot_deleted(lot_id):
+    # deleting a lot cascades to its bookings, so take them out of the rollups
+    month = month_of(Bookedspot.entry_timing)
+    rows = db.session.query(
+        Bookedspot.user_id,
+        month,
+        func.count(Bookedspot.id),
+        func.coalesce(func.sum(Bookedspot.parking_cost), 0)
+    ).join(ParkingSpot, ParkingSpot.id == Bookedspot.spot_id
+    ).filter(ParkingSpot.lot_id == lot_id
+    ).group_by(Bookedspot.user_id, month).all()
+    for user_id, month, bookings, expenditure in rows:
+        _upsert(UserMonthlyUsage, {'user_id': user_id, 'month': month},
+                {'bookings': -bookings, 'expenditure': -expenditure})
+    db.session.execute(delete(LotDailyUsage).where(LotDailyUsage.lot_id == lot_id))
+
+
+def rebuild_rollups(connection):
+    # recompute both rollup tables from Bookedspot with two grouped inserts
+    connection.execute(delete(LotDailyUsage))
+    connection.execute(delete(UserMonthlyUsage))
+
+    day = func.date(Bookedspot.entry_timing)
+    connection.execute(insert(LotDailyUsage).from_select(
+        ['lot_id', 'day', 'bookings', 'released', 'revenue'],
+        select(
+            ParkingSpot.lot_id,
+            day,
+            func.count(Bookedspot.id),
+            func.sum(case((Bookedspot.vehicle_released == True, 1), else_=0)),
+            func.coalesce(func.sum(Bookedspot.parking_cost), 0)
+        ).join(ParkingSpot, ParkingSpot.id == Bookedspot.spot_id).group_by(ParkingSpot.lot_id, day)
+    ))
+
+    month = month_of(Bookedspot.entry_timing, connection.dialect.name)
+    connection.execute(insert(UserMonthlyUsage).from_select(
+        ['user_id', 'month', 'bookings', 'expenditure'],
+        select(
+            Bookedspot.user_id,
+            month,
+            func.count(Bookedspot.id),
+            func.coalesce(func.sum(Bookedspot.parking_cost), 0)
+        ).group_by(Bookedspot.user_id, month)
+    ))
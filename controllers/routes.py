@@ -1,21 +1,46 @@
-from flask import Flask, render_template, request, flash, url_for, redirect, session
-from app import app
-from models.models import db, User, ParkingLot, ParkingSpot ,Bookedspot
+from flask import Blueprint, current_app, render_template, request, flash, url_for, redirect, session, jsonify, Response, stream_with_context, send_file
+from werkzeug.local import LocalProxy
+from models.models import db, User, ParkingLot, ParkingSpot ,Bookedspot, LotDailyUsage, UserMonthlyUsage
+from controllers.occupancy import lot_occupancy, spot_toggled, reset_lot_counters, bump_occupancy_version
+from controllers.allocation import BookingError, claim_spot, claim_first_free_spot, release_booking, check_in
+from controllers.reservations import (ReservationError, reservation_index, parse_window, reserve, cancel_reservation,
+                                      upcoming_reservations, has_upcoming_reservations)
+from controllers.spot_pool import free_spot_pool
+from controllers.bookings import history_page, page_size
+from controllers.users import user_page, USER_PAGE_SIZE, USER_MAX_PAGE_SIZE
+from controllers.provisioning import add_spots, resize_lot, ResizeError
+from controllers.rollups import lot_deleted, month_of
+from controllers.current_user import current_user, remember_user, forget_user, is_admin
+from controllers.cache import view_cache, lot_summaries, lot_summary, spot_grid, lot_changed
+from controllers.live import occupancy_broker, occupancy_changed
+from controllers.vehicles import search_active_parkings, normalize_vehicle_number
+from controllers.billing import TariffError, save_tariff, tariff_book
+from controllers.sweeper import overstay_sweeper, overstays_query
+from controllers.geo import GeoError, parse_coordinates, parse_search, search_lots
+from controllers.exports import ExportError, EXPORTS, EXPORT_FORMATS, parse_range, csv_stream, arrow_stream, write_parquet
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps 
+import os
+import tempfile
 from sqlalchemy import func
-from datetime import datetime
-from math import ceil
 
 ## 1. IMPORTS AND CONTEXT PROCESSOR
 
+# the website; registered by create_app() in app.py
+main = Blueprint('main', __name__)
+
 # Context processor to make 'user' available in all templates
-@app.context_processor
+# (loaded lazily, and only once per request)
+@main.app_context_processor
 def inject_user():
-    user = None
-    if 'user_id' in session:
-        user = User.query.get(session['user_id'])
-    return dict(user=user)
+    return dict(user=LocalProxy(current_user), is_admin=is_admin)
+
+# The overstay sweeper thread starts with the first request a worker serves,
+# so flask CLI commands don't start one
+@main.before_app_request
+def start_sweeper():
+    if current_app.config['SWEEPER_ENABLED']:
+        overstay_sweeper.start(current_app._get_current_object())
 
 # ----------------------------------------------------------------------
 ## 2. DECORATORS
@@ -28,7 +53,7 @@ def auth_required(func):
             return func(*args, **kwargs)
         else:
             flash("Please log in first.")
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
     return inner
 
 # Admin required decorator
@@ -37,30 +62,29 @@ def admin_required(func):
     def inner(*args, **kwargs):
         if 'user_id'not in session:
             flash("Please log in first.")
-            return redirect(url_for('login'))
-        user = User.query.get(session['user_id'])
-        if not user.is_admin:
+            return redirect(url_for('main.login'))
+        if not is_admin():
             flash("You are not an admin.")
-            return redirect(url_for('user_dashboard'))
+            return redirect(url_for('main.user_dashboard'))
         return func(*args, **kwargs)
     return inner
 
 # ----------------------------------------------------------------------
 ## 3. PUBLIC AND AUTHENTICATION ROUTES
 
-@app.route('/')
+@main.route('/')
 def index():
     return render_template('home.html')
 
-@app.route('/login')
+@main.route('/login')
 def login():
     return render_template('login.html')
 
-@app.route('/register')
+@main.route('/register')
 def register():
     return render_template('register.html')
 
-@app.route('/register', methods=["POST"])
+@main.route('/register', methods=["POST"])
 def register_post():
     username = request.form.get('username')
     password = request.form.get('password')
@@ -69,16 +93,16 @@ def register_post():
 
     if not username or not password or not recheck_password:
         flash("Please fill all the fields.")
-        return redirect(url_for('register'))
+        return redirect(url_for('main.register'))
 
     if password != recheck_password:
         flash('Passwords do not match.')
-        return redirect(url_for('register'))
+        return redirect(url_for('main.register'))
 
     user = User.query.filter_by(username=username).first()
     if user:
         flash("Username already exists.")
-        return redirect(url_for('register'))
+        return redirect(url_for('main.register'))
 
     password_hash = generate_password_hash(password)
 
@@ -86,66 +110,66 @@ def register_post():
     db.session.add(new_user)
     db.session.commit()
     flash("Registration successful! Please log in.")
-    return redirect(url_for('login'))
+    return redirect(url_for('main.login'))
 
-@app.route('/login', methods=["POST"])
+@main.route('/login', methods=["POST"])
 def login_page():
     username = request.form.get('username')
     password = request.form.get('password')
     if not username or not password:
         flash("Please fill all fields.")
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
 
     user = User.query.filter_by(username=username).first()
     if not user:
         flash("Username doesn't exist.")
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     
     deleted_spot = User.query.filter_by(username=username , is_active_user=True).first()
     if not deleted_spot:
         flash("You are Blocked .")
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
 
     if not check_password_hash(user.passhash, password):
         flash("Incorrect password.")
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
 
-    session['user_id'] = user.id
+    remember_user(user)
     flash("Login successful.")
     if user.is_admin:
-        return redirect(url_for('admin'))
-    return redirect(url_for('user_dashboard'))
+        return redirect(url_for('main.admin'))
+    return redirect(url_for('main.user_dashboard'))
 
-@app.route('/logout')
+@main.route('/logout')
 @auth_required
 def logout():
-    session.pop('user_id', None)
+    forget_user()
     flash("You have been logged out.")
-    return redirect(url_for('login'))
+    return redirect(url_for('main.login'))
 
 # ----------------------------------------------------------------------
 ## 4. SHARED UTILITY ROUTE
 
 # Returns to the appropriate dashboard based on user role
-@app.route('/return_to_dashboard')
+@main.route('/return_to_dashboard')
 @auth_required
 def return_to_dashboard():
-    user = User.query.get(session['user_id'])
+    user = current_user()
     if user.is_admin:
-        return redirect(url_for('admin'))
-    return redirect(url_for('user_dashboard'))
+        return redirect(url_for('main.admin'))
+    return redirect(url_for('main.user_dashboard'))
 
 # to update profile for admin and users 
-@app.route('/profile')
+@main.route('/profile')
 @auth_required
 def profile():
-    user = User.query.get(session['user_id'])
+    user = current_user()
     return render_template('profile.html', USER=user)
 
-@app.route('/profile', methods=["POST"])
+@main.route('/profile', methods=["POST"])
 @auth_required
 def update_profile():
-    user = User.query.get(session['user_id'])
+    user = current_user()
     
     username = request.form.get('username')
     cpassword = request.form.get('cpassword')
@@ -154,17 +178,17 @@ def update_profile():
 
     if not cpassword or not name or not username:
         flash("Please enter the details and current password.")
-        return redirect(url_for('profile'))
+        return redirect(url_for('main.profile'))
 
     if not check_password_hash(user.passhash, cpassword):
         flash("Please fill the current password correctly.")
-        return redirect(url_for('profile'))
+        return redirect(url_for('main.profile'))
 
     if username != user.username:
         existing_user = User.query.filter_by(username=username).first()
         if existing_user:
             flash("Username already exists.")
-            return redirect(url_for('profile'))
+            return redirect(url_for('main.profile'))
         user.usernaedit_lotsme = username
         
     user.name = name
@@ -174,33 +198,18 @@ def update_profile():
 
     db.session.commit()
     flash("Successfully updated.")
-    return redirect(url_for('return_to_dashboard'))
+    return redirect(url_for('main.return_to_dashboard'))
 
 
 # ----------------------------------------------------------------------
 ## 5. USER ROUTES
 
-@app.route('/user_dashboard')
+@main.route('/user_dashboard')
 @auth_required
 def user_dashboard():
     user_id = session['user_id']
-    all_lots = ParkingLot.query.all()
-    lots = []
-    
     # Compile lot details including spot availability
-    for lot in all_lots:
-        unoccupied_spots_count = ParkingSpot.query.filter_by(occupied_status=False, lot_id=lot.id).count()
-        occupied_spots_count = ParkingSpot.query.filter_by(occupied_status=True, lot_id=lot.id).count()
-        lots.append({
-            'id': lot.id,
-            'lot_name': lot.lot_name,
-            'city': lot.city,
-            'pin_code': lot.pin_code,
-            'available_parking_spots': unoccupied_spots_count,
-            'occupied_spots_count': occupied_spots_count,
-            'price': lot.price,
-            'lot_object': lot
-        })
+    lots = lot_summaries()
 
     # Check for active booking
     booked_spot_details = Bookedspot.query.filter_by(user_id=user_id, vehicle_released=False).first()
@@ -211,220 +220,214 @@ def user_dashboard():
     # Fetch details for the active booking
     booked_spot = ParkingSpot.query.get(booked_spot_details.spot_id)
     booked_lot = ParkingLot.query.get(booked_spot.lot_id)
-    user_booked = User.query.get(user_id)
+    user_booked = current_user()
 
     return render_template('user_dashboard.html', lots=lots, booked_spot_details=booked_spot_details,
                            user_booked=user_booked, booked_lot=booked_lot, booked_spot=booked_spot)
 
-@app.route('/spot_list')
+@main.route('/spot_list')
 @auth_required
 def spot_list():
-    all_lots = ParkingLot.query.all()
-    lots = []
-    for lot in all_lots:
-        unoccupied_spots_count = ParkingSpot.query.filter_by(occupied_status=False, lot_id=lot.id).count()
-        occupied_spots_count = ParkingSpot.query.filter_by(occupied_status=True, lot_id=lot.id).count()
-        lots.append({
-            'id': lot.id,
-            'lot_name': lot.lot_name,
-            'city': lot.city,
-            'pin_code': lot.pin_code,
-            'available_parking_spots': unoccupied_spots_count,
-            'occupied_spots_count': occupied_spots_count,
-            'price': lot.price,
-            'lot_object': lot
-        })
-    return render_template('spot_list.html', lots=lots)
-
-@app.route('/book_spot/<int:lot_id>')
+    # ?city=&pin=&available=on, and lat/lon from the "Near me" button
+    try:
+        search = parse_search(request.args)
+    except GeoError as error:
+        flash(str(error))
+        return redirect(url_for('main.spot_list'))
+    filtered = any(request.args.get(key) for key in ('city', 'pin', 'lat', 'available'))
+    if filtered:
+        lots = search_lots(**dict(search, limit=None))
+    else:
+        lots = lot_summaries()
+    return render_template('spot_list.html', lots=lots, search=search, filtered=filtered)
+
+@main.route('/book_spot/<int:lot_id>')
 @auth_required
 def book_spot(lot_id):
-    user = User.query.get(session['user_id'])
+    user = current_user()
     # Check if the user already has an active booking
     if Bookedspot.query.filter_by(user_id=user.id, vehicle_released=False).first():
         flash("You already have an active booking.")
-        return redirect(url_for('user_dashboard'))
+        return redirect(url_for('main.user_dashboard'))
     
-    spots = ParkingSpot.query.filter_by(lot_id=lot_id).all()
+    spots = spot_grid(lot_id)
     if not spots:
         flash("Invalid lot or no spots available.")
-        return redirect(url_for('user_dashboard'))
+        return redirect(url_for('main.user_dashboard'))
 
-    return render_template('lots_list.html', spots=spots)    
+    next_free = free_spot_pool.next_free(lot_id)
+    return render_template('lots_list.html', spots=spots, lot_id=lot_id, next_free=next_free)    
 
-@app.route('/book_this_spot/<int:spot_id>')
+@main.route('/book_this_spot/<int:spot_id>')
 @auth_required
 def book_this_spot(spot_id):
-    user = User.query.get(session['user_id'])
+    user = current_user()
     spot = ParkingSpot.query.get(spot_id)
 
     if spot is None:
         flash("Spot not available.")
-        return redirect(url_for('spot_list'))
+        return redirect(url_for('main.spot_list'))
         
     if spot.occupied_status:
         flash("Spot is occupied.")
-        return redirect(url_for('book_spot', lot_id=spot.lot_id))
+        return redirect(url_for('main.book_spot', lot_id=spot.lot_id))
 
     # Check for active booking
     if Bookedspot.query.filter_by(user_id=user.id, vehicle_released=False).first():
         flash("You already have an active booking.")
-        return redirect(url_for('user_dashboard'))
+        return redirect(url_for('main.user_dashboard'))
     
     
     lot = ParkingLot.query.get(spot.lot_id)
-    available = ParkingSpot.query.filter_by(occupied_status=False, lot_id=spot.lot_id).count()
+    available = lot.free_count
     return render_template('book_this_spot.html', spot=spot, lot=lot, available=available)
 
-@app.route('/book_this_spot/<int:spot_id>', methods=["POST"])
+@main.route('/book_this_spot/<int:spot_id>', methods=["POST"])
 @auth_required
 def booked_spot(spot_id):
-    spot = ParkingSpot.query.get(spot_id)
+    vehicle_number = request.form.get("vehicle_number")
+    try:
+        claim_spot(session['user_id'], spot_id, vehicle_number)
+    except BookingError as error:
+        flash(str(error))
+        spot = ParkingSpot.query.get(spot_id)
+        if spot is None:
+            return redirect(url_for('main.user_dashboard'))
+        return redirect(url_for('main.book_spot', lot_id=spot.lot_id))
 
-    if not spot:
-        flash("Spot not available.")
-        return redirect(url_for('user_dashboard'))
-    is_deleted = spot.deleted_spot
-    if not is_deleted:
-        flash("cant book a deactive spot")
-        return redirect(url_for('book_spot', lot_id=spot.lot_id))
-    user = User.query.get(session['user_id'])
-    
-    # Check again for active booking before committing
-    if Bookedspot.query.filter_by(user_id=user.id, vehicle_released=False).first():
-        flash("You already have an active booking.")
-        return redirect(url_for('user_dashboard'))
-    
-    parked_spot = ParkingSpot.query.filter_by(id=spot_id).first()
+    flash("Booking successful! Your entry time has been recorded.")
+    return redirect(url_for('main.user_dashboard'))
 
-    
+# Auto-allocates the first free spot of the lot
+@main.route('/auto_book/<int:lot_id>', methods=["POST"])
+@auth_required
+def auto_book_spot(lot_id):
     vehicle_number = request.form.get("vehicle_number")
-    user_id = session['user_id']
-    
-    # Mark spot as occupied
-    spot.occupied_status = True
-    
-    # Create new booking record
-    booked = Bookedspot(user_id=user_id, spot_id=spot_id, vehicle_number=vehicle_number)
-    db.session.add(booked)
-    db.session.commit()
-    flash("Booking successful! Your entry time has been recorded.")
-    return redirect(url_for('user_dashboard'))
+    if not vehicle_number:
+        flash("Please enter the vehicle number.")
+        return redirect(url_for('main.book_spot', lot_id=lot_id))
+    try:
+        booking = claim_first_free_spot(session['user_id'], lot_id, vehicle_number)
+    except BookingError as error:
+        flash(str(error))
+        return redirect(url_for('main.spot_list'))
 
-@app.route('/release_spot/<int:book_id>/<int:spot_id>')
+    flash(f"Booking successful! Spot {booking.parking_spot.spot_number} has been allocated.")
+    return redirect(url_for('main.user_dashboard'))
+
+@main.route('/release_spot/<int:book_id>/<int:spot_id>')
 @auth_required
 def release_spot(book_id, spot_id):
-    booking = Bookedspot.query.get(book_id)
-    parking_spot = ParkingSpot.query.get(spot_id)
-    
-    if not booking or booking.vehicle_released:
-        flash("Invalid or already released spot.")
-        return redirect(url_for('user_dashboard'))
-        
-    parking_lot = ParkingLot.query.get(parking_spot.lot_id)
-    parking_cost_per_hour = parking_lot.price
-    
-    # 1. Update Booking and Parking Spot Status
-    booking.vehicle_released = True
-    booking.exit_timing = datetime.now()
-    parking_spot.occupied_status = False
-    
-    # 2. Calculate Cost
-    entry = booking.entry_timing
-    exit_time = booking.exit_timing
-    
-    time_difference = exit_time - entry
-    total_seconds = time_difference.total_seconds()
-    total_hours = total_seconds / 3600
-    
-    # Cost calculation: Round up to the nearest whole hour using ceil()
-    billed_hours = ceil(total_hours)
-    cost = billed_hours * parking_cost_per_hour
-    
-    # 3. Save Cost and Commit
-    booking.parking_cost = cost
-    db.session.commit()
-    
-    flash(f"Vehicle released! Total cost: INR{cost}.")
-    return redirect(url_for('user_dashboard'))
+    try:
+        booking = release_booking(book_id)
+    except BookingError as error:
+        flash(str(error))
+        return redirect(url_for('main.user_dashboard'))
+
+    flash(f"Vehicle released! Total cost: INR{booking.parking_cost}.")
+    return redirect(url_for('main.user_dashboard'))
 
-@app.route('/booking_history')
+# Server-Sent Events stream of occupancy changes, for every lot or just ?lot_id=
+@main.route('/live/lots')
+@auth_required
+def live_lots():
+    lot_id = request.args.get('lot_id', type=int)
+    after_seq = request.headers.get('Last-Event-ID', type=int)
+    return Response(occupancy_broker.stream(lot_id, after_seq), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@main.route('/booking_history')
 @auth_required
 def booking_history():
-    user = User.query.get(session['user_id'])
-    
-    # Get all released bookings for the user
-    released_bookings = Bookedspot.query.filter_by(user_id=user.id, vehicle_released=True).all()
-    
-    occupied_history = []
-    for booking in released_bookings:
-        spot = ParkingSpot.query.get(booking.spot_id)
-        lot = ParkingLot.query.get(spot.lot_id)
-        
-        occupied_history.append({
-            'bookedspot_id': booking.id,
-            'location_name': lot.lot_name,
-            'address': lot.city,
-            'vehicle': booking.vehicle_number,
-            'entry': booking.entry_timing,
-            'exit': booking.exit_timing,
-            'cost': booking.parking_cost
-        })
-    return render_template('booking_history.html', occupied_history=occupied_history)
+    user = current_user()
+
+    # Released bookings for the user, one page at a time (newest first)
+    size = page_size(request.args.get('size'))
+    cursor = request.args.get('cursor')
+    occupied_history, next_cursor = history_page(user.id, cursor, size)
+    return render_template('booking_history.html', occupied_history=occupied_history,
+                           next_cursor=next_cursor, size=size, first_page=not cursor)
+
+# Advance reservations: reserve a spot for a time window, check in when you arrive
+@main.route('/reservations')
+@auth_required
+def reservations():
+    return render_template('reservations.html', lots=lot_summaries(),
+                           reservations=upcoming_reservations(session['user_id']),
+                           lot_id=request.args.get('lot_id', type=int))
+
+@main.route('/reservations', methods=["POST"])
+@auth_required
+def make_reservation():
+    lot_id = request.form.get('lot_id', type=int)
+    try:
+        start, end = parse_window(request.form.get('start'), request.form.get('end'))
+        reservation = reserve(session['user_id'], lot_id, request.form.get('vehicle_number'), start, end)
+    except ReservationError as error:
+        flash(str(error))
+        return redirect(url_for('main.reservations', lot_id=lot_id))
+
+    flash(f"Spot {reservation.spot_number} at {reservation.lot_name} reserved "
+          f"from {start:%d %b %H:%M} to {end:%d %b %H:%M}.")
+    return redirect(url_for('main.reservations'))
+
+@main.route('/reservations/<int:reservation_id>/check_in', methods=["POST"])
+@auth_required
+def check_in_reservation(reservation_id):
+    try:
+        booking = check_in(session['user_id'], reservation_id)
+    except BookingError as error:
+        flash(str(error))
+        return redirect(url_for('main.reservations'))
+
+    flash(f"Checked in! Your vehicle is booked into spot {booking.parking_spot.spot_number}.")
+    return redirect(url_for('main.user_dashboard'))
+
+@main.route('/reservations/<int:reservation_id>/cancel', methods=["POST"])
+@auth_required
+def cancel_reservation_view(reservation_id):
+    try:
+        cancel_reservation(reservation_id, session['user_id'])
+    except ReservationError as error:
+        flash(str(error))
+    else:
+        flash("Reservation cancelled.")
+    return redirect(url_for('main.reservations'))
 
 # ----------------------------------------------------------------------
 ## 6. ADMIN ROUTES
 
-@app.route('/admin')
+@main.route('/admin')
 @admin_required
 def admin():
-    user = User.query.get(session['user_id'])
-    all_lots = ParkingLot.query.all()
-    lots = []
-    
-    for lot in all_lots:
-        unoccupied_spots_count = ParkingSpot.query.filter_by(occupied_status=False, lot_id=lot.id).count()
-        occupied_spots_count = ParkingSpot.query.filter_by(occupied_status=True, lot_id=lot.id).count()
-        lots.append({
-            'id': lot.id,
-            'lot_name': lot.lot_name,
-            'city': lot.city,
-            'pin_code': lot.pin_code,
-            'available_parking_spots': unoccupied_spots_count,
-            'occupied_spots_count': occupied_spots_count,
-            'lot_object': lot
-        })
+    user = current_user()
+    lots = lot_occupancy()
     user_count = User.query.filter_by(is_active_user = True, is_admin=False).count()   
-    bookings_count = ParkingSpot.query.filter_by(occupied_status=True).count()
-    lot_count = ParkingLot.query.count()
-    total_revenue = db.session.query(func.sum(Bookedspot.parking_cost)).scalar()
+    bookings_count = sum(lot['occupied_spots_count'] for lot in lots)
+    lot_count = len(lots)
+    total_revenue = db.session.query(func.sum(LotDailyUsage.revenue)).scalar()
     
     # Ensure variables are initialized if query returns None
     total_revenue = total_revenue if total_revenue is not None else 0
+
+    # running costs and overstays as of the last sweep (controllers/sweeper.py)
+    overstay_count, accrued_revenue = db.session.query(
+        func.count(Bookedspot.overstay_at), func.coalesce(func.sum(Bookedspot.accrued_cost), 0)
+    ).filter(Bookedspot.vehicle_released == False).one()
+    overstays = overstays_query(current_app.config['OVERSTAY_HOURS']).all()
     
     return render_template('admin.html',  lots=lots, total_revenue=total_revenue, 
-                           lot_count=lot_count, bookings_count=bookings_count, user_count=user_count) 
+                           lot_count=lot_count, bookings_count=bookings_count, user_count=user_count,
+                           overstay_count=overstay_count, accrued_revenue=accrued_revenue, overstays=overstays,
+                           overstay_hours=current_app.config['OVERSTAY_HOURS'])
 
-@app.route('/lot_list')
+@main.route('/lot_list')
 @admin_required
 def lot_list():
-    all_lots = ParkingLot.query.all()
-    lots = []
-    for lot in all_lots:
-        unoccupied_spots_count = ParkingSpot.query.filter_by(occupied_status=False, lot_id=lot.id).count()
-        occupied_spots_count = ParkingSpot.query.filter_by(occupied_status=True, lot_id=lot.id).count()
-        lots.append({
-            'id': lot.id,
-            'lot_name': lot.lot_name,
-            'city': lot.city,
-            'pin_code': lot.pin_code,
-            'available_parking_spots': unoccupied_spots_count,
-            'occupied_spots_count': occupied_spots_count,
-            'lot_object': lot
-        })
+    lots = lot_occupancy()
     return render_template('admin_add_lot.html', lots=lots)
 
-@app.route('/create_lot', methods=["POST"])
+@main.route('/create_lot', methods=["POST"])
 @admin_required
 def create_lot():
     lot_name = request.form.get('location_name')
@@ -435,183 +438,210 @@ def create_lot():
     
     if not all([lot_name, pin_code, city, price, spots_count]):
         flash("Please fill all the details.")
-        return redirect(url_for('admin'))
+        return redirect(url_for('main.admin'))
         
     try:
         spots_count = int(spots_count)
         price = float(price)
     except ValueError:
         flash("Price and Spot count must be numbers.")
-        return redirect(url_for('admin'))
+        return redirect(url_for('main.admin'))
+    try:
+        latitude, longitude = parse_coordinates(request.form.get('latitude'), request.form.get('longitude'))
+    except GeoError as error:
+        flash(str(error))
+        return redirect(url_for('main.admin'))
 
     new_lot = ParkingLot(lot_name=lot_name, price=price, city=city, pin_code=pin_code, 
-                         available_parking_spots=spots_count, deleted_lot=True)
+                         available_parking_spots=spots_count, deleted_lot=True,
+                         latitude=latitude, longitude=longitude)
+    reset_lot_counters(new_lot, spots_count)
     db.session.add(new_lot)
     db.session.flush() # Get the new_lot.id before committing
 
-    # Create parking spots for the new lot
-    def create_spot(lot_id,spots_count):
-        new_spots = [ParkingSpot(lot_id=lot_id, spot_number='P{:03d}'.format(i+1), occupied_status=False) 
-                 for i in range(spots_count)]      
-        db.session.add_all(new_spots)
-    
+    # Create parking spots for the new lot in one bulk insert
     lot_id = new_lot.id
-    create_spot(lot_id,spots_count)
+    add_spots(lot_id, 1, spots_count)
     db.session.commit()
+    free_spot_pool.drop(lot_id)
+    lot_changed(lot_id)
+    occupancy_changed(lot_id, reload=True)
     flash(f"Parking Lot '{lot_name}' created successfully with {spots_count} spots.")
-    return redirect(url_for('lot_list'))
+    return redirect(url_for('main.lot_list'))
 
-@app.route('/see_spots/<int:sid>')
+@main.route('/see_spots/<int:sid>')
 @admin_required
 def see_lots(sid):
-    lots=ParkingLot.query.filter_by(id=sid).first()
-    spots = ParkingSpot.query.filter_by(lot_id=sid).all()
-    unoccupied_spots_count = ParkingSpot.query.filter_by(occupied_status=False, lot_id=lots.id).count()
-    occupied_spots_count = ParkingSpot.query.filter_by(occupied_status=True, lot_id=lots.id).count()
+    lots = lot_summary(sid)
+    if not lots:
+        flash("Parking lot not found.")
+        return redirect(url_for('main.lot_list'))
+    spots = spot_grid(sid)
+    unoccupied_spots_count = lots['available_parking_spots']
+    occupied_spots_count = lots['occupied_spots_count']
     
     return render_template('admin_spot_view.html', lots=lots, spots=spots ,unoccupied_spots_count=unoccupied_spots_count,occupied_spots_count=occupied_spots_count)
-@app.route('/view_this_spot_details/<int:sid>')
+@main.route('/view_this_spot_details/<int:sid>')
 @admin_required
 def view_this_spot_details(sid):
     parked_spot = ParkingSpot.query.filter_by(id=sid,occupied_status=True).first()
-    if not parked_spot:
+    spot = Bookedspot.query.filter_by(spot_id=sid, vehicle_released=False).first()
+    if not parked_spot or not spot:
         flash("Not a Booked Spot")
-    spot = Bookedspot.query.filter_by(spot_id=sid).first()
+        return redirect(url_for('main.lot_list'))
     lot_id = parked_spot.lot_id
     lot = ParkingLot.query.filter_by(id=lot_id).first()
     user_id = spot.user_id
     user = User.query.filter_by(id=user_id).first()
     return render_template('admin_spot_user_details.html', spot=spot , parked_spot=parked_spot,lot=lot,user=user)
 
-@app.route('/deactivate_this_spot/<int:sid>')
+@main.route('/deactivate_this_spot/<int:sid>')
 @admin_required
 def deactivate_this_spot(sid):
-    parked_spot = ParkingSpot.query.filter_by(id=sid).first()
+    parked_spot = ParkingSpot.query.filter_by(id=sid, retired=False).first()
     if not parked_spot:
         flash("Parking spot not found.")
-        return redirect(url_for('lot_list'))
+        return redirect(url_for('main.lot_list'))
     
     lot = ParkingLot.query.filter_by(id=parked_spot.lot_id).first()
     return render_template('admin_deactivate_spot.html', parked_spot=parked_spot, lot=lot)
 
-@app.route('/deactivate_this_spot/<int:sid>',methods=["POST"])
+@main.route('/deactivate_this_spot/<int:sid>',methods=["POST"])
 @admin_required
 def deactivated_spot(sid):
-    parked_spot = ParkingSpot.query.filter_by(id=sid).first()
+    parked_spot = ParkingSpot.query.filter_by(id=sid, retired=False).first()
 
     if not parked_spot:
         flash("Spot not found.") 
-        return redirect(url_for('lot_list'))
+        return redirect(url_for('main.lot_list'))
 
     # see is the spot is occupied then we not delete
     if parked_spot.occupied_status and not parked_spot.deleted_spot:
         flash("Cannot deactivate an occupied spot")
-        return redirect(url_for('see_lots', sid=parked_spot.lot_id))
+        return redirect(url_for('main.see_lots', sid=parked_spot.lot_id))
     
     # see between deleted and undelted
     parked_spot.deleted_spot = not parked_spot.deleted_spot
+    spot_toggled(parked_spot)
     db.session.commit() 
+    free_spot_pool.spot_changed(parked_spot)
+    lot_changed(parked_spot.lot_id)
+    occupancy_changed(parked_spot.lot_id, [parked_spot.id])
 
     if parked_spot.deleted_spot:
         flash(f"Spot {parked_spot.spot_number} successfully activated.")
     else:
         flash(f"Spot {parked_spot.spot_number} successfully dectivated.")
-    return redirect(url_for('see_lots', sid=parked_spot.lot_id))
+    return redirect(url_for('main.see_lots', sid=parked_spot.lot_id))
     
 
 
 
-@app.route('/edit_lots/<int:sid>')
+@main.route('/edit_lots/<int:sid>')
 @admin_required
 def edit_lots(sid):
     lots=ParkingLot.query.filter_by(id=sid).first()
-    spots_count = ParkingSpot.query.filter_by(lot_id=sid).count()    
+    spots_count = lots.available_parking_spots
     return render_template('admin_edit_lot.html',lots=lots,spots_count=spots_count)
 
-@app.route('/edit_lots/<int:sid>', methods=["POST"])
+@main.route('/edit_lots/<int:sid>', methods=["POST"])
 @admin_required
 def edited_lot(sid):
     lot = ParkingLot.query.filter_by(id=sid).first_or_404()
-    active_bookings = ParkingSpot.query.filter_by(lot_id=sid, occupied_status=True).count()
     new_spot_count = int(request.form.get('spots'))
 
     lot.lot_name = request.form.get('location_name')
     lot.pin_code = request.form.get('pin_code')
     lot.city = request.form.get('adress')
     lot.price = float(request.form.get('price'))
-
-    if active_bookings > 0:
-        flash("Active bookings exist! Spot count cannot be changed.")
-    else:
-        old_spots = ParkingSpot.query.filter_by(lot_id=sid).all()
-        for spot in old_spots:
-            db.session.delete(spot)
-        new_spots = [
-            ParkingSpot(
-                lot_id=sid,
-                spot_number='P{:03d}'.format(i + 1),
-                occupied_status=False
-            ) for i in range(new_spot_count)
-        ]
-        db.session.add_all(new_spots)
-        lot.available_parking_spots = new_spot_count
-
+    try:
+        lot.latitude, lot.longitude = parse_coordinates(request.form.get('latitude'), request.form.get('longitude'))
+        tariff = save_tariff(lot, request.form)
+    except (GeoError, TariffError) as error:
+        db.session.rollback()
+        flash(str(error))
+        return redirect(url_for('main.edit_lots', sid=sid))
+
+    # Resize in place: add or retire spots at the end of the lot; a failed
+    # resize discards the whole edit
+    try:
+        resize_lot(lot, new_spot_count)
+    except ResizeError as error:
+        db.session.rollback()
+        flash(str(error))
+        return redirect(url_for('main.edit_lots', sid=sid))
+
+    # the name and price are part of the cached lot responses too
+    bump_occupancy_version(lot)
     db.session.commit()
+    tariff_book.put(sid, lot.price, lot.tariff_version, tariff)
+    free_spot_pool.drop(sid)
+    reservation_index.drop(sid)
+    lot_changed(sid)
+    occupancy_changed(sid, reload=True)
     flash(f"Parking lot '{lot.lot_name}' updated successfully.")
-    return redirect(url_for('lot_list'))
+    return redirect(url_for('main.lot_list'))
 
 
-@app.route('/delete_spots/<int:sid>')
+@main.route('/delete_spots/<int:sid>')
 @admin_required
 def delete_lots(sid):
     lot = ParkingLot.query.filter_by(id=sid).first()
-    active_bookings = ParkingSpot.query.filter_by(lot_id = sid ,occupied_status=True).count()
     if not lot:
-        return redirect(url_for('lot_list'))
+        return redirect(url_for('main.lot_list'))
+    active_bookings = lot.occupied_count
     if active_bookings:
         flash(f"{lot.lot_name} has active bookings cant delete it")
-        return redirect(url_for('lot_list'))
+        return redirect(url_for('main.lot_list'))
+    if has_upcoming_reservations(sid):
+        flash(f"{lot.lot_name} has upcoming reservations cant delete it")
+        return redirect(url_for('main.lot_list'))
+    lot_deleted(sid)
     db.session.delete(lot)
     db.session.flush()
     db.session.commit()
+    free_spot_pool.drop(sid)
+    reservation_index.drop(sid)
+    lot_changed(sid)
+    occupancy_changed(sid)
     flash(f"{lot.lot_name } was successfully deleted !")
-    return redirect(url_for('lot_list'))
+    return redirect(url_for('main.lot_list'))
     
 
-@app.route('/user_list')
+# Where is a vehicle parked? Full plate or the first few characters
+@main.route('/vehicle_search')
+@admin_required
+def vehicle_search():
+    plate = request.args.get('plate', '').strip()
+    parkings = search_active_parkings(plate) if plate else []
+    return render_template('admin_vehicle_search.html', plate=plate, parkings=parkings,
+                           normalized=normalize_vehicle_number(plate))
+
+@main.route('/user_list')
 @admin_required
 def user_list():
-    all_users = User.query.all()
     user_count = User.query.filter_by(is_active_user = True, is_admin=False).count()
-    bookings_count = ParkingSpot.query.filter_by(occupied_status=True).count()
-    usermodel = []
-    
-    for user in all_users:
-        if user.is_admin:
-            continue
-            
-        current_spot_id = "NA"
-        current_spot_number = "NA"
-        
-        # Check for active, unreleased bookings
-        active_booking = Bookedspot.query.filter_by(user_id=user.id, vehicle_released=False).first()
-        
-        if active_booking:
-            parking_spot = ParkingSpot.query.get(active_booking.spot_id)
-            current_spot_id = parking_spot.id
-            current_spot_number = parking_spot.spot_number
-
-        usermodel.append({
-            'id': user.id,
-            'username': user.username,
-            'name': user.name,
-            'spot_id': current_spot_id,
-            'spot_number': current_spot_number,
-            'deleted_spot': user.is_active_user
-        })
-    return render_template('user_list.html', usermodel=usermodel, user_count=user_count, bookings_count=bookings_count)
-
-@app.route('/deactivate_user/<int:uid>')
+    bookings_count = db.session.query(func.coalesce(func.sum(ParkingLot.occupied_count), 0)).scalar()
+
+    # Search and filters come from the query string, one page at a time
+    filters = {
+        'search': request.args.get('search', '').strip(),
+        'status': request.args.get('status', ''),
+        'parked': request.args.get('parked', '')
+    }
+    size = page_size(request.args.get('size'), USER_PAGE_SIZE, USER_MAX_PAGE_SIZE)
+    after_id = request.args.get('after', type=int)
+    usermodel, next_after_id = user_page(filters['search'], filters['status'], filters['parked'], after_id, size)
+    return render_template('user_list.html', usermodel=usermodel, user_count=user_count, bookings_count=bookings_count,
+                           filters=filters, size=size, next_after_id=next_after_id, first_page=after_id is None)
+
+# Hit/miss counters of the lot card and spot grid cache (this worker only)
+@main.route('/cache_stats')
+@admin_required
+def cache_stats():
+    return jsonify(view_cache.stats())
+
+@main.route('/deactivate_user/<int:uid>')
 @admin_required
 def deactivate_user(uid):
     user = User.query.get(uid)
@@ -619,10 +649,10 @@ def deactivate_user(uid):
     user_booked_spot = Bookedspot.query.filter_by(user_id=user_bid,vehicle_released=False).first()
     if not user or user.is_admin:
         flash("Invalid user or cannot deactivate admin.")
-        return redirect(url_for('user_list'))
+        return redirect(url_for('main.user_list'))
     if user_booked_spot:
         flash("sorry! user have active bookings ")
-        return redirect(url_for('user_list'))   
+        return redirect(url_for('main.user_list'))   
     if user.is_active_user:
         user.is_active_user = False
         flash(f"User '{user.username}' successfully deactivated.")
@@ -633,23 +663,24 @@ def deactivate_user(uid):
         db.session.flush()
         
     db.session.commit()
-    return redirect(url_for('user_list'))
+    return redirect(url_for('main.user_list'))
 
 #------------------------------------------user_summary---------------------------------------------------------
-@app.route('/user_bookings_summary')
+@main.route('/user_bookings_summary')
 @auth_required
 def user_bookings_summary():
-    user = User.query.get(session['user_id'])
+    user = current_user()
     user_id = user.id
     if not user:
         return render_template('error.html', message=f"User with ID {user_id} not found.")
 
-    # CRUCIAL: Filtering by Bookedspot.user_id == user_id ensures only the logged-in user's data is aggregated.
+    # CRUCIAL: Filtering by UserMonthlyUsage.user_id == user_id ensures only the logged-in user's data is shown.
     monthly_data = db.session.query(
-        func.strftime('%Y-%m', Bookedspot.entry_timing).label('year_month'),
-        func.count(Bookedspot.id).label('booking_count'),
-        func.sum(Bookedspot.parking_cost).label('total_expenditure')
-    ).filter(Bookedspot.user_id == user_id).group_by('year_month').order_by('year_month').all()
+        UserMonthlyUsage.month.label('year_month'),
+        UserMonthlyUsage.bookings.label('booking_count'),
+        UserMonthlyUsage.expenditure.label('total_expenditure')
+    ).filter(UserMonthlyUsage.user_id == user_id, UserMonthlyUsage.bookings > 0
+    ).order_by(UserMonthlyUsage.month).all()
 
     month_names = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
     
@@ -683,14 +714,16 @@ def user_bookings_summary():
 
 
 #------------------------------------admin_summary----------------------------------
-@app.route('/admin_summary')
+@main.route('/admin_summary')
 @admin_required
 def admin_summary():
     # Total spots that are NOT deleted
     total_spots = db.session.query(func.count(ParkingSpot.id))
     # total_revenue = db.session.query(func.sum(ParkingSpot.occupied_status=False)).scalar()
-    occupied_spots = ParkingSpot.query.filter_by(occupied_status=True,deleted_spot = True).count()
-    unoccupied_spots = ParkingSpot.query.filter_by(occupied_status=False,deleted_spot = True).count()
+    occupied_spots, unoccupied_spots = db.session.query(
+        func.coalesce(func.sum(ParkingLot.occupied_count), 0),
+        func.coalesce(func.sum(ParkingLot.free_count), 0)
+    ).one()
     # Occupied spots: those with occupied_status = True and not deleted
     
 
@@ -699,13 +732,11 @@ def admin_summary():
         'data': [occupied_spots, unoccupied_spots]
     }
 
-    # Monthly revenue from Bookedspot (only those with parking_cost not none)
+    # Monthly revenue from the daily lot rollups (released bookings only)
     monthly_revenue = db.session.query(
-        func.strftime('%Y-%m', Bookedspot.entry_timing).label('year_month'),
-        func.sum(Bookedspot.parking_cost).label('total_revenue')
-    ).filter(
-        Bookedspot.parking_cost != None
-    ).group_by('year_month').order_by('year_month').all()
+        month_of(LotDailyUsage.day).label('year_month'),
+        func.sum(LotDailyUsage.revenue).label('total_revenue')
+    ).group_by('year_month').having(func.sum(LotDailyUsage.released) > 0).order_by('year_month').all()
 
     month_names = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
     bar_labels = []
@@ -724,8 +755,54 @@ def admin_summary():
         'revenue': revenue_data
     }
 
+    lots = db.session.query(ParkingLot.id, ParkingLot.lot_name).order_by(ParkingLot.lot_name).all()
+
     return render_template(
         'admin_summary.html',
         pie_chart_data=pie_chart_data,
-        bar_chart_data=bar_chart_data
+        bar_chart_data=bar_chart_data,
+        lots=lots
     )
+
+# Booking history / daily revenue download, streamed chunk by chunk
+@main.route('/export/<kind>')
+@admin_required
+def export(kind):
+    fmt = request.args.get('format', 'csv')
+    lot_id = request.args.get('lot_id', type=int)
+    try:
+        if kind not in EXPORTS or fmt not in EXPORT_FORMATS:
+            raise ExportError("Unknown export.")
+        start, end = parse_range(request.args.get('start'), request.args.get('end'))
+        filename = f"{kind}.{fmt}"
+        if fmt == 'csv':
+            body = csv_stream(kind, start, end, lot_id)
+            mimetype = 'text/csv'
+        elif fmt == 'arrow':
+            body = arrow_stream(kind, start, end, lot_id)
+            mimetype = 'application/vnd.apache.arrow.stream'
+        else:
+            # Parquet needs its footer at the end, so it is built in a temp file
+            handle, path = tempfile.mkstemp(suffix='.parquet')
+            os.close(handle)
+            try:
+                write_parquet(kind, path, start, end, lot_id)
+                response = send_file(path, mimetype='application/vnd.apache.parquet',
+                                     as_attachment=True, download_name=filename)
+            except Exception:
+                os.remove(path)
+                raise
+            response.call_on_close(lambda: os.remove(path))
+            return response
+        # pull the first block now so an error still becomes a flash message
+        first = next(body)
+    except ExportError as error:
+        flash(str(error))
+        return redirect(url_for('main.admin_summary'))
+
+    def blocks():
+        yield first
+        yield from body
+
+    return Response(stream_with_context(blocks()), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
@@ -0,0 +1,140 @@
+import random
+from datetime import datetime, timedelta
+from math import log
+from sqlalchemy import func, insert, update
+from werkzeug.security import generate_password_hash
+from models.models import db, User, ParkingLot, ParkingSpot, Bookedspot
+from controllers.provisioning import add_spots
+from controllers.occupancy import check_lot_counters
+from controllers.rollups import rebuild_rollups
+from controllers.billing import CompiledTariff
+
+# Synthetic data for benchmarks and load tests.
+# The same seed always produces the same data. Entries follow a commuter
+# pattern (peaks around 9:00 and 18:00, quieter weekends), stays are
+# log-normal around two hours, and a few regulars make most of the
+# bookings. Seeded users are user000001, user000002, ... with the password
+# SEED_PASSWORD; the currently parked vehicles belong to the lowest user
+# numbers, so the benchmarks book as the highest ones.
+
+SEED_CHUNK = 10000
+SEED_PASSWORD = 'password'
+# city -> (latitude, longitude) of its centre; lots are scattered up to
+# CITY_SPREAD degrees (about 15 km) around it
+CITIES = {
+    'Chennai': (13.0827, 80.2707), 'Bengaluru': (12.9716, 77.5946), 'Mumbai': (19.0760, 72.8777),
+    'Delhi': (28.6139, 77.2090), 'Hyderabad': (17.3850, 78.4867), 'Pune': (18.5204, 73.8567),
+    'Kolkata': (22.5726, 88.3639), 'Kochi': (9.9312, 76.2673),
+}
+CITY_SPREAD = 0.15
+PRICES = [10, 20, 30, 40, 50]
+# relative number of entries per clock hour
+HOUR_WEIGHTS = [1, 1, 1, 1, 1, 2, 4, 8, 12, 14, 10, 8, 9, 9, 8, 8, 10, 13, 12, 8, 6, 4, 2, 1]
+MEDIAN_STAY_MINUTES = 120
+LONGEST_STAY_MINUTES = 72 * 60
+
+
+class SeedError(Exception):
+    pass
+
+
+def seed_username(number):
+    return f"user{number:06d}"
+
+
+def seed_plate(number):
+    letters = chr(65 + number % 26) + chr(65 + number // 26 % 26)
+    return f"TN{number % 99 + 1:02d}{letters}{number % 10000:04d}"
+
+
+def _insert_chunks(model, rows):
+    # Core inserts on the table skip the ORM's bulk bookkeeping
+    table = model.__table__
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == SEED_CHUNK:
+            db.session.execute(insert(table), chunk)
+            chunk = []
+    if chunk:
+        db.session.execute(insert(table), chunk)
+
+
+def _history(rng, bookings, users, first_user, spots, days, now):
+    # spots: [(spot_id, CompiledTariff)]
+    cum_weights = []
+    total = 0
+    for weight in HOUR_WEIGHTS:
+        total += weight
+        cum_weights.append(total)
+    first_day = (now - timedelta(days=days)).replace(hour=0, minute=0, second=0, microsecond=0)
+    mu = log(MEDIAN_STAY_MINUTES)
+    hours = range(24)
+    made = 0
+    while made < bookings:
+        count = min(SEED_CHUNK, bookings - made)
+        for hour in rng.choices(hours, cum_weights=cum_weights, k=count):
+            day = first_day + timedelta(days=rng.randrange(days))
+            if day.weekday() >= 5 and rng.random() < 0.4:
+                day = day - timedelta(days=day.weekday() - 4)
+            entry = day + timedelta(hours=hour, minutes=rng.randrange(60), seconds=rng.randrange(60))
+            stay = min(max(rng.lognormvariate(mu, 0.9), 5), LONGEST_STAY_MINUTES)
+            exit_timing = entry + timedelta(seconds=int(stay * 60))
+            if exit_timing >= now:
+                entry -= timedelta(days=1)
+                exit_timing -= timedelta(days=1)
+            # regulars: low user numbers come up much more often
+            user = int(users * rng.random() ** 2) + 1
+            spot_id, tariff = spots[rng.randrange(len(spots))]
+            yield {'user_id': first_user + user - 1, 'spot_id': spot_id, 'vehicle_number': seed_plate(user),
+                   'entry_timing': entry, 'exit_timing': exit_timing,
+                   'parking_cost': tariff.cost(entry, exit_timing), 'vehicle_released': True}
+        made += count
+
+
+def seed_database(lots=20, spots_per_lot=100, users=1000, bookings=100000, days=365,
+                  occupancy=0.6, seed=42, now=None):
+    if ParkingLot.query.first() is not None:
+        raise SeedError("The database already has parking lots; seed an empty database.")
+    rng = random.Random(seed)
+    now = now or datetime.now().replace(microsecond=0)
+
+    passhash = generate_password_hash(SEED_PASSWORD)
+    first_user = (db.session.query(func.max(User.id)).scalar() or 0) + 1
+    _insert_chunks(User, ({'username': seed_username(number), 'passhash': passhash, 'name': f"User {number}",
+                           'is_admin': False, 'is_active_user': True} for number in range(1, users + 1)))
+
+    cities = list(CITIES)
+    for number in range(lots):
+        city = cities[number % len(cities)]
+        latitude, longitude = CITIES[city]
+        lot_id = db.session.execute(insert(ParkingLot).values(
+            lot_name=f"Lot {number + 1}", price=rng.choice(PRICES), city=city,
+            pin_code=str(600001 + number), available_parking_spots=spots_per_lot, deleted_lot=True,
+            latitude=round(latitude + rng.uniform(-CITY_SPREAD, CITY_SPREAD), 5),
+            longitude=round(longitude + rng.uniform(-CITY_SPREAD, CITY_SPREAD), 5)
+        )).inserted_primary_key[0]
+        add_spots(lot_id, 1, spots_per_lot)
+
+    prices = dict(db.session.query(ParkingLot.id, ParkingLot.price))
+    spots = [(spot_id, CompiledTariff(prices[lot_id]))
+             for spot_id, lot_id in db.session.query(ParkingSpot.id, ParkingSpot.lot_id).order_by(ParkingSpot.id)]
+
+    _insert_chunks(Bookedspot, _history(rng, bookings, users, first_user, spots, days, now))
+
+    # the parked vehicles: one open booking each for the lowest user numbers,
+    # leaving at least half of the users free to book
+    parked = rng.sample([spot_id for spot_id, _ in spots], min(int(len(spots) * occupancy), users // 2))
+    _insert_chunks(Bookedspot, ({'user_id': first_user + number - 1, 'spot_id': spot_id, 'vehicle_number': seed_plate(number),
+                                 'entry_timing': now - timedelta(minutes=rng.randrange(5, 600)),
+                                 'vehicle_released': False}
+                                for number, spot_id in enumerate(parked, start=1)))
+    for index in range(0, len(parked), SEED_CHUNK):
+        db.session.execute(update(ParkingSpot).where(ParkingSpot.id.in_(parked[index:index + SEED_CHUNK]))
+                           .values(occupied_status=True).execution_options(synchronize_session=False))
+    db.session.commit()
+
+    check_lot_counters(repair=True)
+    with db.engine.begin() as connection:
+        rebuild_rollups(connection)
+    return {'lots': lots, 'spots': len(spots), 'users': users, 'bookings': bookings, 'parked': len(parked)}
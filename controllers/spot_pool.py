@@ -0,0 +1,103 @@
+import heapq
+import threading
+from models.models import db, ParkingSpot
+
+# In-memory pool of free spots per lot.
+# Each lot keeps a min-heap of (spot_id, spot_number) plus a set of the ids
+# that are really free, so the lowest free spot is found in O(log n) without
+# scanning ParkingSpot. Entries that are no longer free are dropped lazily
+# when they reach the top of the heap.
+#
+# The pool is only a hint: the compare-and-set in controllers/allocation.py
+# stays authoritative, so a stale entry (e.g. a spot booked through another
+# worker) just costs one failed claim before it is discarded.
+
+
+class FreeSpotPool:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._heaps = {}
+        self._free = {}
+
+    # never query the database while holding the lock: a thread waiting for
+    # a pooled connection under the lock would stall every other request
+
+    def _fetch(self, lot_id):
+        rows = db.session.query(ParkingSpot.id, ParkingSpot.spot_number).filter_by(
+            lot_id=lot_id, occupied_status=False, deleted_spot=True
+        ).all()
+        return [(spot_id, spot_number) for spot_id, spot_number in rows]
+
+    def _install(self, lot_id, heap):
+        heapq.heapify(heap)
+        self._heaps[lot_id] = heap
+        self._free[lot_id] = {spot_id for spot_id, _ in heap}
+
+    def warm(self, lot_id):
+        heap = self._fetch(lot_id)
+        with self._lock:
+            self._install(lot_id, heap)
+
+    def next_free(self, lot_id, exclude=()):
+        # lowest free (spot_id, spot_number) of the lot that is not in
+        # exclude (e.g. spots reserved soon), or None
+        if lot_id not in self._heaps:
+            heap = self._fetch(lot_id)
+            with self._lock:
+                if lot_id not in self._heaps:
+                    self._install(lot_id, heap)
+        with self._lock:
+            if lot_id not in self._heaps:
+                # dropped by a concurrent lot edit; the next call reloads it
+                return None
+            heap = self._heaps[lot_id]
+            free = self._free[lot_id]
+            while heap and heap[0][0] not in free:
+                heapq.heappop(heap)
+            if not heap:
+                return None
+            if heap[0][0] not in exclude:
+                return heap[0]
+            # one pass over the heap; only lots with upcoming reservations get here
+            return min((entry for entry in heap if entry[0] in free and entry[0] not in exclude), default=None)
+
+    def add(self, lot_id, spot_id, spot_number):
+        with self._lock:
+            if lot_id not in self._heaps or spot_id in self._free[lot_id]:
+                return
+            self._free[lot_id].add(spot_id)
+            heapq.heappush(self._heaps[lot_id], (spot_id, spot_number))
+
+    def discard(self, lot_id, spot_id):
+        with self._lock:
+            if lot_id in self._free:
+                self._free[lot_id].discard(spot_id)
+
+    def drop(self, lot_id):
+        with self._lock:
+            self._heaps.pop(lot_id, None)
+            self._free.pop(lot_id, None)
+
+    def spot_changed(self, spot):
+        # keep the pool in step with a spot after its change was committed
+        if spot.occupied_status or not spot.deleted_spot:
+            self.discard(spot.lot_id, spot.id)
+        else:
+            self.add(spot.lot_id, spot.id, spot.spot_number)
+
+    def verify(self, repair=True):
+        # compare every loaded lot with the ParkingSpot table
+        mismatched = []
+        for lot_id in list(self._free):
+            heap = self._fetch(lot_id)
+            free_in_db = {spot_id for spot_id, _ in heap}
+            with self._lock:
+                free_in_pool = set(self._free.get(lot_id, ()))
+                if free_in_db != free_in_pool:
+                    mismatched.append((lot_id, len(free_in_pool), len(free_in_db)))
+                    if repair:
+                        self._install(lot_id, heap)
+        return mismatched
+
+
+free_spot_pool = FreeSpotPool()
@@ -0,0 +1,184 @@
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import insert, or_, select, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from models.models import db, ParkingLot, ParkingSpot, Bookedspot, SchedulerLock
+from controllers.billing import price_stays
+from controllers.gate import process_gate_events
+from controllers.vehicles import active_parkings_query
+from controllers.reservations import expire_reservations
+from controllers.spot_pool import free_spot_pool
+
+# Overstay sweeper.
+# Every worker runs a background thread that wakes up every SWEEP_INTERVAL
+# seconds and tries to take the 'overstay-sweeper' lease in scheduler_lock;
+# only the worker holding the lease sweeps, and it keeps the lease by
+# renewing it each round. A sweep
+#   - stores the running cost of every open booking in accrued_cost, so the
+#     admin dashboard reads it instead of pricing stays per request;
+#   - flags open bookings older than OVERSTAY_HOURS (overstay_at);
+#   - with OVERSTAY_RELEASE_HOURS set, releases the ones older than that
+#     through the bulk gate path, SWEEP_BATCH at a time;
+#   - expires the reservations nobody checked into (controllers/reservations.py).
+# Every worker, lease or not, also compares its free spot pool with the
+# spot table each round and reloads the lots that drifted.
+# The old open bookings are found with a range scan of ix_open_booking_entry.
+
+SWEEP_BATCH = 500
+SWEEPER_LOCK = 'overstay-sweeper'
+OVERSTAY_LIST_SIZE = 20
+
+
+def acquire_lease(name, owner, seconds):
+    # True if owner now holds the lease (taken, renewed or taken over after it expired)
+    now = datetime.now()
+    expires_at = now + timedelta(seconds=seconds)
+    taken = db.session.execute(
+        update(SchedulerLock)
+        .where(SchedulerLock.name == name, or_(SchedulerLock.owner == owner, SchedulerLock.expires_at < now))
+        .values(owner=owner, expires_at=expires_at)
+    ).rowcount
+    if not taken:
+        try:
+            db.session.execute(insert(SchedulerLock).values(name=name, owner=owner, expires_at=expires_at))
+        except IntegrityError:
+            # somebody else holds it
+            db.session.rollback()
+            return False
+    db.session.commit()
+    return True
+
+
+def open_bookings_page(key, size=SWEEP_BATCH):
+    # open bookings after key = (entry_timing, id), oldest first
+    query = db.session.query(
+        Bookedspot.id, Bookedspot.entry_timing,
+        ParkingLot.id.label('lot_id'), ParkingLot.price, ParkingLot.tariff_version
+    ).join(ParkingSpot, ParkingSpot.id == Bookedspot.spot_id
+    ).join(ParkingLot, ParkingLot.id == ParkingSpot.lot_id
+    ).filter(Bookedspot.vehicle_released == False)
+    if key is not None:
+        query = query.filter(tuple_(Bookedspot.entry_timing, Bookedspot.id) > tuple_(*key))
+    return query.order_by(Bookedspot.entry_timing, Bookedspot.id).limit(size)
+
+
+def accrue_costs(now):
+    # returns how many open bookings were priced
+    count = 0
+    key = None
+    while True:
+        rows = open_bookings_page(key).all()
+        if not rows:
+            return count
+        costs = price_stays([(row.lot_id, row.price, row.tariff_version, row.entry_timing, now) for row in rows])
+        db.session.execute(update(Bookedspot), [
+            {'id': row.id, 'accrued_cost': cost} for row, cost in zip(rows, costs)
+        ])
+        db.session.commit()
+        count += len(rows)
+        key = (rows[-1].entry_timing, rows[-1].id)
+
+
+def overstays_query(hours, limit=OVERSTAY_LIST_SIZE):
+    # flagged open bookings, longest parked first
+    return active_parkings_query().add_columns(
+        Bookedspot.accrued_cost, Bookedspot.overstay_at
+    ).filter(Bookedspot.entry_timing < datetime.now() - timedelta(hours=hours),
+             Bookedspot.overstay_at != None).order_by(Bookedspot.entry_timing).limit(limit)
+
+
+def flag_overstays(now, hours):
+    result = db.session.execute(
+        update(Bookedspot)
+        .where(Bookedspot.vehicle_released == False,
+               Bookedspot.entry_timing < now - timedelta(hours=hours),
+               Bookedspot.overstay_at == None)
+        .values(overstay_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def release_overstays(now, hours):
+    released = 0
+    while True:
+        rows = db.session.execute(
+            select(Bookedspot.vehicle_number, ParkingSpot.lot_id)
+            .join(ParkingSpot, ParkingSpot.id == Bookedspot.spot_id)
+            .where(Bookedspot.vehicle_released == False,
+                   Bookedspot.entry_timing < now - timedelta(hours=hours))
+            .order_by(Bookedspot.entry_timing).limit(SWEEP_BATCH)
+        ).all()
+        if not rows:
+            return released
+        results = process_gate_events([
+            {'type': 'exit', 'vehicle_number': row.vehicle_number, 'lot_id': row.lot_id,
+             'timestamp': now.isoformat()} for row in rows
+        ])
+        done = sum(1 for result in results if result['ok'])
+        if not done:
+            # nothing could be released (e.g. released meanwhile); try next round
+            return released
+        released += done
+
+
+def sweep(config, now=None):
+    now = now or datetime.now()
+    stats = {'released': 0}
+    if config['OVERSTAY_RELEASE_HOURS']:
+        stats['released'] = release_overstays(now, config['OVERSTAY_RELEASE_HOURS'])
+    stats['flagged'] = flag_overstays(now, config['OVERSTAY_HOURS'])
+    stats['accrued'] = accrue_costs(now)
+    stats['expired'] = expire_reservations(now, config['RESERVATION_GRACE_MINUTES'])
+    return stats
+
+
+class OverstaySweeper:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.owner = None
+        self.last_run = None
+        self.last_stats = None
+
+    def start(self, app):
+        with self._lock:
+            # a thread started before a fork does not run in the child
+            if self._thread is not None and self._thread.is_alive():
+                return
+            # named after the worker process, so taken here rather than at import
+            self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+            self._thread = threading.Thread(target=self._run, args=(app,), name='overstay-sweeper', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, app):
+        while not self._stop.wait(app.config['SWEEP_INTERVAL']):
+            self.tick(app)
+
+    def tick(self, app):
+        interval = app.config['SWEEP_INTERVAL']
+        with app.app_context():
+            try:
+                # the lease outlives a missed round so a slow sweep keeps it
+                if acquire_lease(SWEEPER_LOCK, self.owner, interval * 2 + 60):
+                    self.last_stats = sweep(app.config)
+                    self.last_run = datetime.now()
+                # the pool is per worker, so every worker checks its own
+                drifted = free_spot_pool.verify()
+                if drifted:
+                    app.logger.warning("Reloaded the free spot pool of %d lot(s): %s", len(drifted), drifted)
+            except Exception:
+                db.session.rollback()
+                app.logger.exception("Overstay sweep failed")
+            finally:
+                db.session.remove()
+
+
+overstay_sweeper = OverstaySweeper()
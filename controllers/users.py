@@ -0,0 +1,66 @@
+from sqlalchemy import and_, or_
+from models.models import db, User, ParkingSpot, Bookedspot
+
+# Admin user list: one page of users together with their active spot,
+# fetched with a single outer join. Pages are keyed on User.id so the cost
+# of a page does not grow with the number of users.
+
+USER_PAGE_SIZE = 25
+USER_MAX_PAGE_SIZE = 100
+
+
+def _prefix_range(column, prefix):
+    # prefix match written as a range so the column's index can be used
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return and_(column >= prefix, column < upper)
+
+
+def user_page_query(search, status, parked, after_id, size):
+    query = db.session.query(
+        User.id,
+        User.username,
+        User.name,
+        User.is_active_user,
+        ParkingSpot.id.label('spot_id'),
+        ParkingSpot.spot_number
+    ).outerjoin(Bookedspot, and_(Bookedspot.user_id == User.id, Bookedspot.vehicle_released == False)
+    ).outerjoin(ParkingSpot, ParkingSpot.id == Bookedspot.spot_id
+    ).filter(User.is_admin == False)
+
+    if search:
+        query = query.filter(or_(_prefix_range(User.username, search), _prefix_range(User.name, search)))
+    if status == 'active':
+        query = query.filter(User.is_active_user == True)
+    elif status == 'blocked':
+        query = query.filter(User.is_active_user == False)
+    if parked == 'yes':
+        query = query.filter(Bookedspot.id != None)
+    elif parked == 'no':
+        query = query.filter(Bookedspot.id == None)
+    if after_id is not None:
+        query = query.filter(User.id > after_id)
+
+    # one extra row tells us whether there is a next page
+    return query.order_by(User.id).limit(size + 1)
+
+
+def user_page(search=None, status=None, parked=None, after_id=None, size=USER_PAGE_SIZE):
+    # returns (users, next_after_id); next_after_id is None on the last page
+    rows = user_page_query(search, status, parked, after_id, size).all()
+
+    next_after_id = None
+    if len(rows) > size:
+        rows = rows[:size]
+        next_after_id = rows[-1].id
+
+    usermodel = []
+    for row in rows:
+        usermodel.append({
+            'id': row.id,
+            'username': row.username,
+            'name': row.name,
+            'spot_id': row.spot_id if row.spot_id is not None else "NA",
+            'spot_number': row.spot_number if row.spot_number is not None else "NA",
+            'deleted_spot': row.is_active_user
+        })
+    return usermodel, next_after_id
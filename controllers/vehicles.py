@@ -0,0 +1,71 @@
+import re
+from models.models import db, User, ParkingLot, ParkingSpot, Bookedspot
+from controllers.users import _prefix_range
+
+# Vehicle numbers and active parkings.
+# Plates are stored normalised (upper case, letters and digits only), so
+# "tn 01-ab 1234" and "TN01AB1234" are the same vehicle. Open bookings are
+# indexed on the plate by uq_open_booking_vehicle, which also allows a
+# vehicle only one open booking at a time; exact and prefix lookups are a
+# single range scan of that index.
+
+VEHICLE_SEARCH_LIMIT = 50
+
+_NOT_PLATE = re.compile(r'[^A-Z0-9]')
+
+
+def normalize_vehicle_number(vehicle_number):
+    # returns '' for input without any letters or digits
+    return _NOT_PLATE.sub('', (vehicle_number or '').upper())
+
+
+def active_parkings_query():
+    return db.session.query(
+        Bookedspot.id,
+        Bookedspot.vehicle_number,
+        Bookedspot.entry_timing,
+        Bookedspot.user_id,
+        User.username,
+        User.name,
+        ParkingSpot.id.label('spot_id'),
+        ParkingSpot.spot_number,
+        ParkingLot.id.label('lot_id'),
+        ParkingLot.lot_name,
+        ParkingLot.city
+    ).join(User, User.id == Bookedspot.user_id
+    ).join(ParkingSpot, ParkingSpot.id == Bookedspot.spot_id
+    ).join(ParkingLot, ParkingLot.id == ParkingSpot.lot_id
+    ).filter(Bookedspot.vehicle_released == False)
+
+
+def active_parking(vehicle_number):
+    # the open booking of a plate, or None
+    plate = normalize_vehicle_number(vehicle_number)
+    if not plate:
+        return None
+    return active_parkings_query().filter(Bookedspot.vehicle_number == plate).first()
+
+
+def search_active_parkings(partial, limit=VEHICLE_SEARCH_LIMIT):
+    plate = normalize_vehicle_number(partial)
+    if not plate:
+        return []
+    return active_parkings_query().filter(_prefix_range(Bookedspot.vehicle_number, plate)
+    ).order_by(Bookedspot.vehicle_number).limit(limit).all()
+
+
+def vehicle_parked(vehicle_number):
+    return db.session.query(
+        Bookedspot.query.filter_by(vehicle_number=vehicle_number, vehicle_released=False).exists()
+    ).scalar()
+
+
+def parking_json(row):
+    return {
+        'booking_id': row.id,
+        'vehicle_number': row.vehicle_number,
+        'entry': row.entry_timing.isoformat(),
+        'user': {'id': row.user_id, 'username': row.username, 'name': row.name},
+        'lot': {'id': row.lot_id, 'name': row.lot_name, 'city': row.city},
+        'spot': {'id': row.spot_id, 'number': row.spot_number}
+    }
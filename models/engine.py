@@ -0,0 +1,78 @@
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+# Engine profile: pool sizes per backend and the PRAGMAs every pooled
+# SQLite connection gets.
+# With the 'production' profile SQLite runs in WAL mode, so readers never
+# block the writer, and a busy_timeout makes a second writer wait for the
+# lock instead of failing with "database is locked". synchronous=NORMAL is
+# safe in WAL mode (a power cut can lose the last commits, never corrupt the
+# file). 'default' leaves SQLite's own settings alone.
+
+SQLITE_PROFILES = {
+    'production': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'mmap_size': 256 * 1024 * 1024,
+        # negative means KiB, so 64 MiB of page cache per connection
+        'cache_size': -64 * 1024,
+        'temp_store': 'MEMORY',
+    },
+    'safe': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'busy_timeout': 5000,
+    },
+    'default': {},
+}
+
+
+def _is_sqlite(uri):
+    return uri is not None and make_url(uri).get_backend_name() == 'sqlite'
+
+
+def _is_memory(uri):
+    return make_url(uri).database in (None, '', ':memory:')
+
+
+def sqlite_pragmas(config):
+    # the profile's PRAGMAs, overridden by SQLITE_PRAGMAS="name=value,..."
+    pragmas = dict(SQLITE_PROFILES[config['SQLITE_PROFILE']])
+    for item in (config.get('SQLITE_PRAGMAS') or '').split(','):
+        if '=' in item:
+            name, value = item.split('=', 1)
+            pragmas[name.strip()] = value.strip()
+    return pragmas
+
+
+def engine_options(config):
+    uri = config['SQLALCHEMY_DATABASE_URI']
+    pool_size = config.get('DB_POOL_SIZE')
+    max_overflow = config.get('DB_MAX_OVERFLOW')
+    if uri is None:
+        return {}
+    if _is_sqlite(uri):
+        if _is_memory(uri):
+            # Flask-SQLAlchemy shares one connection for in-memory databases
+            return {}
+        # one writer at a time anyway; a few connections for the readers
+        return {'pool_size': pool_size or 8, 'max_overflow': max_overflow or 8, 'pool_timeout': 30}
+    # client/server databases: more connections, and survive server restarts
+    return {'pool_size': pool_size or 10, 'max_overflow': max_overflow or 20,
+            'pool_pre_ping': True, 'pool_recycle': 1800}
+
+
+def install_sqlite_pragmas(engine, config):
+    if engine.dialect.name != 'sqlite' or _is_memory(str(engine.url)):
+        return
+    pragmas = sqlite_pragmas(config)
+    if not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
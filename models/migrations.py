@@ -0,0 +1,187 @@
+import warnings
+from sqlalchemy import inspect, text
+from datetime import datetime
+
+# Versioned schema migrations.
+# db.create_all() only creates missing tables, so every change to an
+# existing table (new columns, new indexes) is listed here with a version
+# number. Applied versions are recorded in the schema_version table and each
+# migration runs in its own transaction. A brand new database is created
+# from the models directly and stamped with the latest version.
+
+# rows per round trip for the migrations that rewrite data in Python
+MIGRATION_BATCH = 5000
+
+
+def _add_lot_counters(db, connection):
+    lot_columns = [column['name'] for column in inspect(connection).get_columns('parking_lot')]
+    for column in ['occupied_count', 'free_count', 'active_count']:
+        if column not in lot_columns:
+            connection.execute(text(f"ALTER TABLE parking_lot ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0"))
+    # fill the counters from the existing spots
+    connection.execute(text("""
+        UPDATE parking_lot SET
+            occupied_count = (SELECT COUNT(*) FROM parking_spot
+                              WHERE lot_id = parking_lot.id AND occupied_status = 1),
+            free_count = (SELECT COUNT(*) FROM parking_spot
+                          WHERE lot_id = parking_lot.id AND occupied_status = 0 AND deleted_spot = 1),
+            active_count = (SELECT COUNT(*) FROM parking_spot
+                            WHERE lot_id = parking_lot.id AND deleted_spot = 1)
+    """))
+
+
+def _create_indexes(*names):
+    def migration(db, connection):
+        indexes = {index.name: index for table in db.metadata.tables.values() for index in table.indexes}
+        with warnings.catch_warnings():
+            # checkfirst reflects the table's indexes, and SQLAlchemy cannot
+            # reflect expression indexes such as ix_parking_lot_city
+            warnings.filterwarnings('ignore', 'Skipped unsupported reflection of expression-based index')
+            for name in names:
+                indexes[name].create(bind=connection, checkfirst=True)
+    return migration
+
+
+def _booking_history_index(db, connection):
+    # supersedes the (user_id, vehicle_released) index of version 3
+    connection.execute(text("DROP INDEX IF EXISTS ix_bookedspot_user_released"))
+    _create_indexes('ix_bookedspot_user_history')(db, connection)
+
+
+def _add_retired_spots(db, connection):
+    spot_columns = [column['name'] for column in inspect(connection).get_columns('parking_spot')]
+    if 'retired' not in spot_columns:
+        connection.execute(text("ALTER TABLE parking_spot ADD COLUMN retired BOOLEAN NOT NULL DEFAULT 0"))
+
+
+def _add_occupancy_version(db, connection):
+    lot_columns = [column['name'] for column in inspect(connection).get_columns('parking_lot')]
+    if 'occupancy_version' not in lot_columns:
+        connection.execute(text("ALTER TABLE parking_lot ADD COLUMN occupancy_version INTEGER NOT NULL DEFAULT 0"))
+    if 'occupancy_updated_at' not in lot_columns:
+        connection.execute(text("ALTER TABLE parking_lot ADD COLUMN occupancy_updated_at DATETIME"))
+    connection.execute(text("UPDATE parking_lot SET occupancy_updated_at = :now WHERE occupancy_updated_at IS NULL"),
+                       {'now': datetime.now()})
+
+
+def _add_tariff_version(db, connection):
+    # the lot_tariff table itself comes from create_all()
+    lot_columns = [column['name'] for column in inspect(connection).get_columns('parking_lot')]
+    if 'tariff_version' not in lot_columns:
+        connection.execute(text("ALTER TABLE parking_lot ADD COLUMN tariff_version INTEGER NOT NULL DEFAULT 0"))
+
+
+def _add_overstay_columns(db, connection):
+    # the scheduler_lock table itself comes from create_all()
+    booking_columns = [column['name'] for column in inspect(connection).get_columns('bookedspot')]
+    if 'accrued_cost' not in booking_columns:
+        connection.execute(text("ALTER TABLE bookedspot ADD COLUMN accrued_cost FLOAT"))
+    if 'overstay_at' not in booking_columns:
+        connection.execute(text("ALTER TABLE bookedspot ADD COLUMN overstay_at DATETIME"))
+    _create_indexes('ix_open_booking_entry')(db, connection)
+
+
+def _add_lot_coordinates(db, connection):
+    lot_columns = [column['name'] for column in inspect(connection).get_columns('parking_lot')]
+    for column in ['latitude', 'longitude']:
+        if column not in lot_columns:
+            connection.execute(text(f"ALTER TABLE parking_lot ADD COLUMN {column} FLOAT"))
+    _create_indexes('ix_parking_lot_city', 'ix_parking_lot_pin_code')(db, connection)
+
+
+def _normalize_vehicle_numbers(db, connection):
+    # the same rule the app applies to new plates; read in id order and
+    # rewrite only the rows that change
+    from controllers.vehicles import normalize_vehicle_number
+    last_id = 0
+    while True:
+        rows = connection.execute(text(
+            "SELECT id, vehicle_number FROM bookedspot WHERE id > :last_id ORDER BY id LIMIT :size"
+        ), {'last_id': last_id, 'size': MIGRATION_BATCH}).all()
+        if not rows:
+            break
+        changed = []
+        for row in rows:
+            plate = normalize_vehicle_number(row.vehicle_number)
+            if plate != row.vehicle_number:
+                changed.append({'id': row.id, 'plate': plate})
+        if changed:
+            connection.execute(text("UPDATE bookedspot SET vehicle_number = :plate WHERE id = :id"), changed)
+        last_id = rows[-1].id
+    duplicates = connection.execute(text(
+        "SELECT vehicle_number FROM bookedspot WHERE vehicle_released = 0 "
+        "GROUP BY vehicle_number HAVING COUNT(*) > 1"
+    )).scalars().all()
+    if duplicates:
+        raise RuntimeError("Release the duplicate open bookings of these vehicles first: " + ", ".join(duplicates))
+    _create_indexes('uq_open_booking_vehicle')(db, connection)
+
+
+def _backfill_rollups(db, connection):
+    # the tables themselves come from create_all()
+    from controllers.rollups import rebuild_rollups
+    rebuild_rollups(connection)
+
+
+MIGRATIONS = [
+    (1, "occupancy counters on parking_lot", _add_lot_counters),
+    (2, "one open booking per user and per spot",
+     _create_indexes('uq_open_booking_user', 'uq_open_booking_spot')),
+    (3, "indexes for the hot filter columns",
+     _create_indexes('ix_parking_spot_lot_status', 'ix_bookedspot_spot',
+                     'ix_bookedspot_entry_timing', 'ix_user_active')),
+    (4, "booking history index on (user_id, vehicle_released, exit_timing)", _booking_history_index),
+    (5, "name index for the admin user search", _create_indexes('ix_user_name')),
+    (6, "retired flag on parking_spot", _add_retired_spots),
+    (7, "usage rollups for the summary dashboards", _backfill_rollups),
+    (8, "occupancy version on parking_lot", _add_occupancy_version),
+    (9, "normalised vehicle numbers, one open booking per vehicle", _normalize_vehicle_numbers),
+    (10, "lot tariffs", _add_tariff_version),
+    (11, "overstay sweeper columns and open booking entry index", _add_overstay_columns),
+    (12, "lot coordinates and lot search indexes", _add_lot_coordinates),
+]
+
+
+def _ensure_version_table(connection):
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description VARCHAR(256) NOT NULL,
+            applied_at DATETIME NOT NULL
+        )
+    """))
+
+
+def _record(connection, version, description):
+    connection.execute(
+        text("INSERT INTO schema_version (version, description, applied_at) VALUES (:version, :description, :applied_at)"),
+        {'version': version, 'description': description, 'applied_at': datetime.now()}
+    )
+
+
+def current_version(connection):
+    return connection.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+
+
+def migrate(db):
+    # returns the (version, description) pairs that were applied
+    fresh = not inspect(db.engine).has_table('parking_lot')
+    db.create_all()
+
+    with db.engine.begin() as connection:
+        _ensure_version_table(connection)
+        version = current_version(connection)
+        if fresh and version == 0:
+            for number, description, _ in MIGRATIONS:
+                _record(connection, number, description)
+            return []
+
+    applied = []
+    for number, description, migration in MIGRATIONS:
+        if number <= version:
+            continue
+        with db.engine.begin() as connection:
+            migration(db, connection)
+            _record(connection, number, description)
+        applied.append((number, description))
+    return applied
@@ -1,8 +1,9 @@
-from app import app 
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 from werkzeug.security import generate_password_hash
-db = SQLAlchemy(app)
+from sqlalchemy import text
+from models.migrations import migrate
+db = SQLAlchemy()
 
 class User(db.Model):
     id = db.Column(db.Integer , primary_key = True)
@@ -12,6 +13,12 @@ class User(db.Model):
     is_admin = db.Column(db.Boolean, nullable = False , default = False)
     is_active_user = db.Column(db.Boolean, nullable = False , default = True)
 
+    __table_args__ = (
+        db.Index('ix_user_active', 'is_active_user', 'is_admin'),
+        # prefix search on the admin user list (username is already unique)
+        db.Index('ix_user_name', 'name'),
+    )
+
     # spots where the users have acquired or booked the spot 
     acquired_spot = db.relationship("Bookedspot", backref="user", lazy='dynamic',cascade='all, delete-orphan')
 
@@ -26,8 +33,32 @@ class ParkingLot(db.Model):
     available_parking_spots = db.Column(db.Integer, nullable = False)
     deleted_lot = db.Column(db.Boolean, nullable = False, default = False)
 
+    # denormalized spot counters, kept in step with ParkingSpot by every
+    # booking, release and activation toggle (see controllers/occupancy.py)
+    occupied_count = db.Column(db.Integer, nullable = False, default = 0, server_default = '0')
+    free_count = db.Column(db.Integer, nullable = False, default = 0, server_default = '0')
+    active_count = db.Column(db.Integer, nullable = False, default = 0, server_default = '0')
+    # bumped with every counter change; the API derives ETag/Last-Modified from them
+    occupancy_version = db.Column(db.Integer, nullable = False, default = 0, server_default = '0')
+    occupancy_updated_at = db.Column(db.DateTime, nullable = True, default = datetime.now)
+    # bumped whenever the lot's tariff is saved (see controllers/billing.py)
+    tariff_version = db.Column(db.Integer, nullable = False, default = 0, server_default = '0')
+    # optional, in degrees; lots without them are left out of distance searches
+    latitude = db.Column(db.Float, nullable = True)
+    longitude = db.Column(db.Float, nullable = True)
+
     # each parking lot will have many parking spots
     parking_spot = db.relationship("ParkingSpot", backref="parking_lot", lazy=True,cascade="all, delete",)
+    # optional pricing rules, deleted with the lot
+    tariff = db.relationship("LotTariff", uselist=False, lazy=True, cascade="all, delete-orphan")
+    # advance reservations of the lot's spots, deleted with the lot
+    reservations = db.relationship("Reservation", lazy=True, cascade="all, delete")
+
+    # lot search by city (case-insensitive) and pin code prefix (see controllers/geo.py)
+    __table_args__ = (
+        db.Index('ix_parking_lot_city', db.func.lower(city)),
+        db.Index('ix_parking_lot_pin_code', 'pin_code'),
+    )
 
 
 class ParkingSpot(db.Model):
@@ -37,9 +68,16 @@ class ParkingSpot(db.Model):
     occupied_status = db.Column(db.Boolean , nullable = False , default = False)
     spot_number = db.Column(db.String(6), nullable = False)
     deleted_spot = db.Column(db.Boolean,default=True,nullable = False)
+    # spots cut off by shrinking the lot; kept (deactivated) for their history
+    retired = db.Column(db.Boolean, nullable = False, default = False, server_default = '0')
     # each parking spot can be booked many times
     booked_spots = db.relationship("Bookedspot", backref="parking_spot", lazy=True,cascade="all, delete",)
 
+    # spot grids, free-spot lookups and counts all filter on the lot first
+    __table_args__ = (
+        db.Index('ix_parking_spot_lot_status', 'lot_id', 'occupied_status', 'deleted_spot'),
+    )
+
 
 # spots where the users have acquired or booked the spot 
 class Bookedspot(db.Model):
@@ -52,14 +90,108 @@ class Bookedspot(db.Model):
     exit_timing = db.Column(db.DateTime, nullable=True)
 
     parking_cost = db.Column(db.Float, nullable=True)
+    # stored normalised, see controllers/vehicles.py
     vehicle_number = db.Column(db.String(64), nullable = False)
     vehicle_released = db.Column(db.Boolean, nullable = False , default = False)
-with app.app_context():
-    db.create_all()
+    # kept up to date by the overstay sweeper while the booking is open (see controllers/sweeper.py)
+    accrued_cost = db.Column(db.Float, nullable = True)
+    overstay_at = db.Column(db.DateTime, nullable = True)
+
+    # a user, a spot and a vehicle can each have at most one open (unreleased) booking
+    __table_args__ = (
+        db.Index('uq_open_booking_user', 'user_id', unique=True,
+                 sqlite_where=text('vehicle_released = 0'), postgresql_where=text('NOT vehicle_released')),
+        db.Index('uq_open_booking_spot', 'spot_id', unique=True,
+                 sqlite_where=text('vehicle_released = 0'), postgresql_where=text('NOT vehicle_released')),
+        # also serves the plate lookup and prefix search of active parkings
+        db.Index('uq_open_booking_vehicle', 'vehicle_number', unique=True,
+                 sqlite_where=text('vehicle_released = 0'), postgresql_where=text('NOT vehicle_released')),
+        # also serves the keyset-paginated booking history
+        db.Index('ix_bookedspot_user_history', 'user_id', 'vehicle_released', 'exit_timing'),
+        db.Index('ix_bookedspot_spot', 'spot_id'),
+        # covers the monthly revenue report without touching the table
+        db.Index('ix_bookedspot_entry_timing', 'entry_timing', 'parking_cost'),
+        # the sweeper's range query for long open bookings
+        db.Index('ix_open_booking_entry', 'entry_timing',
+                 sqlite_where=text('vehicle_released = 0'), postgresql_where=text('NOT vehicle_released')),
+    )
+
+
+# a spot held for a future time window [start_time, end_time) (see controllers/reservations.py)
+class Reservation(db.Model):
+    id = db.Column(db.Integer, primary_key = True)
+    lot_id = db.Column(db.Integer, db.ForeignKey(ParkingLot.id), nullable = False)
+    spot_id = db.Column(db.Integer, db.ForeignKey(ParkingSpot.id), nullable = False)
+    user_id = db.Column(db.Integer, db.ForeignKey(User.id), nullable = False)
+    # stored normalised, see controllers/vehicles.py
+    vehicle_number = db.Column(db.String(64), nullable = False)
+    start_time = db.Column(db.DateTime, nullable = False)
+    end_time = db.Column(db.DateTime, nullable = False)
+    # 'reserved' -> 'checked_in' (with booking_id) -> 'completed', or 'cancelled' / 'expired'
+    status = db.Column(db.String(16), nullable = False, default = 'reserved')
+    booking_id = db.Column(db.Integer, db.ForeignKey(Bookedspot.id), nullable = True)
+    created_at = db.Column(db.DateTime, nullable = False, default = datetime.now)
+
+    # overlap checks only read the windows that end after the one asked about,
+    # so past reservations never slow them down
+    __table_args__ = (
+        db.Index('ix_reservation_spot_end', 'spot_id', 'end_time'),
+        db.Index('ix_reservation_lot_end', 'lot_id', 'end_time'),
+        db.Index('ix_reservation_user_end', 'user_id', 'end_time'),
+        db.Index('ix_reservation_booking', 'booking_id'),
+        # the sweeper's scan for no-shows
+        db.Index('ix_reservation_status_start', 'status', 'start_time'),
+    )
+
+
+# optional pricing rules on top of the lot's hourly price; empty columns are off
+class LotTariff(db.Model):
+    lot_id = db.Column(db.Integer, db.ForeignKey(ParkingLot.id), primary_key = True)
+    first_hour_rate = db.Column(db.Float, nullable = True)
+    night_rate = db.Column(db.Float, nullable = True)
+    # night hours are night_start <= hour < night_end, wrapping past midnight
+    night_start = db.Column(db.Integer, nullable = False, default = 22)
+    night_end = db.Column(db.Integer, nullable = False, default = 6)
+    # most a stay is charged per 24 hours
+    daily_cap = db.Column(db.Float, nullable = True)
+    # stays this short are free
+    grace_minutes = db.Column(db.Integer, nullable = False, default = 0)
+
+
+# pre-aggregated usage for the summary dashboards (see controllers/rollups.py)
+class LotDailyUsage(db.Model):
+    lot_id = db.Column(db.Integer, db.ForeignKey(ParkingLot.id), primary_key = True)
+    day = db.Column(db.Date, primary_key = True)
+    bookings = db.Column(db.Integer, nullable = False, default = 0)
+    released = db.Column(db.Integer, nullable = False, default = 0)
+    revenue = db.Column(db.Float, nullable = False, default = 0)
+
+
+class UserMonthlyUsage(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey(User.id), primary_key = True)
+    # 'YYYY-MM' of the booking's entry time
+    month = db.Column(db.String(7), primary_key = True)
+    bookings = db.Column(db.Integer, nullable = False, default = 0)
+    expenditure = db.Column(db.Float, nullable = False, default = 0)
+
+
+# leases for jobs that only one worker may run at a time
+class SchedulerLock(db.Model):
+    name = db.Column(db.String(64), primary_key = True)
+    owner = db.Column(db.String(64), nullable = False)
+    expires_at = db.Column(db.DateTime, nullable = False)
+
+
+# `flask init-db`: create or upgrade the schema, and the admin account on a
+# database without one. Returns (applied migrations, admin created).
+def init_db():
+    applied = migrate(db)
     #checking if it is not admin 
     admin = User.query.filter_by(is_admin=True).first()
-    if not admin:
-        password = generate_password_hash('admin')
-        admin = User(username = 'admin',passhash = password , name = 'Admin', is_admin = True)
-        db.session.add(admin)
-        db.session.commit()
\ No newline at end of file
+    if admin:
+        return applied, False
+    password = generate_password_hash('admin')
+    admin = User(username = 'admin',passhash = password , name = 'Admin', is_admin = True)
+    db.session.add(admin)
+    db.session.commit()
+    return applied, True
\ No newline at end of file
@@ -0,0 +1,60 @@
+import os
+import sys
+import pytest
+
+# the modules are imported from the repository root, as the app does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from models.models import db, init_db
+from controllers.billing import tariff_book
+from controllers.geo import lot_grid
+from controllers.reservations import reservation_index
+from controllers.spot_pool import free_spot_pool
+
+
+def reset_worker_state():
+    # the per-worker indexes outlive an app; every test starts on a new
+    # database whose ids overlap the previous one's
+    free_spot_pool.__init__()
+    reservation_index.__init__()
+    lot_grid.__init__()
+    tariff_book.clear()
+
+
+@pytest.fixture
+def app(tmp_path):
+    # a file-backed database, so threads see each other's commits
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'test.db'}",
+        'SECRET_KEY': 'test',
+        'SWEEPER_ENABLED': False,
+    })
+    reset_worker_state()
+    with app.app_context():
+        init_db()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def admin_client(app):
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin'})
+    return client
+
+
+def login(app, username, password='p'):
+    # registers the user on first use
+    client = app.test_client()
+    client.post('/register', data={'username': username, 'password': password,
+                                   'recheck_password': password, 'fullname': username})
+    client.post('/login', data={'username': username, 'password': password})
+    return client
+
+
+def create_lot(admin_client, spots, name='Lot', pin_code='600000', city='Chennai', price=10):
+    admin_client.post('/create_lot', data={'location_name': name, 'pin_code': pin_code, 'adress': city,
+                                           'price': str(price), 'spots': str(spots)})
@@ -0,0 +1,110 @@
+import threading
+from sqlalchemy import func
+from werkzeug.security import generate_password_hash
+from models.models import db, User, ParkingSpot, Bookedspot
+from controllers.allocation import BookingError, claim_spot, claim_first_free_spot
+from controllers.occupancy import check_lot_counters
+from controllers.spot_pool import free_spot_pool
+from controllers.sweeper import overstay_sweeper
+from conftest import create_lot
+
+
+def make_users(count):
+    passhash = generate_password_hash('p')
+    users = [User(username=f'driver{i}', passhash=passhash, name='Driver') for i in range(count)]
+    db.session.add_all(users)
+    db.session.commit()
+    return [user.id for user in users]
+
+
+def race(app, calls):
+    # runs every call at once, each in its own thread and session;
+    # returns the spot ids booked and how many calls were refused
+    barrier = threading.Barrier(len(calls))
+    booked, refused = [], []
+
+    def run(call):
+        with app.app_context():
+            try:
+                barrier.wait()
+                booked.append(call().spot_id)
+            except BookingError:
+                refused.append(call)
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=run, args=(call,)) for call in calls]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return booked, len(refused)
+
+
+def assert_consistent():
+    open_per_spot = db.session.query(Bookedspot.spot_id, func.count()).filter_by(
+        vehicle_released=False).group_by(Bookedspot.spot_id).all()
+    assert all(count == 1 for _, count in open_per_spot)
+    occupied = {spot_id for (spot_id,) in db.session.query(ParkingSpot.id).filter_by(occupied_status=True)}
+    assert occupied == {spot_id for spot_id, _ in open_per_spot}
+    assert check_lot_counters() == []
+    assert free_spot_pool.verify(repair=False) == []
+
+
+def test_one_booking_per_spot(app, admin_client):
+    create_lot(admin_client, 5)
+    with app.app_context():
+        users = make_users(20)
+    booked, refused = race(app, [
+        lambda user_id=user_id: claim_spot(user_id, 1, f'TN01AA{user_id:04d}') for user_id in users
+    ])
+    assert booked == [1]
+    assert refused == 19
+    with app.app_context():
+        assert_consistent()
+
+
+def test_auto_allocation_hands_out_each_spot_once(app, admin_client):
+    create_lot(admin_client, 10)
+    with app.app_context():
+        users = make_users(30)
+    booked, refused = race(app, [
+        lambda user_id=user_id: claim_first_free_spot(user_id, 1, f'TN01AA{user_id:04d}') for user_id in users
+    ])
+    assert sorted(booked) == list(range(1, 11))
+    assert refused == 20
+    with app.app_context():
+        assert_consistent()
+
+
+def test_direct_and_auto_claims_race(app, admin_client):
+    create_lot(admin_client, 4)
+    with app.app_context():
+        users = make_users(24)
+    calls = []
+    for index, user_id in enumerate(users):
+        if index % 2:
+            calls.append(lambda user_id=user_id: claim_spot(user_id, 1 + user_id % 4, f'TN01AA{user_id:04d}'))
+        else:
+            calls.append(lambda user_id=user_id: claim_first_free_spot(user_id, 1, f'TN01AA{user_id:04d}'))
+    booked, refused = race(app, calls)
+    assert len(booked) == len(set(booked)) == 4
+    assert refused == 20
+    with app.app_context():
+        assert_consistent()
+
+
+def test_sweeper_tick_reloads_a_drifted_pool(app, admin_client, monkeypatch):
+    monkeypatch.setattr(overstay_sweeper, 'owner', 'test-worker')
+    create_lot(admin_client, 5)
+    with app.app_context():
+        assert free_spot_pool.next_free(1) == (1, 'P001')
+    # spot 2 dropped from the pool, and spot 3 booked through another worker
+    free_spot_pool.discard(1, 2)
+    with app.app_context():
+        db.session.query(ParkingSpot).filter_by(id=3).update({'occupied_status': True})
+        db.session.commit()
+        assert free_spot_pool.verify(repair=False) == [(1, 4, 4)]
+    overstay_sweeper.tick(app)
+    with app.app_context():
+        assert free_spot_pool.verify(repair=False) == []
@@ -0,0 +1,104 @@
+import random
+from datetime import datetime, timedelta
+from math import ceil
+import pytest
+from models.models import LotTariff
+from controllers.billing import CompiledTariff
+
+# The compiled lookup tables against a plain hour-by-hour reference. Rates
+# are multiples of 0.25, so both sums are exact and must agree to the cent.
+
+RATES = [0.0, 5.0, 7.25, 10.0, 12.5, 20.0, 33.75]
+
+
+def night_hours(night_start, night_end):
+    hours = set()
+    hour = night_start
+    while hour != night_end:
+        hours.add(hour)
+        hour = (hour + 1) % 24
+    return hours
+
+
+def reference_cost(price, tariff, entry_timing, exit_timing):
+    # every started hour at the rate of the clock hour it starts in, the
+    # first hour of the stay at the first-hour rate, each 24 hours capped
+    seconds = (exit_timing - entry_timing).total_seconds()
+    if tariff is not None and seconds <= tariff.grace_minutes * 60:
+        return 0.0
+    night = night_hours(tariff.night_start, tariff.night_end) if tariff is not None else set()
+    hours = ceil(seconds / 3600)
+    total = 0.0
+    for day_start in range(0, hours, 24):
+        day = 0.0
+        for k in range(day_start, min(day_start + 24, hours)):
+            if k == 0 and tariff is not None and tariff.first_hour_rate is not None:
+                day += tariff.first_hour_rate
+            elif tariff is not None and tariff.night_rate is not None \
+                    and (entry_timing + timedelta(hours=k)).hour in night:
+                day += tariff.night_rate
+            else:
+                day += price
+        if tariff is not None and tariff.daily_cap is not None:
+            day = min(day, tariff.daily_cap)
+        total += day
+    return round(total, 2)
+
+
+def random_tariff(rng):
+    if rng.random() < 0.15:
+        return None
+    night_start = rng.randrange(24)
+    return LotTariff(
+        first_hour_rate=rng.choice([None, *RATES]),
+        night_rate=rng.choice([None, *RATES]),
+        night_start=night_start,
+        # now and then an empty night window (start == end)
+        night_end=rng.choice([night_start, rng.randrange(24)]),
+        daily_cap=rng.choice([None, None, 25.0, 60.5, 150.0]),
+        grace_minutes=rng.choice([0, 0, 10, 15, 60]),
+    )
+
+
+def random_stay(rng, tariff):
+    day = datetime(2026, 3, 1) + timedelta(days=rng.randrange(60))
+    if tariff is not None and rng.random() < 0.3:
+        # start right on a night boundary, or a minute either side of it
+        hour = rng.choice([tariff.night_start, tariff.night_end])
+        entry_timing = day + timedelta(hours=hour, minutes=rng.choice([-1, 0, 1]))
+    else:
+        entry_timing = day + timedelta(hours=rng.randrange(24), minutes=rng.randrange(60),
+                                       seconds=rng.randrange(60))
+    kind = rng.random()
+    if kind < 0.2:
+        # whole hours and whole days, where the tables switch rows
+        duration = timedelta(hours=rng.choice([1, 23, 24, 25, 47, 48, 49, 72]))
+    elif kind < 0.3:
+        # around the grace period
+        duration = timedelta(minutes=rng.choice([0, 1, 10, 15, 59, 60, 61]), seconds=rng.choice([0, 1]))
+    else:
+        duration = timedelta(seconds=rng.randrange(1, 5 * 24 * 3600))
+    return entry_timing, entry_timing + duration
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_compiled_tables_match_reference(seed):
+    rng = random.Random(seed)
+    for _ in range(200):
+        price = rng.choice(RATES[1:])
+        tariff = random_tariff(rng)
+        compiled = CompiledTariff(price, tariff)
+        stays = [random_stay(rng, tariff) for _ in range(50)]
+        expected = [reference_cost(price, tariff, entry_timing, exit_timing) for entry_timing, exit_timing in stays]
+        assert compiled.costs(stays) == expected, (price, tariff and vars(tariff), stays)
+        assert [compiled.cost(*stay) for stay in stays] == expected
+
+
+def test_night_window_wraps_midnight():
+    tariff = LotTariff(first_hour_rate=None, night_rate=2.0, night_start=22, night_end=6,
+                       daily_cap=None, grace_minutes=0)
+    compiled = CompiledTariff(10.0, tariff)
+    # 21:30 to 23:30: one day hour (21) and one night hour (22)
+    assert compiled.cost(datetime(2026, 3, 1, 21, 30), datetime(2026, 3, 1, 23, 30)) == 12.0
+    # 05:00 to 07:00: night hour 5, day hour 6
+    assert compiled.cost(datetime(2026, 3, 1, 5), datetime(2026, 3, 1, 7)) == 12.0
@@ -0,0 +1,25 @@
+import pytest
+from controllers.gate import process_gate_events
+from conftest import create_lot, login
+
+
+@pytest.mark.parametrize('lot_id', [True, False, '1', 1.0])
+def test_lot_id_must_be_an_integer(app, admin_client, lot_id):
+    create_lot(admin_client, 2)
+    login(app, 'driver')
+    with app.app_context():
+        [result] = process_gate_events([{'type': 'entry', 'vehicle_number': 'TN01AB1234', 'lot_id': lot_id,
+                                        'username': 'driver'}])
+    assert result == {'index': 0, 'type': 'entry', 'ok': False, 'error': "lot_id must be a number."}
+
+
+def test_entry_and_exit(app, admin_client):
+    create_lot(admin_client, 2, price=10)
+    login(app, 'driver')
+    with app.app_context():
+        [entry] = process_gate_events([{'type': 'entry', 'vehicle_number': 'tn 01 ab 1234', 'lot_id': 1,
+                                        'username': 'driver', 'timestamp': '2026-03-01T10:00:00'}])
+        [exit] = process_gate_events([{'type': 'exit', 'vehicle_number': 'TN01AB1234',
+                                       'timestamp': '2026-03-01T12:30:00'}])
+    assert entry['ok'] and entry['spot_number'] == 'P001'
+    assert exit['ok'] and exit['booking_id'] == entry['booking_id'] and exit['cost'] == 30.0
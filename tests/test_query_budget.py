@@ -0,0 +1,77 @@
+import pytest
+from contextlib import contextmanager
+from sqlalchemy import event
+from models.models import db
+from conftest import create_lot, login
+
+# Statements per request on the dashboard and lot views (see
+# controllers/occupancy.py). Each view reads every lot's counts in one
+# query, so these do not grow with the number of lots; a view that goes
+# over its budget has picked up a query per lot or per row.
+VIEW_BUDGETS = {
+    '/user_dashboard': 4,
+    '/spot_list': 1,
+    '/admin': 6,
+    '/lot_list': 2,
+    '/see_spots/1': 2,
+    '/admin_summary': 4,
+    '/user_list': 4,
+}
+ADMIN_VIEWS = ('/admin', '/lot_list', '/see_spots/1', '/admin_summary', '/user_list')
+# booking and releasing a spot through the JSON API
+BOOK_BUDGET = 13
+RELEASE_BUDGET = 16
+
+
+@contextmanager
+def count_statements(app):
+    counter = {'statements': 0}
+
+    def count(*args, **kwargs):
+        counter['statements'] += 1
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'after_cursor_execute', count)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'after_cursor_execute', count)
+
+
+def view_statements(app, admin_client, user_client, path):
+    client = admin_client if path in ADMIN_VIEWS else user_client
+    with count_statements(app) as counter:
+        assert client.get(path).status_code == 200
+    return counter['statements']
+
+
+@pytest.mark.parametrize('lots', [3, 20])
+def test_views_stay_within_budget(app, admin_client, lots):
+    for index in range(lots):
+        create_lot(admin_client, 5, name=f'Lot {index}')
+    user_client = login(app, 'driver')
+    user_client.post('/book_this_spot/2', data={'vehicle_number': 'TN01AB1234'})
+
+    over = {}
+    for path, budget in VIEW_BUDGETS.items():
+        # the first request may fill the view cache, the second reads it
+        for _ in range(2):
+            statements = view_statements(app, admin_client, user_client, path)
+            if statements > budget:
+                over[path] = statements
+    assert over == {}
+
+
+def test_booking_and_release_stay_within_budget(app, admin_client):
+    create_lot(admin_client, 5)
+    user_client = login(app, 'driver')
+    with count_statements(app) as counter:
+        response = user_client.post('/api/v1/bookings', json={'lot_id': 1, 'vehicle_number': 'TN01AB1234'})
+    assert response.status_code == 201
+    assert counter['statements'] <= BOOK_BUDGET
+
+    with count_statements(app) as counter:
+        response = user_client.post(f"/api/v1/bookings/{response.get_json()['id']}/release")
+    assert response.status_code == 200
+    assert counter['statements'] <= RELEASE_BUDGET
@@ -0,0 +1,18 @@
+from sqlalchemy import text
+from controllers import query_plans
+from controllers.query_plans import full_scans, plan_engine
+
+
+def test_hot_queries_use_an_index(app):
+    with app.app_context():
+        assert full_scans() == []
+
+
+def test_a_dropped_index_is_reported(app, monkeypatch):
+    # on a plan schema of its own, so the cached one keeps its indexes
+    monkeypatch.setattr(query_plans, '_plan_engine', None)
+    with app.app_context():
+        with plan_engine().begin() as connection:
+            connection.execute(text("DROP INDEX ix_parking_spot_lot_status"))
+        scans = dict(full_scans())
+    assert 'free spots of a lot' in scans